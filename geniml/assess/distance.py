@@ -8,8 +8,13 @@ from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 
-from ..utils import natural_chr_sort
-from .utils import check_if_uni_flexible, check_if_uni_sorted, prep_data, process_db_line
+from .utils import (
+    check_if_uni_flexible,
+    check_if_uni_sorted,
+    chrom_cmp_bigger,
+    prep_data,
+    process_db_line,
+)
 
 
 def flexible_distance_between_two_regions(region, query):
@@ -120,7 +125,7 @@ def read_in_new_universe_regions(
             waiting = False
             db_queue.append(unused_db[-1][0])
             unused_db.clear()
-        elif natural_chr_sort(unused_db[-1][1], current_chrom) == 1:
+        elif chrom_cmp_bigger(unused_db[-1][1], current_chrom):
             # chrom present in file not in DB
             waiting = True
             return waiting, current_chrom
@@ -131,7 +136,7 @@ def read_in_new_universe_regions(
             d_start, d_start_chrom = process_db_line(d, pos_index)
             if d_start_chrom == current_chrom:
                 db_queue.append(d_start)
-            elif natural_chr_sort(d_start_chrom, current_chrom) == 1:
+            elif chrom_cmp_bigger(d_start_chrom, current_chrom):
                 unused_db.append([d_start, d_start_chrom])
                 waiting = True
                 return waiting, current_chrom
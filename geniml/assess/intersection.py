@@ -8,14 +8,12 @@ from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 
-from ..utils import natural_chr_sort
-from .utils import check_if_uni_sorted, prep_data, process_line
+from .utils import CHROMOSOMES, check_if_uni_sorted, prep_data, process_line
 
 
 def chrom_cmp(a, b):
     """Return smaller chromosome name"""
-    c = natural_chr_sort(a, b)
-    if c > 0:
+    if CHROMOSOMES.compare(a, b) > 0:
         return b, True, False
     else:
         return a, False, True
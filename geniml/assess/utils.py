@@ -2,25 +2,26 @@ import os
 import shlex
 import subprocess
 import tempfile
-from subprocess import PIPE, Popen
+
+from ..io.bed_index import iter_bed_chunks
+from ..io.chromosomes import ChromosomeDictionary
+from ..io.io import RegionSet
+
+# chromosome ranks shared by the sweeps over sorted files
+CHROMOSOMES = ChromosomeDictionary()
 
 
 def prep_data(folder, file, tmp_file):
     """File sort and merge"""
     fin = os.path.join(folder, file)
-    stdin_1 = None
-    if ".gz" in file:
-        command0 = f"zcat {fin}"
-        fin = ""
-        p0 = Popen(shlex.split(command0), stdout=PIPE)
-        stdin_1 = p0.stdout
-    command1 = f"sort -k1,1V -k2,2n {fin}"
-    command2 = "bedtools merge"
-    p1 = Popen(shlex.split(command1), stdin=stdin_1, stdout=PIPE)
-    p2 = Popen(shlex.split(command2), stdin=p1.stdout, stdout=PIPE)
-    p1.stdout.close()  # Allow p1 to receive a SIGPIPE if p2 exits.
-    output = p2.communicate()[0]
-    tmp_file.write(output)
+    if next(iter_bed_chunks(fin, 1), None) is None:
+        # files without records once decompressed (e.g. empty or header-only files) give an
+        # empty query, as with `zcat | sort | bedtools merge`
+        tmp_file.seek(0)
+        return
+    merged = RegionSet(fin).merge()
+    output = merged.to_pandas().to_csv(sep="\t", header=False, index=False)
+    tmp_file.write(output.encode("utf-8"))
     tmp_file.seek(0)
 
 
@@ -51,20 +52,7 @@ def process_line(line):
 
 def chrom_cmp_bigger(a, b):
     """Natural check if chromosomes name is bigger"""
-    ac = a.replace("chr", "")
-    ac = ac.split("_")[0]
-    bc = b.replace("chr", "")
-    bc = bc.split("_")[0]
-    if bc.isnumeric() and ac.isnumeric() and bc != ac:
-        if int(bc) < int(ac):
-            return True
-        else:
-            return False
-    else:
-        if b < a:
-            return True
-        else:
-            return False
+    return CHROMOSOMES.compare(a, b) > 0
 
 
 def process_db_line(dn, pos_index):
@@ -128,14 +128,17 @@ class BBClient(BedCacheManager):
 
         return RegionSet(regions=file_path)
 
-    def add_bedset_to_cache(self, bedset: BedSet) -> str:
+    def add_bedset_to_cache(self, bedset: BedSet, workers: int = 1) -> str:
         """
         Add a BED set to the cache
 
         :param bedset: the BED set to be added, a BedSet class
+        :param workers: number of processes used to compute the identifiers of the BED files
         :return: the identifier if the BedSet object
         """
 
+        # hash all BED files up front, so they can be hashed in parallel
+        bedset.compute_bed_identifiers(workers=workers)
         bedset_id = bedset.compute_bedset_identifier()
         file_path = self._bedset_path(bedset_id)
         if os.path.exists(file_path):
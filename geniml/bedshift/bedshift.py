@@ -12,6 +12,7 @@ import pandas as pd
 
 from geniml.bedshift import BedshiftYAMLHandler, arguments
 from geniml.bedshift._version import __version__
+from geniml.io.io import RegionSet
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -437,23 +438,24 @@ class Bedshift(object):
             comparison_bed = self.read_bed(fp)
         else:
             raise Exception("unsupported input type: {}".format(type(reference)))
-        reference_bed.columns = ["Chromosome", "Start", "End", "modifications"]
-        comparison_bed.columns = ["Chromosome", "Start", "End", "modifications"]
-        # TODO, switch this overlap calculation to use genomicranges
-        raise NotImplementedError(
-            "This relies on pyranges, which was removed with the switch to geniml."
+        reference_set = RegionSet.from_arrays(
+            reference_bed[0].astype(str),
+            reference_bed[1].astype(int),
+            reference_bed[2].astype(int),
         )
-
-        # USE AILIST HERE:
-        reference_pr = pr.PyRanges(reference_bed)
-        comparison_pr = pr.PyRanges(comparison_bed)
-        intersection = reference_pr.overlap(comparison_pr, how="first").as_df()
-        if len(intersection) == 0:
+        comparison_set = RegionSet.from_arrays(
+            comparison_bed[0].astype(str),
+            comparison_bed[1].astype(int),
+            comparison_bed[2].astype(int),
+        )
+        overlapping = reference_set.count_overlaps(comparison_set) > 0
+        if not overlapping.any():
             raise Exception(
                 "no intersection found between {} and {}".format(reference_bed, comparison_bed)
             )
-        intersection = intersection.drop(["modifications"], axis=1)
-        intersection.columns = [0, 1, 2]
+        intersection = reference_bed.loc[overlapping, [0, 1, 2]].reset_index(drop=True)
+        intersection[1] = intersection[1].astype(int)
+        intersection[2] = intersection[2].astype(int)
         return intersection
 
     def all_perturbations(
@@ -259,7 +259,7 @@ def main(test_args=None):
             seed=args.seed,
         )
     if args.command == "tokenize":
-        from .tokenization import hard_tokenization
+        from .tokenization.main import hard_tokenization_main as hard_tokenization
 
         hard_tokenization(
             src_folder=args.data_folder,
@@ -5,6 +5,7 @@ from typing import Dict, List, Tuple, Union
 import numpy as np
 from gensim.models import Word2Vec
 
+from ..io.io import EmbeddingSet
 from ..region2vec import Region2VecExModel
 
 
@@ -136,15 +137,22 @@ def save_base_embeddings(base_embed_obj: BaseEmbeddings, file_name: str) -> None
 
 
 def load_base_embeddings(path: str) -> Tuple[np.ndarray, List[str]]:
-    """Loads a BaseEmbeddings object.
+    """Loads a BaseEmbeddings object, or a saved EmbeddingSet.
+
+    EmbeddingSets (directories written by EmbeddingSet.save) are memory-mapped
+    instead of being loaded; their labels are used as the region list.
 
     Args:
-        path (str): The path to a BaseEmbeddings object.
+        path (str): The path to a BaseEmbeddings object, or to an EmbeddingSet
+            directory.
 
     Returns:
         tuple[np.ndarray, list[str]]: Embedding vectors and the corresponding
             region list.
     """
+    if os.path.isdir(path):
+        embedding_set = EmbeddingSet.open(path)
+        return embedding_set.embeddings, embedding_set.labels
     with open(path, "rb") as f:
         base_embed_obj = pickle.load(f)
     return base_embed_obj.embeddings, base_embed_obj.vocab
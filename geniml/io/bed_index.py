@@ -0,0 +1,440 @@
+import logging
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .const import (
+    BED_IDENTIFIER_CHUNK_SIZE,
+    BED_INDEX_BLOCK_SIZE,
+    BED_INDEX_EXT,
+    BED_INDEX_MAGIC,
+    BED_INDEX_VERSION,
+    CHROM_CODE_DTYPE,
+    REGION_COORD_DTYPE,
+)
+from .utils import (
+    JoinedDigest,
+    binary_is_fresh,
+    check_binary_version,
+    combine_bed_digests,
+    is_gzip_file,
+    iter_lines,
+    iter_uncompressed,
+    read_columnar_file,
+    read_uncompressed_range,
+    source_stat,
+    write_columnar_file,
+)
+
+_LOGGER = logging.getLogger("bbclient")
+
+# (chromosome names, starts, ends) of a batch of records
+Records = Tuple[List[str], np.ndarray, np.ndarray]
+# (chromosome codes, starts, ends) of a batch of records
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def bed_index_path(file_path: str) -> str:
+    """
+    Get the path of the line-offset index sidecar for a bed file.
+
+    :param file_path: path to bed file
+    :return: path to the index
+    """
+    return file_path + BED_INDEX_EXT
+
+
+def parse_bed_line(line: bytes) -> Union[Tuple[str, int, int], None]:
+    """
+    Parse the first three columns of a bed line.
+
+    :param line: line of a bed file
+    :return: chromosome, start and end, or None if the line is not a record (e.g. a header)
+    """
+    fields = line.split(b"\t", 3)
+    if len(fields) < 3:
+        return None
+    try:
+        return fields[0].decode("utf-8"), int(fields[1]), int(fields[2])
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def iter_bed_chunks(
+    path: str, chunk_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Stream the records of a bed file as blocks of columns, with a single sequential pass and
+    without indexing the file, so memory use does not grow with the file.
+
+    :param path: path to bed file (plain or gzip compressed)
+    :param chunk_size: number of records per block
+    :return: generator of (chromosome names, chromosome codes, starts, ends) blocks; chromosome
+        codes index into the chromosome names seen so far
+    """
+    chrom_to_code = {}
+    codes, starts, ends = [], [], []
+
+    def block():
+        return (
+            np.asarray(list(chrom_to_code), dtype=object),
+            np.asarray(codes, dtype=CHROM_CODE_DTYPE),
+            np.asarray(starts, dtype=REGION_COORD_DTYPE),
+            np.asarray(ends, dtype=REGION_COORD_DTYPE),
+        )
+
+    chunks = iter_uncompressed(path, is_gzip_file(path), [], [])
+    for _, lines in iter_lines(chunks):
+        for line in lines:
+            record = parse_bed_line(line)
+            if record is None:
+                continue
+            chrom, start, end = record
+            codes.append(chrom_to_code.setdefault(chrom, len(chrom_to_code)))
+            starts.append(start)
+            ends.append(end)
+            if len(codes) == chunk_size:
+                yield block()
+                codes, starts, ends = [], [], []
+    if codes:
+        yield block()
+
+
+def compute_bed_identifier_from_file(
+    file_path: str, chunk_size: int = BED_IDENTIFIER_CHUNK_SIZE
+) -> str:
+    """
+    Compute the bed identifier of a bed file, streaming over it without loading it.
+
+    Records are parsed as for indexing (see `parse_bed_line`), so lines that are not records,
+    like headers, are skipped, and the identifier is the one of the loaded RegionSet (see
+    `compute_bed_identifier_from_columns`). Lines end at "\\n", "\\r\\n" or "\\r", as when
+    reading the file as text.
+
+    :param file_path: path to bed file (plain or gzip compressed)
+    :param chunk_size: number of records to hash at a time
+    :return: bed identifier
+    """
+    chr_digest, start_digest, end_digest = JoinedDigest(), JoinedDigest(), JoinedDigest()
+    chrs, starts, ends = [], [], []
+
+    def update():
+        chr_digest.update(chrs)
+        start_digest.update([b"%d" % v for v in starts])
+        end_digest.update([b"%d" % v for v in ends])
+
+    chunks = iter_uncompressed(file_path, is_gzip_file(file_path), [], [])
+    for _, lines in iter_lines(chunks):
+        if any(b"\r" in line for line in lines):
+            # the empty lines left by "\r\n" line ends are skipped as non-records
+            lines = b"\n".join(lines).replace(b"\r", b"\n").split(b"\n")
+        for line in lines:
+            record = parse_bed_line(line)
+            if record is None:
+                continue
+            chrom, start, end = record
+            chrs.append(chrom.encode("utf-8"))
+            starts.append(start)
+            ends.append(end)
+            if len(starts) == chunk_size:
+                update()
+                chrs, starts, ends = [], [], []
+    update()
+    return combine_bed_digests(
+        chr_digest.hexdigest(), start_digest.hexdigest(), end_digest.hexdigest()
+    )
+
+
+class BedIndex:
+    """
+    Line-offset index of a bed file, for random access without loading the file.
+
+    The index stores the byte offset of every record, the layout of the gzip members of
+    compressed files and, for range queries, the extent of each chromosome within blocks of
+    consecutive records. Indexes are persisted next to the bed file and reused as long as the
+    bed file does not change.
+
+    Random access into plain (single member) gzip files has to decompress the file from its
+    start; compress large files with `bgzip` to make every access cheap.
+    """
+
+    def __init__(self, path: str, header: dict, columns: dict):
+        """
+        :param path: path to the indexed bed file
+        :param header: index metadata
+        :param columns: index arrays
+        """
+        self.path = path
+        self.compressed: bool = header["compressed"]
+        self.block_size: int = header["block_size"]
+        self.chrom_names: List[str] = header["chrom_names"]
+        self._header = header
+        self._chrom_to_code = {chrom: code for code, chrom in enumerate(self.chrom_names)}
+        self.offsets: np.ndarray = columns["offsets"]
+        self.member_offsets: np.ndarray = columns["member_offsets"]
+        self.member_starts: np.ndarray = columns["member_starts"]
+        self.block_ids: np.ndarray = columns["block_ids"]
+        self.block_chrom_codes: np.ndarray = columns["block_chrom_codes"]
+        self.block_min_starts: np.ndarray = columns["block_min_starts"]
+        self.block_max_ends: np.ndarray = columns["block_max_ends"]
+
+    @classmethod
+    def build(cls, path: str, block_size: int = BED_INDEX_BLOCK_SIZE) -> "BedIndex":
+        """
+        Index a bed file with a single pass over it.
+
+        :param path: path to bed file
+        :param block_size: number of records per block summary
+        :return: BedIndex
+        """
+        compressed = is_gzip_file(path)
+        member_offsets, member_starts = [], []
+        chrom_to_code = {}
+        offsets, blocks = [], []
+        n_records = 0
+        n_skipped = 0
+
+        chunks = iter_uncompressed(path, compressed, member_offsets, member_starts)
+        for line_offsets, lines in iter_lines(chunks):
+            keep, codes, starts, ends = [], [], [], []
+            for i, line in enumerate(lines):
+                record = parse_bed_line(line)
+                if record is None:
+                    if line.strip():
+                        n_skipped += 1
+                    continue
+                chrom, start, end = record
+                keep.append(i)
+                codes.append(chrom_to_code.setdefault(chrom, len(chrom_to_code)))
+                starts.append(start)
+                ends.append(end)
+            if not keep:
+                continue
+
+            offsets.append(line_offsets[keep])
+            record_ids = n_records + np.arange(len(keep))
+            n_records += len(keep)
+            blocks.append(
+                pd.DataFrame(
+                    {
+                        "block": record_ids // block_size,
+                        "chrom": np.asarray(codes, dtype=CHROM_CODE_DTYPE),
+                        "start": np.asarray(starts, dtype=REGION_COORD_DTYPE),
+                        "end": np.asarray(ends, dtype=REGION_COORD_DTYPE),
+                    }
+                )
+                .groupby(["block", "chrom"], sort=False)
+                .agg(start=("start", "min"), end=("end", "max"))
+                .reset_index()
+            )
+
+        if n_skipped > 0:
+            _LOGGER.info(f"Skipped {n_skipped} lines while indexing file. File: '{path}'")
+
+        blocks = (
+            pd.concat(blocks, ignore_index=True)
+            if blocks
+            else pd.DataFrame({"block": [], "chrom": [], "start": [], "end": []})
+        )
+        header = {
+            "version": BED_INDEX_VERSION,
+            "length": n_records,
+            "compressed": compressed,
+            "block_size": block_size,
+            "chrom_names": list(chrom_to_code),
+            "source": source_stat(path),
+        }
+        columns = {
+            "offsets": (
+                np.concatenate(offsets).astype(np.uint64) if offsets else np.empty(0, np.uint64)
+            ),
+            "member_offsets": np.asarray(member_offsets, dtype=np.uint64),
+            "member_starts": np.asarray(member_starts, dtype=np.uint64),
+            "block_ids": blocks["block"].to_numpy(dtype=np.int64),
+            "block_chrom_codes": blocks["chrom"].to_numpy(dtype=CHROM_CODE_DTYPE),
+            "block_min_starts": blocks["start"].to_numpy(dtype=REGION_COORD_DTYPE),
+            "block_max_ends": blocks["end"].to_numpy(dtype=REGION_COORD_DTYPE),
+        }
+        return cls(path, header, columns)
+
+    @classmethod
+    def load(cls, path: str, index_path: str = None) -> "BedIndex":
+        """
+        Load (memory-map) a persisted index.
+
+        :param path: path to the indexed bed file
+        :param index_path: path to the index [Default: `<path>.rsidx`]
+        :return: BedIndex
+        """
+        index_path = index_path or bed_index_path(path)
+        header, columns = read_columnar_file(index_path, BED_INDEX_MAGIC)
+        check_binary_version(header, BED_INDEX_VERSION, index_path)
+        return cls(path, header, columns)
+
+    @classmethod
+    def open(cls, path: str, persist: bool = True) -> "BedIndex":
+        """
+        Load the index of a bed file, building (and persisting) it if it is missing or stale.
+
+        :param path: path to bed file
+        :param persist: whether to save a newly built index next to the bed file
+        :return: BedIndex
+        """
+        index_path = bed_index_path(path)
+        if binary_is_fresh(index_path, path, BED_INDEX_MAGIC, BED_INDEX_VERSION):
+            return cls.load(path, index_path)
+
+        index = cls.build(path)
+        if persist:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                _LOGGER.warning(f"Could not save index of '{path}', keeping it in memory: {e}")
+        return index
+
+    def save(self, index_path: str = None) -> str:
+        """
+        Persist the index.
+
+        :param index_path: path to the index [Default: `<path>.rsidx`]
+        :return: path to the index
+        """
+        index_path = index_path or bed_index_path(self.path)
+        columns = {
+            "offsets": self.offsets,
+            "member_offsets": self.member_offsets,
+            "member_starts": self.member_starts,
+            "block_ids": self.block_ids,
+            "block_chrom_codes": self.block_chrom_codes,
+            "block_min_starts": self.block_min_starts,
+            "block_max_ends": self.block_max_ends,
+        }
+        write_columnar_file(index_path, BED_INDEX_MAGIC, self._header, columns)
+        return index_path
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _read_bytes(self, offset: int, size: int) -> bytes:
+        """
+        Read a range of the (decompressed) file.
+
+        :param offset: offset in the decompressed file
+        :param size: number of bytes to read, -1 to read until the end of the file
+        :return: bytes
+        """
+        return read_uncompressed_range(
+            self.path, self.compressed, self.member_offsets, self.member_starts, offset, size
+        )
+
+    def _read_run(self, first: int, last: int) -> Records:
+        """
+        Read a run of consecutive records with a single read.
+
+        :param first: index of the first record
+        :param last: index of the last record (inclusive)
+        :return: records
+        """
+        base = int(self.offsets[first])
+        if last + 1 < len(self.offsets):
+            data = self._read_bytes(base, int(self.offsets[last + 1]) - base)
+        else:
+            data = self._read_bytes(base, -1)
+
+        chroms, starts, ends = [], [], []
+        for offset in (self.offsets[first : last + 1] - base).tolist():
+            line_end = data.find(b"\n", offset)
+            chrom, start, end = parse_bed_line(data[offset : line_end if line_end != -1 else None])
+            chroms.append(chrom)
+            starts.append(start)
+            ends.append(end)
+        return chroms, np.asarray(starts, REGION_COORD_DTYPE), np.asarray(ends, REGION_COORD_DTYPE)
+
+    def read_records(self, indices: np.ndarray) -> Records:
+        """
+        Read records by index, in the given order. Consecutive indices are read together.
+
+        :param indices: record indices
+        :return: records
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return [], np.empty(0, REGION_COORD_DTYPE), np.empty(0, REGION_COORD_DTYPE)
+
+        # split into runs of consecutive indices
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        chroms, starts, ends = [], [], []
+        for run in np.split(indices, breaks):
+            run_chroms, run_starts, run_ends = self._read_run(int(run[0]), int(run[-1]))
+            chroms.extend(run_chroms)
+            starts.append(run_starts)
+            ends.append(run_ends)
+        return chroms, np.concatenate(starts), np.concatenate(ends)
+
+    def records_in(self, chrom: str, start: int, end: int) -> Records:
+        """
+        Read the records that overlap a genomic range. Only the blocks of records that can
+        contain overlapping records are read.
+
+        :param chrom: chromosome
+        :param start: start of the range
+        :param end: end of the range
+        :return: records, in file order
+        """
+        code = self._chrom_to_code.get(chrom)
+        if code is None:
+            return [], np.empty(0, REGION_COORD_DTYPE), np.empty(0, REGION_COORD_DTYPE)
+
+        candidates = (
+            (self.block_chrom_codes == code)
+            & (self.block_min_starts < end)
+            & (self.block_max_ends > start)
+        )
+        chroms, starts, ends = [], [], []
+        for block in np.unique(self.block_ids[candidates]).tolist():
+            first = block * self.block_size
+            last = min(first + self.block_size, len(self)) - 1
+            block_chroms, block_starts, block_ends = self._read_run(first, last)
+            block_chroms = np.asarray(block_chroms, dtype=object)
+            hits = (block_chroms == chrom) & (block_starts < end) & (block_ends > start)
+            chroms.extend(block_chroms[hits].tolist())
+            starts.append(block_starts[hits])
+            ends.append(block_ends[hits])
+
+        if not starts:
+            return [], np.empty(0, REGION_COORD_DTYPE), np.empty(0, REGION_COORD_DTYPE)
+        return chroms, np.concatenate(starts), np.concatenate(ends)
+
+    def iter_columns(self, chunk_size: int) -> Iterator[Columns]:
+        """
+        Stream the records as blocks of columns, with a single sequential pass over the file.
+
+        :param chunk_size: number of records per block
+        :return: generator of (chromosome codes, starts, ends) blocks; chromosome codes index
+            into `chrom_names`
+        """
+        codes, starts, ends = [], [], []
+        chunks = iter_uncompressed(self.path, self.compressed, [], [])
+        for _, lines in iter_lines(chunks):
+            for line in lines:
+                record = parse_bed_line(line)
+                if record is None:
+                    continue
+                chrom, start, end = record
+                codes.append(self._chrom_to_code[chrom])
+                starts.append(start)
+                ends.append(end)
+                if len(codes) == chunk_size:
+                    yield (
+                        np.asarray(codes, dtype=CHROM_CODE_DTYPE),
+                        np.asarray(starts, dtype=REGION_COORD_DTYPE),
+                        np.asarray(ends, dtype=REGION_COORD_DTYPE),
+                    )
+                    codes, starts, ends = [], [], []
+        if codes:
+            yield (
+                np.asarray(codes, dtype=CHROM_CODE_DTYPE),
+                np.asarray(starts, dtype=REGION_COORD_DTYPE),
+                np.asarray(ends, dtype=REGION_COORD_DTYPE),
+            )
@@ -0,0 +1,159 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+@lru_cache(maxsize=None)
+def natural_chrom_key(chrom: str) -> Tuple[int, int, str]:
+    """
+    Sort key for the natural order of chromosome names: chromosomes whose name (without the
+    `chr` prefix and any `_` suffix) is a number come first, in numeric order, followed by the
+    others in lexicographic order, e.g. chr1, chr2, chr10, chr10_random, chrM, chrX.
+
+    Alt, random and unplaced contigs sort next to their chromosome (chr1_KI270706v1_random right
+    after chr1) or, for chrUn contigs, with the other named chromosomes, as with `sort -V`. Keys
+    are cached, so each name is only parsed once.
+
+    :param chrom: chromosome name
+    :return: sort key
+    """
+    stem = chrom.replace("chr", "").split("_")[0]
+    if stem.isnumeric():
+        return 0, int(stem), chrom
+    return 1, 0, chrom
+
+
+def natural_chrom_ranks(chrom_names: Union[np.ndarray, List[str]]) -> np.ndarray:
+    """
+    Rank chromosome names in natural order (see `natural_chrom_key`).
+
+    :param chrom_names: chromosome names
+    :return: rank of each chromosome name
+    """
+    order = sorted(range(len(chrom_names)), key=lambda i: natural_chrom_key(chrom_names[i]))
+    ranks = np.empty(len(chrom_names), dtype=np.int64)
+    ranks[order] = np.arange(len(chrom_names))
+    return ranks
+
+
+def sort_chroms(chrom_names: Iterable[str]) -> List[str]:
+    """
+    Sort chromosome names in natural order (see `natural_chrom_key`).
+
+    :param chrom_names: chromosome names
+    :return: sorted chromosome names
+    """
+    return sorted(chrom_names, key=natural_chrom_key)
+
+
+class ChromosomeDictionary:
+    """
+    Encodes chromosome names as small integers: codes, in order of first appearance, and ranks,
+    in natural order (see `natural_chrom_key`). Sorting, merging and sweeps over sorted files can
+    then compare integers instead of parsing chromosome names over and over.
+
+    Names are added on first use; ranks are recomputed (for the few distinct chromosome names)
+    when a new name shows up.
+    """
+
+    def __init__(self, chrom_names: Iterable[str] = ()):
+        """
+        :param chrom_names: chromosome names to encode up front
+        """
+        self._names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._ranks: Union[np.ndarray, None] = None
+        self._rank_of: Dict[str, int] = {}
+        for chrom in chrom_names:
+            self.code(chrom)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, chrom: str):
+        return chrom in self._codes
+
+    @property
+    def names(self) -> List[str]:
+        """
+        Chromosome names, by code.
+        """
+        return self._names
+
+    @property
+    def ranks(self) -> np.ndarray:
+        """
+        Natural-order rank of each chromosome, by code.
+        """
+        if self._ranks is None:
+            self._ranks = natural_chrom_ranks(self._names)
+            self._rank_of = dict(zip(self._names, self._ranks.tolist()))
+        return self._ranks
+
+    def code(self, chrom: str) -> int:
+        """
+        Get the code of a chromosome, adding it to the dictionary if needed.
+
+        :param chrom: chromosome name
+        :return: code
+        """
+        code = self._codes.get(chrom)
+        if code is None:
+            code = len(self._names)
+            self._codes[chrom] = code
+            self._names.append(chrom)
+            self._ranks = None
+        return code
+
+    def encode(self, chroms: Union[np.ndarray, List[str]]) -> np.ndarray:
+        """
+        Get the codes of many chromosome names, adding new names to the dictionary.
+
+        :param chroms: chromosome names
+        :return: codes
+        """
+        codes, uniques = pd.factorize(np.asarray(chroms, dtype=object), sort=False)
+        translation = np.asarray([self.code(chrom) for chrom in uniques], dtype=np.int64)
+        return translation[codes]
+
+    def rank(self, chrom: str) -> int:
+        """
+        Get the natural-order rank of a chromosome, adding it to the dictionary if needed.
+
+        :param chrom: chromosome name
+        :return: rank
+        """
+        if chrom not in self._codes:
+            self.code(chrom)
+        if self._ranks is None:
+            self.ranks
+        return self._rank_of[chrom]
+
+    def compare(self, a: str, b: str) -> int:
+        """
+        Compare two chromosome names in natural order.
+
+        :param a: chromosome name
+        :param b: chromosome name
+        :return: 1 if a comes after b, -1 if it comes before, 0 if they are the same
+        """
+        if a == b:
+            return 0
+        # add both names before ranking, as adding a name shifts the ranks of others
+        self.code(a)
+        self.code(b)
+        return 1 if self.rank(a) > self.rank(b) else -1
+
+    def sort(self, chroms: Iterable[str]) -> List[str]:
+        """
+        Sort chromosome names in natural order.
+
+        :param chroms: chromosome names
+        :return: sorted chromosome names
+        """
+        chroms = list(chroms)
+        for chrom in chroms:
+            self.code(chrom)
+        return sorted(chroms, key=self.rank)
@@ -21,3 +21,53 @@ MAF_COLUMN = Literal[
 ]
 
 MAF_FILE_DELIM = "\t"
+
+# line-offset index of backed (on disk) MAF files
+MAF_INDEX_EXT = ".mafidx"
+MAF_INDEX_MAGIC = b"GENIMLMX"
+MAF_INDEX_VERSION = 1
+# number of SNPs per batch when iterating over MAF files
+MAF_BATCH_SIZE = 100_000
+# bytes parsed at a time by the columnar MAF reader
+MAF_READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+# dtypes of the columns backing an in-memory RegionSet
+CHROM_CODE_DTYPE = "int32"
+REGION_COORD_DTYPE = "int64"
+
+# binary (memory-mappable) RegionSet format
+REGIONSET_BINARY_EXT = ".rsbin"
+REGIONSET_BINARY_MAGIC = b"GENIMLRS"
+REGIONSET_BINARY_VERSION = 1
+REGIONSET_BINARY_ALIGNMENT = 8
+
+# line-offset index of backed (on disk) bed files
+BED_INDEX_EXT = ".rsidx"
+BED_INDEX_MAGIC = b"GENIMLIX"
+BED_INDEX_VERSION = 1
+BED_INDEX_BLOCK_SIZE = 1024  # records per block summary used by range queries
+BED_INDEX_READ_CHUNK_SIZE = 4 * 1024 * 1024  # bytes
+
+# number of regions hashed at a time when computing bed identifiers
+BED_IDENTIFIER_CHUNK_SIZE = 100_000
+
+# interval index keys are `chrom_code << shift | position`, leaving 40 bits (~1.1e12) for positions
+INTERVAL_INDEX_CHROM_SHIFT = 40
+# number of queries resolved at a time when enumerating overlaps
+INTERVAL_INDEX_QUERY_CHUNK_SIZE = 100_000
+
+# number of BED files a lazy BedSet keeps in memory
+BEDSET_CACHE_SIZE = 128
+# number of progress messages logged while loading all BED files of a BedSet
+BEDSET_PROGRESS_STEPS = 10
+
+# number of regions per block yielded by RegionSet.iter_chunks
+REGIONSET_CHUNK_SIZE = 100_000
+
+# on-disk (memory-mapped) EmbeddingSet: a directory with the raw vectors, metadata and labels
+EMBEDDING_SET_VECTORS_FILE_NAME = "vectors.bin"
+EMBEDDING_SET_META_FILE_NAME = "meta.json"
+EMBEDDING_SET_LABELS_FILE_NAME = "labels.tsv"
+EMBEDDING_SET_VERSION = 1
+# number of vectors written at a time when saving an EmbeddingSet
+EMBEDDING_SET_WRITE_BATCH_SIZE = 100_000
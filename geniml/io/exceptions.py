@@ -15,3 +15,10 @@ class BEDFileReadError(GenimlBaseError):
 
     def __init__(self, message: Optional[str] = None):
         super().__init__(message or self.default_message)
+
+
+class BinaryFileReadError(GenimlBaseError):
+    default_message = "Error reading binary file."
+
+    def __init__(self, message: Optional[str] = None):
+        super().__init__(message or self.default_message)
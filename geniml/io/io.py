@@ -1,16 +1,32 @@
-import gzip
+import glob
+import json
 import logging
 import os
-from hashlib import md5
-from typing import List, NoReturn, Union
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, NoReturn, Tuple, Union
 
 import genomicranges
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from iranges import IRanges
+from pyarrow import csv as pacsv
 from ubiquerg import is_url
 
+from .bed_index import BedIndex, Columns, compute_bed_identifier_from_file
 from .const import (
+    BEDSET_CACHE_SIZE,
+    BEDSET_PROGRESS_STEPS,
+    CHROM_CODE_DTYPE,
+    EMBEDDING_SET_LABELS_FILE_NAME,
+    EMBEDDING_SET_META_FILE_NAME,
+    EMBEDDING_SET_VECTORS_FILE_NAME,
+    EMBEDDING_SET_VERSION,
+    EMBEDDING_SET_WRITE_BATCH_SIZE,
+    MAF_BATCH_SIZE,
     MAF_CENTER_COL_NAME,
     MAF_CHROMOSOME_COL_NAME,
     MAF_END_COL_NAME,
@@ -18,11 +34,29 @@ from .const import (
     MAF_FILE_DELIM,
     MAF_HUGO_SYMBOL_COL_NAME,
     MAF_NCBI_BUILD_COL_NAME,
+    MAF_READ_BLOCK_SIZE,
     MAF_START_COL_NAME,
     MAF_STRAND_COL_NAME,
+    REGION_COORD_DTYPE,
+    REGIONSET_BINARY_EXT,
+    REGIONSET_CHUNK_SIZE,
 )
 from .exceptions import BackedFileNotAvailableError, BEDFileReadError
-from .utils import compute_md5sum_bedset, extract_maf_col_positions, is_gzipped, read_bedset_file
+from .interval_index import IntervalIndex
+from .maf_index import MafIndex
+from .region_ops import complement_merged, merge_sorted, sort_order, subtract_overlaps
+from .utils import (
+    check_binary_version,
+    compute_bed_identifier_from_columns,
+    compute_md5sum_bedset,
+    extract_maf_col_positions,
+    is_gzipped,
+    read_bedset_file,
+    read_regionset_binary,
+    regionset_binary_is_fresh,
+    regionset_binary_path,
+    write_regionset_binary,
+)
 
 _LOGGER = logging.getLogger("bbclient")
 
@@ -45,81 +79,327 @@ class Region:
 
 
 class RegionSet:
-    def __init__(self, regions: Union[str, List[Region]], backed: bool = False):
+    def __init__(
+        self,
+        regions: Union[str, List[Region]],
+        backed: bool = False,
+        binary_cache: bool = False,
+    ):
         """
         Instantiate a RegionSet object. This can be backed or not backed. It represents a set of genomic regions.
 
         If you specify `backed` as True, then the bed file will not be loaded into memory. This is useful for large
-        bed files. You can still iterate over the regions, but you cannot index into them.
+        bed files. Backed RegionSets build a line-offset index of the bed file (persisted next to it as
+        `<path>.rsidx`, and reused while the file is unchanged), so you can index, slice and query them
+        with `regions_in` without reading the whole file.
+
+        In-memory RegionSets keep their regions as contiguous columns: integer chromosome codes
+        (into a small array of chromosome names), starts and ends. `Region` objects are only
+        created on demand, when indexing into or iterating over the RegionSet.
 
-        :param regions: path, or url to bed file or list of Region objects
+        Paths ending in `.rsbin` are opened as binary RegionSet files (see `save_binary`). With
+        `binary_cache` set, a binary sidecar (`<path>.rsbin`) is written the first time a local bed
+        file is read, and memory-mapped instead of re-parsing the bed file on later loads, as long
+        as the bed file has not changed.
+
+        :param regions: path, or url to bed file, path to a binary RegionSet file, or list of Region objects
         :param backed: whether to load the bed file into memory or not [Default: False]
+        :param binary_cache: whether to read from, and write, a binary sidecar of the bed file [Default: False]
         """
-        self._df: Union[pd.DataFrame, None] = None
+        self._identifier = None
+        self._interval_index: Union[IntervalIndex, None] = None
+        self._index: Union[BedIndex, None] = None
+        self._chrom_codes: Union[np.ndarray, None] = None
+        self._chrom_names: Union[np.ndarray, None] = None
+        self._starts: Union[np.ndarray, None] = None
+        self._ends: Union[np.ndarray, None] = None
 
         if isinstance(regions, str):
             self.backed = backed
-            self.regions: List[Region] = []
             self.path = regions
-            self.regions = None
             self.is_gzipped = False
 
             if backed:
                 if is_url(regions):
                     raise BackedFileNotAvailableError()
-                # Open function depending on file type
-                if not is_gzipped(regions):
-                    open_func = open
-                    mode = "r"
-                else:
-                    self.is_gzipped = True
-                    open_func = gzip.open
-                    mode = "rt"
-
-                # https://stackoverflow.com/a/32607817/13175187
-                try:
-                    with open_func(self.path, mode) as file:
-                        self.length = sum(1 for line in file if line.strip())
-                except UnicodeDecodeError:
-                    self.is_gzipped = True
-                    with gzip.open(self.path, "rt") as file:
-                        self.length = sum(1 for line in file if line.strip())
+                if regions.endswith(REGIONSET_BINARY_EXT):
+                    raise ValueError(
+                        f"Binary RegionSet files can not be backed, they are already memory-mapped: "
+                        f"open '{regions}' with RegionSet.open_binary instead."
+                    )
+                self._index = BedIndex.open(regions)
+                self.is_gzipped = self._index.compressed
+                self.length = len(self._index)
+
+            elif regions.endswith(REGIONSET_BINARY_EXT):
+                self._set_columns_from_binary(regions)
+
+            elif (
+                binary_cache
+                and not is_url(regions)
+                and regionset_binary_is_fresh(regionset_binary_path(regions), regions)
+            ):
+                self._set_columns_from_binary(regionset_binary_path(regions))
 
             else:
                 if is_gzipped(regions):
                     df = self._read_gzipped_file(regions)
                 else:
                     df = self._read_file_pd(regions, sep="\t", header=None, engine="pyarrow")
-                self._df = df
 
-                _regions = []
-                df.apply(
-                    lambda row: _regions.append(Region(row[0], row[1], row[2])),
-                    axis=1,
-                )
+                self._set_columns_from_df(df)
+                self.length = len(self._starts)
 
-                self.regions = _regions
-                self.length = len(self.regions)
+                if binary_cache and not is_url(regions):
+                    self.save_binary()
 
         # load from list
         elif isinstance(regions, list) and all([isinstance(region, Region) for region in regions]):
             self.backed = False
             self.path = None
-            self.regions = regions
-            self.length = len(self.regions)
+            self._set_columns(
+                [region.chr for region in regions],
+                [region.start for region in regions],
+                [region.end for region in regions],
+            )
+            self.length = len(self._starts)
         else:
             raise ValueError("regions must be a path to a bed file or a list of Region objects")
 
-        self._identifier = None
+    @classmethod
+    def from_arrays(
+        cls,
+        chroms: Union[np.ndarray, List[str]],
+        starts: Union[np.ndarray, List[int]],
+        ends: Union[np.ndarray, List[int]],
+    ) -> "RegionSet":
+        """
+        Create an in-memory RegionSet directly from chromosome, start and end columns.
+
+        :param chroms: chromosome name of each region
+        :param starts: start position of each region
+        :param ends: end position of each region
+        :return: RegionSet
+        """
+        instance = cls.__new__(cls)
+        instance.backed = False
+        instance.path = None
+        instance._set_columns(chroms, starts, ends)
+        instance.length = len(instance._starts)
+        instance._identifier = None
+        instance._interval_index = None
+        return instance
+
+    @classmethod
+    def _from_columns(
+        cls,
+        chrom_codes: np.ndarray,
+        chrom_names: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+    ) -> "RegionSet":
+        """
+        Create an in-memory RegionSet from already encoded columns, without copying them.
+
+        :param chrom_codes: index of each region's chromosome in chrom_names
+        :param chrom_names: chromosome names
+        :param starts: start position of each region
+        :param ends: end position of each region
+        :return: RegionSet
+        """
+        instance = cls.__new__(cls)
+        instance.backed = False
+        instance.path = None
+        instance._chrom_codes = chrom_codes
+        instance._chrom_names = chrom_names
+        instance._starts = starts
+        instance._ends = ends
+        instance.length = len(starts)
+        instance._identifier = None
+        instance._interval_index = None
+        return instance
+
+    def _set_columns(
+        self,
+        chroms: Union[np.ndarray, List[str]],
+        starts: Union[np.ndarray, List[int]],
+        ends: Union[np.ndarray, List[int]],
+    ) -> NoReturn:
+        """
+        Encode chromosome names and store the region columns.
+
+        :param chroms: chromosome name of each region
+        :param starts: start position of each region
+        :param ends: end position of each region
+        """
+        codes, names = pd.factorize(np.asarray(chroms, dtype=object).astype(str), sort=False)
+        self._chrom_codes = codes.astype(CHROM_CODE_DTYPE, copy=False)
+        self._chrom_names = np.asarray(names, dtype=object)
+        self._starts = np.asarray(starts, dtype=REGION_COORD_DTYPE)
+        self._ends = np.asarray(ends, dtype=REGION_COORD_DTYPE)
+
+    def _set_columns_from_df(self, df: pd.DataFrame) -> NoReturn:
+        """
+        Store the first three columns of a BED dataframe as region columns.
+
+        :param df: pandas dataframe read from a bed file
+        """
+        codes, names = pd.factorize(df[0].astype(str), sort=False)
+        self._chrom_codes = codes.astype(CHROM_CODE_DTYPE, copy=False)
+        self._chrom_names = np.asarray(names, dtype=object)
+        self._starts = df[1].to_numpy(dtype=REGION_COORD_DTYPE)
+        self._ends = df[2].to_numpy(dtype=REGION_COORD_DTYPE)
+
+    def _set_columns_from_binary(self, file_path: str) -> NoReturn:
+        """
+        Memory-map the region columns of a binary RegionSet file.
+
+        :param file_path: path to the binary file
+        """
+        header, chrom_names, chrom_codes, starts, ends = read_regionset_binary(file_path)
+        self._chrom_names = chrom_names
+        self._chrom_codes = chrom_codes
+        self._starts = starts
+        self._ends = ends
+        self._identifier = header.get("identifier")
+        self.length = len(starts)
+
+    @classmethod
+    def open_binary(cls, file_path: str) -> "RegionSet":
+        """
+        Open a binary RegionSet file written by `save_binary`. The columns are memory-mapped,
+        so this is near-instant regardless of the number of regions.
+
+        :param file_path: path to the binary file
+        :return: RegionSet
+        """
+        instance = cls.__new__(cls)
+        instance.backed = False
+        instance.path = file_path
+        instance._interval_index = None
+        instance._set_columns_from_binary(file_path)
+        return instance
+
+    def save_binary(self, file_path: str = None) -> str:
+        """
+        Save the regions in the binary RegionSet format, which can be memory-mapped by
+        `open_binary` (or by passing the path to `RegionSet`).
+
+        :param file_path: path to the binary file [Default: `<path>.rsbin` next to the bed file]
+        :return: path to the binary file
+        """
+        if self.backed:
+            raise NotImplementedError("Backed RegionSets can not be saved in binary format.")
+
+        source_path = None
+        if self.path and not is_url(self.path) and not self.path.endswith(REGIONSET_BINARY_EXT):
+            source_path = self.path
+
+        if file_path is None:
+            if source_path is None:
+                raise ValueError("file_path is required for RegionSets not read from a bed file.")
+            file_path = regionset_binary_path(source_path)
 
-    def to_pandas(self) -> Union[pd.DataFrame, None]:
-        if self._df is None:
-            seqnames, starts, ends = zip(
-                *[(region.chr, region.start, region.end) for region in self]
+        write_regionset_binary(
+            file_path,
+            self._chrom_names,
+            self._chrom_codes,
+            self._starts,
+            self._ends,
+            identifier=self._identifier,
+            source_path=source_path,
+        )
+        return file_path
+
+    @property
+    def chrom_codes(self) -> Union[np.ndarray, None]:
+        """
+        Integer chromosome code of each region (index into `chrom_names`).
+        """
+        return self._chrom_codes
+
+    @property
+    def chrom_names(self) -> np.ndarray:
+        """
+        Chromosome names referenced by `chrom_codes` (and by the blocks of `iter_chunks`).
+        """
+        if self.backed:
+            return np.asarray(self._index.chrom_names, dtype=object)
+        return self._chrom_names
+
+    @property
+    def chroms(self) -> Union[np.ndarray, None]:
+        """
+        Chromosome name of each region.
+        """
+        if self.backed:
+            return None
+        return self._chrom_names[self._chrom_codes]
+
+    @property
+    def starts(self) -> Union[np.ndarray, None]:
+        """
+        Start position of each region.
+        """
+        return self._starts
+
+    @property
+    def ends(self) -> Union[np.ndarray, None]:
+        """
+        End position of each region.
+        """
+        return self._ends
+
+    @property
+    def regions(self) -> Union[List[Region], None]:
+        """
+        Materialize all regions as a list of Region objects.
+
+        Kept for backwards compatibility. Prefer indexing into, or iterating over, the
+        RegionSet, which creates Region objects on demand.
+        """
+        if self.backed:
+            return None
+        return list(self)
+
+    def iter_chunks(self, size: int = REGIONSET_CHUNK_SIZE) -> Iterator[Columns]:
+        """
+        Iterate over the regions in blocks of columns, without creating Region objects. Backed
+        RegionSets are streamed from disk, so at most one block is held in memory.
+
+        :param size: number of regions per block [Default: 100,000]
+        :return: generator of (chromosome codes, starts, ends) arrays; chromosome codes index
+            into `chrom_names`
+        """
+        if self.backed:
+            yield from self._index.iter_columns(size)
+            return
+        for offset in range(0, self.length, size):
+            yield (
+                self._chrom_codes[offset : offset + size],
+                self._starts[offset : offset + size],
+                self._ends[offset : offset + size],
+            )
+
+    def _columns(self) -> Columns:
+        """
+        Get the chromosome codes, starts and ends of all regions, reading them for backed
+        RegionSets.
+        """
+        if not self.backed:
+            return self._chrom_codes, self._starts, self._ends
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return (
+                np.empty(0, dtype=CHROM_CODE_DTYPE),
+                np.empty(0, dtype=REGION_COORD_DTYPE),
+                np.empty(0, dtype=REGION_COORD_DTYPE),
             )
-            return pd.DataFrame([seqnames, starts, ends])
+        return tuple(np.concatenate(column) for column in zip(*chunks))
 
-        return self._df
+    def to_pandas(self) -> pd.DataFrame:
+        chrom_codes, starts, ends = self._columns()
+        return pd.DataFrame({0: self.chrom_names[chrom_codes], 1: starts, 2: ends})
 
     def _read_gzipped_file(self, file_path: str) -> pd.DataFrame:
         """
@@ -183,9 +463,203 @@ class RegionSet:
 
     def __getitem__(self, key):
         if self.backed:
-            raise NotImplementedError("Backed RegionSets do not currently support indexing.")
-        else:
-            return self.regions[key]
+            return self._get_backed_item(key)
+        if isinstance(key, (int, np.integer)):
+            return Region(
+                self._chrom_names[self._chrom_codes[key]],
+                int(self._starts[key]),
+                int(self._ends[key]),
+            )
+        # slices, integer and boolean arrays select a new (array-backed) RegionSet
+        return RegionSet._from_columns(
+            self._chrom_codes[key],
+            self._chrom_names,
+            self._starts[key],
+            self._ends[key],
+        )
+
+    def _get_backed_item(self, key) -> Union[Region, "RegionSet"]:
+        """
+        Read regions of a backed RegionSet from disk, through the line-offset index.
+
+        :param key: index, slice, or integer/boolean array
+        :return: Region for an integer index, otherwise an in-memory RegionSet
+        """
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.length
+            if not 0 <= key < self.length:
+                raise IndexError("RegionSet index out of range")
+            chroms, starts, ends = self._index.read_records([key])
+            return Region(chroms[0], int(starts[0]), int(ends[0]))
+
+        indices = np.arange(self.length)[key]
+        chroms, starts, ends = self._index.read_records(indices)
+        return RegionSet.from_arrays(chroms, starts, ends)
+
+    def regions_in(self, chrom: str, start: int, end: int) -> "RegionSet":
+        """
+        Get the regions that overlap a genomic range. For backed RegionSets, only the parts of
+        the file that can contain overlapping regions are read.
+
+        :param chrom: chromosome
+        :param start: start of the range
+        :param end: end of the range
+        :return: in-memory RegionSet of the overlapping regions, in their original order
+        """
+        if self.backed:
+            chroms, starts, ends = self._index.records_in(chrom, start, end)
+            return RegionSet.from_arrays(chroms, starts, ends)
+
+        codes = np.flatnonzero(self._chrom_names == chrom)
+        if len(codes) == 0:
+            return self[np.empty(0, dtype=np.int64)]
+        hits = (self._chrom_codes == codes[0]) & (self._starts < end) & (self._ends > start)
+        return self[hits]
+
+    @property
+    def interval_index(self) -> IntervalIndex:
+        """
+        Interval index over the regions, built on first use and reused by later queries.
+        """
+        if self.backed:
+            raise NotImplementedError("Backed RegionSets can not be indexed for overlap queries.")
+        if self._interval_index is None:
+            self._interval_index = IntervalIndex(
+                self._chrom_names, self._chrom_codes, self._starts, self._ends
+            )
+        return self._interval_index
+
+    def _query_columns(self) -> tuple:
+        """
+        Region columns, in the form taken by IntervalIndex queries.
+        """
+        if self.backed:
+            raise NotImplementedError("Backed RegionSets can not be used in overlap queries.")
+        return self._chrom_names, self._chrom_codes, self._starts, self._ends
+
+    def overlaps(self, other: "RegionSet") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find all pairs of overlapping regions between this RegionSet and another one. The
+        interval index of `other` is used (and built if needed), so query a large, reused
+        RegionSet (e.g. a universe) by passing it as `other`.
+
+        :param other: RegionSet to compare against
+        :return: indices into this RegionSet and indices into `other` of each overlapping pair,
+            ordered by the index into this RegionSet
+        """
+        return other.interval_index.overlaps(*self._query_columns())
+
+    def count_overlaps(self, other: "RegionSet") -> np.ndarray:
+        """
+        Count the regions of another RegionSet that overlap each region of this one.
+
+        :param other: RegionSet to compare against
+        :return: number of overlapping regions in `other`, for each region
+        """
+        return other.interval_index.count(*self._query_columns())
+
+    def nearest(
+        self, other: "RegionSet", return_distance: bool = False
+    ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Find the nearest region of another RegionSet for each region of this one. Overlapping
+        regions are nearest (distance 0); otherwise the distance is the number of bases between
+        the two regions, and ties go to the upstream region.
+
+        :param other: RegionSet to compare against
+        :param return_distance: whether to also return the distances
+        :return: index into `other` of the nearest region, for each region (-1 if `other` has no
+            region on the same chromosome), and the distances if `return_distance` is set
+        """
+        nearest, distance = other.interval_index.nearest(*self._query_columns())
+        if return_distance:
+            return nearest, distance
+        return nearest
+
+    def sort(self) -> "RegionSet":
+        """
+        Sort the regions by chromosome (in natural order: chr1, chr2, ..., chr10, ..., chrX),
+        start and end, like `sort -k1,1V -k2,2n`.
+
+        :return: sorted RegionSet
+        """
+        return self[sort_order(*self._query_columns())]
+
+    def merge(self, distance: int = 0) -> "RegionSet":
+        """
+        Merge overlapping regions, like `bedtools merge`.
+
+        :param distance: maximum number of bases between two regions for them to be merged;
+            0 merges overlapping and book-ended regions [Default: 0]
+        :return: sorted RegionSet of the merged regions
+        """
+        sorted_set = self.sort()
+        chrom_codes, starts, ends = merge_sorted(
+            sorted_set._chrom_codes, sorted_set._starts, sorted_set._ends, distance
+        )
+        return RegionSet._from_columns(chrom_codes, self._chrom_names, starts, ends)
+
+    def intersect(self, other: "RegionSet", fraction: float = 0.0) -> "RegionSet":
+        """
+        Get the regions that overlap another RegionSet, like `bedtools intersect -u -f`.
+
+        :param other: RegionSet to compare against
+        :param fraction: minimum fraction of a region that has to be covered by a single region
+            of `other` [Default: 0.0, any overlap]
+        :return: RegionSet of the overlapping regions, in their original order
+        """
+        if fraction <= 0:
+            return self[self.count_overlaps(other) > 0]
+
+        query_idx, other_idx = self.overlaps(other)
+        overlap = np.minimum(self._ends[query_idx], other._ends[other_idx]) - np.maximum(
+            self._starts[query_idx], other._starts[other_idx]
+        )
+        lengths = self._ends[query_idx] - self._starts[query_idx]
+        keep = np.zeros(self.length, dtype=bool)
+        keep[query_idx[overlap >= fraction * lengths]] = True
+        return self[keep]
+
+    def subtract(self, other: "RegionSet") -> "RegionSet":
+        """
+        Remove the parts of the regions that overlap another RegionSet, like `bedtools subtract`.
+        Regions that are split by the subtraction are replaced by their remaining pieces.
+
+        :param other: RegionSet to subtract
+        :return: RegionSet of the remaining pieces, in the original order of the regions
+        """
+        other = other.merge()
+        query_idx, other_idx = self.overlaps(other)
+        owners, starts, ends = subtract_overlaps(
+            self._starts, self._ends, query_idx, other._starts[other_idx], other._ends[other_idx]
+        )
+        return RegionSet._from_columns(self._chrom_codes[owners], self._chrom_names, starts, ends)
+
+    def complement(self, chrom_sizes: Union[str, Dict[str, int]]) -> "RegionSet":
+        """
+        Get the parts of the genome not covered by the regions, like `bedtools complement`.
+        Regions on chromosomes missing from `chrom_sizes` are ignored.
+
+        :param chrom_sizes: path to a chrom.sizes file, or mapping of chromosome names to sizes
+        :return: sorted RegionSet of the uncovered regions
+        """
+        if isinstance(chrom_sizes, str):
+            sizes = pd.read_csv(chrom_sizes, sep="\t", header=None, usecols=[0, 1])
+            chrom_sizes = dict(zip(sizes[0].astype(str), sizes[1]))
+        genome_names = np.asarray(list(chrom_sizes), dtype=object)
+        genome_sizes = np.asarray(list(chrom_sizes.values()), dtype=REGION_COORD_DTYPE)
+
+        merged = self.merge()
+        translation = pd.Index(genome_names).get_indexer(merged._chrom_names)
+        genome_codes = translation[merged._chrom_codes]
+        known = genome_codes >= 0
+        chrom_codes, starts, ends = complement_merged(
+            genome_codes[known], merged._starts[known], merged._ends[known], genome_sizes
+        )
+        return RegionSet._from_columns(
+            chrom_codes.astype(CHROM_CODE_DTYPE), genome_names, starts, ends
+        ).sort()
 
     def __repr__(self):
         if self.path:
@@ -198,34 +672,17 @@ class RegionSet:
 
     def __iter__(self):
         if self.backed:
-            # Open function depending on file type
-            if self.is_gzipped:
-                open_func = gzip.open
-                mode = "rt"
-            else:
-                open_func = open
-                mode = "r"
-
-            with open_func(self.path, mode) as f:
-                skipped_lines = 0
-                max_skipped_lines = 5
-                for line in f:
-                    try:
-                        chr, start, stop = line.split("\t")[:3]
-                    except ValueError as _:
-                        if skipped_lines < max_skipped_lines:
-                            skipped_lines += 1
-                            continue
-                        else:
-                            raise BEDFileReadError("Could not read line bed file")
-                    if skipped_lines > 0:
-                        _LOGGER.info(
-                            f"Skipped {skipped_lines} lines while opening file. File: '{self.path}'"
-                        )
-                    yield Region(chr, int(start), int(stop))
+            # stream the records the index holds, parsed as for indexing
+            chrom_names = self._index.chrom_names
+            for chrom_codes, starts, ends in self._index.iter_columns(REGIONSET_CHUNK_SIZE):
+                for code, start, end in zip(chrom_codes.tolist(), starts.tolist(), ends.tolist()):
+                    yield Region(chrom_names[code], start, end)
         else:
-            for region in self.regions:
-                yield region
+            chrom_names = self._chrom_names
+            for code, start, end in zip(
+                self._chrom_codes.tolist(), self._starts.tolist(), self._ends.tolist()
+            ):
+                yield Region(chrom_names[code], start, end)
 
     @property
     def identifier(self) -> str:
@@ -237,14 +694,9 @@ class RegionSet:
 
         :return: GenomicRanges object
         """
-
-        seqnames, starts, ends = zip(
-            *[(region.chr, region.start, region.end) for region in self.regions]
-        )
-        width_list = []
-        for start, end in zip(starts, ends):
-            width_list.append(end - start)
-        ir = IRanges(start=starts, width=width_list)
+        chrom_codes, starts, ends = self._columns()
+        seqnames = self.chrom_names[chrom_codes].tolist()
+        ir = IRanges(start=starts, width=ends - starts)
 
         return genomicranges.GenomicRanges(seqnames, ir)
 
@@ -254,43 +706,47 @@ class RegionSet:
 
         :return: the identifier of BED file (str)
         """
-        if self._identifier is not None:
-            return self._identifier
-        else:
+        if self._identifier is None:
             if not self.backed:
-                # concate column values
-                chrs = ",".join([region.chr for region in self.regions])
-                starts = ",".join([str(region.start) for region in self.regions])
-                ends = ",".join([str(region.end) for region in self.regions])
-
+                self._identifier = compute_bed_identifier_from_columns(
+                    self._chrom_names, self._chrom_codes, self._starts, self._ends
+                )
             else:
-                open_func = open if not is_gzipped(self.path) else gzip.open
-                mode = "r" if not is_gzipped(self.path) else "rt"
-                with open_func(self.path, mode) as f:
-                    # concate column values
-                    chrs = []
-                    starts = []
-                    ends = []
-                    for row in f:
-                        chrs.append(row.split("\t")[0])
-                        starts.append(row.split("\t")[1])
-                        ends.append(row.split("\t")[2].replace("\n", ""))
-                    chrs = ",".join(chrs)
-                    starts = ",".join(starts)
-                    ends = ",".join(ends)
-
-            # hash column values
-            chr_digest = md5(chrs.encode("utf-8")).hexdigest()
-            start_digest = md5(starts.encode("utf-8")).hexdigest()
-            end_digest = md5(ends.encode("utf-8")).hexdigest()
-            # hash column digests
-            bed_digest = md5(
-                ",".join([chr_digest, start_digest, end_digest]).encode("utf-8")
-            ).hexdigest()
-
-            self._identifier = bed_digest
-
-            return self._identifier
+                self._identifier = compute_bed_identifier_from_file(self.path)
+
+        return self._identifier
+
+
+def _compute_bed_identifier(region_set: Union[RegionSet, str, List[Region]]) -> str:
+    if isinstance(region_set, RegionSet):
+        return region_set.compute_bed_identifier()
+    if isinstance(region_set, str) and not is_url(region_set):
+        # local files are hashed as a stream, without loading them
+        return compute_bed_identifier_from_file(region_set)
+    return RegionSet(region_set).compute_bed_identifier()
+
+
+def compute_bed_identifiers(region_sets: List[RegionSet], workers: int = 1) -> List[str]:
+    """
+    Compute the identifiers of many RegionSets, hashing them in a pool of `workers` processes.
+    Identifiers are stored on the RegionSets, so they are only computed once.
+
+    :param region_sets: RegionSets to hash
+    :param workers: number of processes to use
+    :return: the identifiers, in the order of region_sets
+    """
+    pending = [region_set for region_set in region_sets if region_set._identifier is None]
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            identifiers = executor.map(
+                _compute_bed_identifier,
+                pending,
+                chunksize=max(1, len(pending) // (workers * 4)),
+            )
+            for region_set, identifier in zip(pending, identifiers):
+                region_set._identifier = identifier
+
+    return [region_set.compute_bed_identifier() for region_set in region_sets]
 
 
 class BedSet:
@@ -303,43 +759,150 @@ class BedSet:
         region_sets: Union[List[RegionSet], List[str], List[List[Region]], None] = None,
         file_path: str = None,
         identifier: str = None,
+        cache_size: Union[int, None] = BEDSET_CACHE_SIZE,
     ):
         """
+        BED files given as paths (or lists of Region) are loaded lazily, on first access, and at
+        most `cache_size` of them are kept in memory at a time (least recently used are dropped
+        first, and reloaded if accessed again). Use `load_all` to load all of them, in parallel.
+
         :param region_sets: list of BED file paths, RegionSet, or 2-dimension list of Region [Default: None - empty BedSet]
         :param file_path: path to the .txt file with identifier of all BED files in it
         :param identifier: the identifier of the BED set
+        :param cache_size: number of lazily loaded BED files kept in memory, None to keep all [Default: 128]
         """
 
         if isinstance(region_sets, list):
-            # init with a list of BED files
-            if all(isinstance(region_set, RegionSet) for region_set in region_sets):
-                self.region_sets = region_sets
-            # init with a list of file paths or a 2d list of Region
-            else:
-                self.region_sets = []
-                for r in region_sets:
-                    self.region_sets.append(RegionSet(r))
-
+            sources = region_sets
         elif file_path is not None:
             if os.path.isfile(file_path):
-                self.region_sets = [RegionSet(r) for r in read_bedset_file(file_path)]
+                sources = read_bedset_file(file_path)
             else:
                 raise FileNotFoundError(f"The specified file '{file_path}' does not exist.")
         else:
             # create empty regionSet
-            self.region_sets = []
+            sources = []
 
+        self._sources: List[Union[RegionSet, str, List[Region]]] = list(sources)
+        self._bed_identifiers: List[Union[str, None]] = [None] * len(self._sources)
+        self._cache: OrderedDict = OrderedDict()
+        self.cache_size = cache_size
         self._bedset_identifier = identifier
 
     def __len__(self):
-        return len(self.region_sets)
+        return len(self._sources)
 
     def __iter__(self):
-        for region_set in self.region_sets:
-            yield region_set
+        for indx in range(len(self)):
+            yield self[indx]
+
+    def __getitem__(self, indx: Union[int, slice]) -> Union[RegionSet, List[RegionSet]]:
+        if isinstance(indx, slice):
+            return [self[i] for i in range(*indx.indices(len(self)))]
+        if indx < 0:
+            indx += len(self)
+        if not 0 <= indx < len(self):
+            raise IndexError("BedSet index out of range")
+        return self._load(indx)
+
+    @property
+    def region_sets(self) -> Tuple[RegionSet, ...]:
+        """
+        All RegionSets of the BED set, as a tuple: use `add` to add a BED file. This loads every
+        BED file; iterate over the BedSet instead to only hold `cache_size` of them in memory.
+        """
+        return tuple(self)
 
-    def __getitem__(self, indx: int):
-        return self.region_sets[indx]
+    @region_sets.setter
+    def region_sets(self, region_sets: Union[List[RegionSet], List[str], List[List[Region]]]):
+        """
+        Replace the BED files of the BED set.
+        """
+        self._sources = list(region_sets)
+        self._bed_identifiers = [None] * len(self._sources)
+        self._cache = OrderedDict()
+        self._bedset_identifier = None
+
+    def _load(self, indx: int) -> RegionSet:
+        """
+        Get a RegionSet, loading it if it is not in memory.
+
+        :param indx: index of the BED file
+        :return: RegionSet
+        """
+        source = self._sources[indx]
+        if isinstance(source, RegionSet):
+            return source
+        if indx in self._cache:
+            self._cache.move_to_end(indx)
+            return self._cache[indx]
+        self._store(indx, RegionSet(source))
+        return self._cache[indx]
+
+    def _store(self, indx: int, region_set: RegionSet) -> NoReturn:
+        """
+        Keep a loaded RegionSet in the LRU cache, dropping the least recently used ones if the
+        cache is full. Identifiers of dropped RegionSets are kept, so they are not recomputed.
+
+        :param indx: index of the BED file
+        :param region_set: loaded RegionSet
+        """
+        if region_set._identifier is None:
+            region_set._identifier = self._bed_identifiers[indx]
+        self._cache[indx] = region_set
+        self._cache.move_to_end(indx)
+        while self.cache_size is not None and len(self._cache) > max(self.cache_size, 1):
+            dropped_indx, dropped = self._cache.popitem(last=False)
+            self._bed_identifiers[dropped_indx] = dropped._identifier
+
+    def iter_chunks(self, size: int = REGIONSET_CHUNK_SIZE) -> Iterator[Tuple[RegionSet, Columns]]:
+        """
+        Iterate over the regions of all BED files in blocks of columns (see
+        `RegionSet.iter_chunks`). BED files are loaded one at a time, as for plain iteration.
+
+        :param size: maximum number of regions per block [Default: 100,000]
+        :return: generator of (RegionSet, (chromosome codes, starts, ends)) pairs; chromosome
+            codes index into the `chrom_names` of the RegionSet
+        """
+        for region_set in self:
+            for chunk in region_set.iter_chunks(size):
+                yield region_set, chunk
+
+    def load_all(self, workers: int = 1, use_processes: bool = False) -> "BedSet":
+        """
+        Load all BED files into memory, parsing them in a pool of `workers` threads (or
+        processes), and logging the progress. The BedSet keeps all of them in memory afterwards,
+        regardless of `cache_size`.
+
+        :param workers: number of threads or processes to use
+        :param use_processes: whether to use processes instead of threads
+        :return: the BedSet
+        """
+        if self.cache_size is not None:
+            self.cache_size = max(self.cache_size, len(self))
+        pending = [
+            indx
+            for indx, source in enumerate(self._sources)
+            if not isinstance(source, RegionSet) and indx not in self._cache
+        ]
+        if not pending:
+            return self
+
+        step = max(1, len(pending) // BEDSET_PROGRESS_STEPS)
+        if workers > 1 and len(pending) > 1:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with executor_class(max_workers=workers) as executor:
+                loaded = executor.map(RegionSet, [self._sources[indx] for indx in pending])
+                for n_loaded, (indx, region_set) in enumerate(zip(pending, loaded), 1):
+                    self._store(indx, region_set)
+                    if n_loaded % step == 0 or n_loaded == len(pending):
+                        _LOGGER.info(f"Loaded {n_loaded}/{len(pending)} BED files")
+        else:
+            for n_loaded, indx in enumerate(pending, 1):
+                self._load(indx)
+                if n_loaded % step == 0 or n_loaded == len(pending):
+                    _LOGGER.info(f"Loaded {n_loaded}/{len(pending)} BED files")
+        return self
 
     @property
     def identifier(self) -> str:
@@ -354,7 +917,8 @@ class BedSet:
         :param bedfile: RegionSet instance, that should be added to the bedSet
         :return: NoReturn
         """
-        self.region_sets.append(bedfile)
+        self._sources.append(bedfile)
+        self._bed_identifiers.append(None)
 
         self._bedset_identifier = self.compute_bedset_identifier()
 
@@ -363,25 +927,71 @@ class BedSet:
         Process a list of BED set identifiers and returns a GenomicRangesList object
         """
         gr_list = []
-        for regionset in self.region_sets:
+        for regionset in self:
             gr_list.append(regionset.to_granges())
 
         return genomicranges.GenomicRangesList(ranges=gr_list)
 
-    def compute_bedset_identifier(self) -> str:
+    def _known_bed_identifier(self, indx: int) -> Union[str, None]:
+        """
+        Get the identifier of a BED file, if it has already been computed.
+
+        :param indx: index of the BED file
+        :return: identifier, or None
+        """
+        source = self._sources[indx]
+        if isinstance(source, RegionSet):
+            return source._identifier
+        if indx in self._cache and self._cache[indx]._identifier is not None:
+            return self._cache[indx]._identifier
+        return self._bed_identifiers[indx]
+
+    def compute_bed_identifiers(self, workers: int = 1) -> List[str]:
+        """
+        Compute the identifiers of all BED files in the BED set, hashing them in a pool of
+        `workers` processes. Local BED files that are not loaded yet are hashed straight from
+        disk, without loading them. Identifiers are kept, so they are only computed once.
+
+        :param workers: number of processes to use
+        :return: the identifiers of the BED files
+        """
+        pending = [indx for indx in range(len(self)) if self._known_bed_identifier(indx) is None]
+        jobs = [
+            self._cache[indx] if indx in self._cache else self._sources[indx] for indx in pending
+        ]
+        if workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                identifiers = list(
+                    executor.map(
+                        _compute_bed_identifier,
+                        jobs,
+                        chunksize=max(1, len(pending) // (workers * 4)),
+                    )
+                )
+        else:
+            identifiers = [_compute_bed_identifier(job) for job in jobs]
+
+        for indx, identifier in zip(pending, identifiers):
+            self._bed_identifiers[indx] = identifier
+            if isinstance(self._sources[indx], RegionSet):
+                self._sources[indx]._identifier = identifier
+            elif indx in self._cache:
+                self._cache[indx]._identifier = identifier
+
+        return [self._known_bed_identifier(indx) for indx in range(len(self))]
+
+    def compute_bedset_identifier(self, workers: int = 1) -> str:
         """
         Return the identifier. If it is not set, compute one
 
-        :param bedset: BedSet object
+        :param workers: number of processes used to hash the BED files
         :return: the identifier of BED set
         """
         if self._bedset_identifier is not None:
             return self._bedset_identifier
 
         elif self._bedset_identifier is None:
-            bedfile_ids = []
-            for bedfile in self.region_sets:
-                bedfile_ids.append(bedfile.compute_bed_identifier())
+            bedfile_ids = self.compute_bed_identifiers(workers=workers)
             self._bedset_identifier = compute_md5sum_bedset(bedfile_ids)
 
             return self._bedset_identifier
@@ -446,16 +1056,6 @@ class Maf:
     Python representation of a MAF file, only supports some columns for now
     """
 
-    def _extract_value_from_col(self, col_name: str, line: str) -> any:
-        """
-        Extract a value from a column in a line of a MAF file.
-
-        :param col_name: name of column
-        :param line: line from MAF file
-        :return: value of column
-        """
-        return line[self.col_positions[col_name]] if self.col_positions[col_name] else None
-
     def __init__(
         self,
         maf_file: str,
@@ -464,108 +1064,202 @@ class Maf:
         chr_rep_as_int: bool = False,
     ):
         """
+        The supported columns are read with pyarrow and kept as columns; SNP objects are only
+        created on demand, when indexing into or iterating over the Maf. Backed Mafs build a
+        line-offset index of the file (persisted next to it as `<path>.mafidx`), so they can be
+        indexed without loading the file.
+
         :param maf_file: path to maf file
         :param backed: whether to load the maf file into memory or not
         :param bump_end_position: whether to bump the end position by 1 or not (this is useful for interval trees and interval lists)
         :param chr_rep_as_int: whether to represent the chromosome as an int or not (this is useful for interval trees and interval lists)
         """
-        # load from file
-        if isinstance(maf_file, str):
-            self.maf_file = maf_file
-            self.col_positions = extract_maf_col_positions(maf_file)
-            self.backed = backed
-            self.mafs: List[SNP] = []
-
-            # Open function depending on file type
-            open_func = gzip.open if is_gzipped(maf_file) else open
-            mode = "rt" if is_gzipped(maf_file) else "r"
+        if not isinstance(maf_file, str):
+            raise ValueError("mafs must be a path to a maf file")
 
-            if backed:
-                self.mafs = None
-                # https://stackoverflow.com/a/32607817/13175187
-                with open_func(self.maf_file, mode) as file:
-                    self.length = (
-                        sum(1 for line in file if line.strip()) - 1
-                    )  # subtract 1 for header
-            else:
-                with open_func(maf_file, mode) as f:
-                    # skip header
-                    lines = f.readlines()[1:]
-                    for line in lines:
-                        # some bed files have more than 3 columns, so we just take the first 3
-                        line = line.strip().split(MAF_FILE_DELIM)
-                        self.mafs.append(
-                            SNP(
-                                hugo_symbol=self._extract_value_from_col(
-                                    MAF_HUGO_SYMBOL_COL_NAME, line
-                                ),
-                                entrez_gene_id=self._extract_value_from_col(
-                                    MAF_ENTREZ_GENE_ID_COL_NAME, line
-                                ),
-                                center=self._extract_value_from_col(MAF_CENTER_COL_NAME, line),
-                                ncbi_build=self._extract_value_from_col(
-                                    MAF_NCBI_BUILD_COL_NAME, line
-                                ),
-                                chromosome=self._extract_value_from_col(
-                                    MAF_CHROMOSOME_COL_NAME, line
-                                ),
-                                start_position=int(
-                                    self._extract_value_from_col(MAF_START_COL_NAME, line)
-                                ),
-                                end_position=int(
-                                    self._extract_value_from_col(MAF_END_COL_NAME, line)
-                                ),
-                                strand=self._extract_value_from_col(MAF_STRAND_COL_NAME, line),
-                            )
-                        )
-                    self.length = len(self.mafs)
-
-                # post process according to flags
-                for maf in self.mafs:
-                    if bump_end_position:
-                        maf.end_position += 1
-                    if not chr_rep_as_int:
-                        maf.chromosome = "chr" + str(maf.chromosome)
+        self.maf_file = maf_file
+        self.col_positions = extract_maf_col_positions(maf_file)
+        self.backed = backed
+        self.bump_end_position = bump_end_position
+        self.chr_rep_as_int = chr_rep_as_int
+        self._index: Union[MafIndex, None] = None
+        self._table: Union[pa.Table, None] = None
+
+        if backed:
+            self._index = MafIndex.open(maf_file)
+            self.length = len(self._index)
         else:
-            raise ValueError("mafs must be a path to a maf file")
+            self._table = self._read_table()
+            self.length = self._table.num_rows
+
+    def _csv_options(self) -> Tuple[pacsv.ReadOptions, pacsv.ParseOptions, pacsv.ConvertOptions]:
+        """
+        Options to read the supported columns of the MAF file with pyarrow.
+        """
+        columns = [name for name, position in self.col_positions.items() if position is not None]
+        column_types = {name: pa.string() for name in columns}
+        column_types[MAF_START_COL_NAME] = pa.int64()
+        column_types[MAF_END_COL_NAME] = pa.int64()
+        return (
+            pacsv.ReadOptions(block_size=MAF_READ_BLOCK_SIZE),
+            pacsv.ParseOptions(delimiter=MAF_FILE_DELIM, quote_char=False),
+            pacsv.ConvertOptions(
+                include_columns=columns, column_types=column_types, strings_can_be_null=False
+            ),
+        )
+
+    def _input_stream(self) -> pa.NativeFile:
+        return pa.input_stream(
+            self.maf_file, compression="gzip" if is_gzipped(self.maf_file) else None
+        )
+
+    def _post_process(self, table: pa.Table) -> pa.Table:
+        """
+        Dictionary-encode the chromosomes, and apply the `bump_end_position` and
+        `chr_rep_as_int` flags, on whole columns.
+
+        :param table: columns read from the MAF file
+        :return: processed columns
+        """
+        if MAF_CHROMOSOME_COL_NAME in table.column_names:
+            chroms = table.column(MAF_CHROMOSOME_COL_NAME).dictionary_encode().combine_chunks()
+            if not self.chr_rep_as_int:
+                # only the (few) distinct chromosome names are rewritten
+                chroms = pa.DictionaryArray.from_arrays(
+                    chroms.indices, pc.binary_join_element_wise("chr", chroms.dictionary, "")
+                )
+            table = table.set_column(
+                table.column_names.index(MAF_CHROMOSOME_COL_NAME), MAF_CHROMOSOME_COL_NAME, chroms
+            )
+        if self.bump_end_position and MAF_END_COL_NAME in table.column_names:
+            table = table.set_column(
+                table.column_names.index(MAF_END_COL_NAME),
+                MAF_END_COL_NAME,
+                pc.add(table.column(MAF_END_COL_NAME), 1),
+            )
+        return table
+
+    def _read_table(self) -> pa.Table:
+        """
+        Read the supported columns of the whole MAF file.
+        """
+        read_options, parse_options, convert_options = self._csv_options()
+        with self._input_stream() as stream:
+            table = pacsv.read_csv(
+                stream,
+                read_options=read_options,
+                parse_options=parse_options,
+                convert_options=convert_options,
+            )
+        return self._post_process(table)
+
+    def _iter_tables(self) -> Iterator[pa.Table]:
+        """
+        Iterate over the supported columns of the MAF file in batches of at most
+        `MAF_BATCH_SIZE` rows, streaming the file if the Maf is backed.
+        """
+        if not self.backed:
+            yield from (
+                pa.Table.from_batches([batch])
+                for batch in self._table.to_batches(max_chunksize=MAF_BATCH_SIZE)
+            )
+            return
+
+        read_options, parse_options, convert_options = self._csv_options()
+        with self._input_stream() as stream:
+            reader = pacsv.open_csv(
+                stream,
+                read_options=read_options,
+                parse_options=parse_options,
+                convert_options=convert_options,
+            )
+            for batch in reader:
+                yield self._post_process(pa.Table.from_batches([batch]))
+
+    @staticmethod
+    def _snp_from_row(row: dict) -> "SNP":
+        return SNP(
+            hugo_symbol=row.get(MAF_HUGO_SYMBOL_COL_NAME),
+            entrez_gene_id=row.get(MAF_ENTREZ_GENE_ID_COL_NAME),
+            center=row.get(MAF_CENTER_COL_NAME),
+            ncbi_build=row.get(MAF_NCBI_BUILD_COL_NAME),
+            chromosome=row.get(MAF_CHROMOSOME_COL_NAME),
+            start_position=row.get(MAF_START_COL_NAME),
+            end_position=row.get(MAF_END_COL_NAME),
+            strand=row.get(MAF_STRAND_COL_NAME),
+        )
+
+    def _parse_line(self, line: bytes) -> "SNP":
+        """
+        Parse a row read through the line-offset index of a backed Maf.
+
+        :param line: row of the MAF file
+        :return: SNP
+        """
+        fields = line.decode("utf-8").split(MAF_FILE_DELIM)
+        row = {
+            name: fields[position]
+            for name, position in self.col_positions.items()
+            if position is not None and position < len(fields)
+        }
+        for name in (MAF_START_COL_NAME, MAF_END_COL_NAME):
+            if name in row:
+                row[name] = int(row[name])
+        if self.bump_end_position and MAF_END_COL_NAME in row:
+            row[MAF_END_COL_NAME] += 1
+        if not self.chr_rep_as_int and MAF_CHROMOSOME_COL_NAME in row:
+            row[MAF_CHROMOSOME_COL_NAME] = "chr" + row[MAF_CHROMOSOME_COL_NAME]
+        return self._snp_from_row(row)
+
+    @property
+    def mafs(self) -> Union[List["SNP"], None]:
+        """
+        Materialize all SNPs as a list of SNP objects.
+
+        Kept for backwards compatibility. Prefer indexing into, or iterating over, the Maf,
+        which creates SNP objects on demand.
+        """
+        if self.backed:
+            return None
+        return list(self)
 
     def __len__(self):
         return self.length
 
     def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(self.length))]
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("Maf index out of range")
         if self.backed:
-            raise NotImplementedError("Backed MAFs do not currently support indexing.")
-        else:
-            return self.mafs[key]
+            return self._parse_line(self._index.read_lines([key])[0])
+        return self._snp_from_row(self._table.slice(key, 1).to_pylist()[0])
 
     def __iter__(self):
-        if self.backed:
-            # Open function depending on file type
-            open_func = gzip.open if is_gzipped(self.maf_file) else open
-            mode = "rt" if is_gzipped(self.maf_file) else "r"
-
-            with open_func(self.maf_file, mode) as f:
-                # skip header
-                for i, line in enumerate(f):
-                    if i == 0:
-                        continue
-                    line = line.strip().split(MAF_FILE_DELIM)
-                    yield SNP(
-                        hugo_symbol=self._extract_value_from_col(MAF_HUGO_SYMBOL_COL_NAME, line),
-                        entrez_gene_id=self._extract_value_from_col(
-                            MAF_ENTREZ_GENE_ID_COL_NAME, line
-                        ),
-                        center=self._extract_value_from_col(MAF_CENTER_COL_NAME, line),
-                        ncbi_build=self._extract_value_from_col(MAF_NCBI_BUILD_COL_NAME, line),
-                        chromosome=self._extract_value_from_col(MAF_CHROMOSOME_COL_NAME, line),
-                        start_position=self._extract_value_from_col(MAF_START_COL_NAME, line),
-                        end_position=self._extract_value_from_col(MAF_END_COL_NAME, line),
-                        strand=self._extract_value_from_col(MAF_STRAND_COL_NAME, line),
-                    )
+        for table in self._iter_tables():
+            for row in table.to_pylist():
+                yield self._snp_from_row(row)
 
-        else:
-            for maf in self.mafs:
-                yield maf
+    def to_region_set(self) -> RegionSet:
+        """
+        Convert the SNPs to an in-memory RegionSet, without creating SNP or Region objects. As
+        in `SNP.to_region`, SNPs that start and end at the same position get an end one
+        position further.
+
+        :return: RegionSet
+        """
+        table = self._read_table() if self.backed else self._table
+        chroms = table.column(MAF_CHROMOSOME_COL_NAME).combine_chunks()
+        starts = table.column(MAF_START_COL_NAME).to_numpy().astype(REGION_COORD_DTYPE, copy=False)
+        ends = table.column(MAF_END_COL_NAME).to_numpy().astype(REGION_COORD_DTYPE, copy=False)
+        return RegionSet._from_columns(
+            chroms.indices.to_numpy(zero_copy_only=False).astype(CHROM_CODE_DTYPE, copy=False),
+            np.asarray(chroms.dictionary.to_pylist(), dtype=object),
+            starts,
+            np.where(starts == ends, ends + 1, ends),
+        )
 
     def __repr__(self):
         return f"MAF({self.maf_file})"
@@ -580,29 +1274,411 @@ class TokenizedRegionSet(object):
         self.universe = universe
 
 
-# Write a class representing a collection of RegionSets
-# TODO: This shouldn't read in the actual files, it should just represent the files and use lazy loading
-class RegionSetCollection(object):
-    """Represents a collection of RegionSets"""
+def _file_size(path: Union[str, None]) -> Union[int, None]:
+    if path is None or is_url(path) or not os.path.isfile(path):
+        return None
+    return os.path.getsize(path)
 
-    def __init__(self, region_sets: List[RegionSet] = None, file_globs: List[str] = None):
-        if region_sets:
-            self.region_sets = region_sets
-        elif file_globs:
-            self.region_sets = []
-            for glob in file_globs:
-                self.region_sets.extend([RegionSet(path) for path in glob.glob(glob)])
 
-    def __getitem__(self, key):
-        return self.region_sets[key]
+def region_set_to_arrow(region_set: RegionSet, file_id: str) -> pa.Table:
+    """
+    Convert a RegionSet to an Arrow table with `file_id`, `chrom`, `start` and `end` columns. The
+    file id and chromosomes are dictionary-encoded, so the region columns are not copied.
 
-    def __len__(self):
-        return len(self.region_sets)
+    :param region_set: RegionSet to convert
+    :param file_id: identifier of the file the regions come from
+    :return: Arrow table
+    """
+    chrom_codes, starts, ends = region_set._columns()
+    return pa.table(
+        {
+            "file_id": pa.DictionaryArray.from_arrays(
+                np.zeros(len(starts), dtype=np.int32), pa.array([file_id], type=pa.string())
+            ),
+            "chrom": pa.DictionaryArray.from_arrays(
+                np.asarray(chrom_codes, dtype=np.int32),
+                pa.array(region_set.chrom_names.tolist(), type=pa.string()),
+            ),
+            "start": np.asarray(starts),
+            "end": np.asarray(ends),
+        }
+    )
+
+
+class RegionSetCollection(BedSet):
+    """
+    Represents a collection of RegionSets.
+
+    Like a BedSet, members given as paths (or expanded from globs) are loaded lazily, with at
+    most `cache_size` of them in memory, or all at once, in parallel, with `load_all`. The
+    collection can be described by a manifest of paths, file sizes and identifiers, and exported
+    as a single Parquet dataset.
+    """
+
+    def __init__(
+        self,
+        region_sets: Union[List[RegionSet], List[str], None] = None,
+        file_globs: List[str] = None,
+        cache_size: Union[int, None] = BEDSET_CACHE_SIZE,
+    ):
+        """
+        :param region_sets: list of RegionSets, or of paths to BED files
+        :param file_globs: glob patterns of BED files to add to the collection, in sorted order
+        :param cache_size: number of lazily loaded RegionSets kept in memory, None to keep all [Default: 128]
+        """
+        sources = list(region_sets) if region_sets else []
+        for pattern in file_globs or []:
+            sources.extend(sorted(glob.glob(pattern)))
+        super().__init__(sources, cache_size=cache_size)
+
+    @classmethod
+    def from_manifest(
+        cls, manifest_path: str, cache_size: Union[int, None] = BEDSET_CACHE_SIZE
+    ) -> "RegionSetCollection":
+        """
+        Create a collection from a manifest written by `save_manifest`. Identifiers in the
+        manifest are reused for files whose size has not changed.
+
+        :param manifest_path: path to the manifest
+        :param cache_size: number of lazily loaded RegionSets kept in memory, None to keep all [Default: 128]
+        :return: RegionSetCollection
+        """
+        manifest = pd.read_csv(manifest_path, sep="\t", dtype={"identifier": str})
+        collection = cls(manifest["path"].tolist(), cache_size=cache_size)
+        for indx, row in enumerate(manifest.itertuples(index=False)):
+            if not pd.isna(row.identifier) and _file_size(row.path) == row.size:
+                collection._bed_identifiers[indx] = row.identifier
+        return collection
+
+    def _source_path(self, indx: int) -> Union[str, None]:
+        source = self._sources[indx]
+        if isinstance(source, RegionSet):
+            return source.path
+        return source if isinstance(source, str) else None
+
+    def manifest(self, workers: int = 1) -> pd.DataFrame:
+        """
+        Describe the members of the collection, computing their identifiers if needed.
+
+        :param workers: number of processes used to compute the identifiers
+        :return: DataFrame with the path, size (in bytes) and identifier of each member
+        """
+        identifiers = self.compute_bed_identifiers(workers=workers)
+        paths = [self._source_path(indx) for indx in range(len(self))]
+        return pd.DataFrame(
+            {
+                "path": paths,
+                "size": pd.array([_file_size(path) for path in paths], dtype="Int64"),
+                "identifier": identifiers,
+            }
+        )
+
+    def save_manifest(self, manifest_path: str, workers: int = 1) -> str:
+        """
+        Save the manifest of the collection as a tab-separated file.
+
+        :param manifest_path: path to the manifest
+        :param workers: number of processes used to compute the identifiers
+        :return: path to the manifest
+        """
+        self.manifest(workers=workers).to_csv(manifest_path, sep="\t", index=False)
+        return manifest_path
+
+    def _detached(self, indx: int) -> RegionSet:
+        """
+        Get a member without touching the LRU cache, so that it can be called from worker
+        threads.
+
+        :param indx: index of the member
+        :return: RegionSet
+        """
+        source = self._sources[indx]
+        if isinstance(source, RegionSet):
+            return source
+        region_set = self._cache.get(indx)
+        return region_set if region_set is not None else RegionSet(source)
+
+    def to_arrow(self, workers: int = 1) -> pa.Table:
+        """
+        Concatenate all members into one Arrow table with `file_id` (the BED file identifier),
+        `chrom`, `start` and `end` columns.
+
+        :param workers: number of threads used to load the members (and processes used to
+            compute their identifiers)
+        :return: Arrow table
+        """
+        identifiers = self.compute_bed_identifiers(workers=workers)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            tables = list(
+                executor.map(
+                    lambda indx: region_set_to_arrow(self._detached(indx), identifiers[indx]),
+                    range(len(self)),
+                )
+            )
+        if not tables:
+            return region_set_to_arrow(RegionSet.from_arrays([], [], []), "")
+        return pa.concat_tables(tables)
+
+    def to_parquet(self, path: str, workers: int = 1) -> str:
+        """
+        Export the collection as a Parquet dataset: a directory with one Parquet file per member,
+        each with `file_id` (the BED file identifier), `chrom`, `start` and `end` columns. Read
+        it back with `pyarrow.dataset.dataset(path)`.
+
+        :param path: path to the dataset directory; existing members of a previous export are
+            replaced
+        :param workers: number of threads used to load and write the members (and processes
+            used to compute their identifiers)
+        :return: path to the dataset directory
+        """
+        identifiers = self.compute_bed_identifiers(workers=workers)
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, "part-*.parquet")):
+            os.remove(stale)
+
+        def write_member(indx: int) -> None:
+            table = region_set_to_arrow(self._detached(indx), identifiers[indx])
+            pq.write_table(table, os.path.join(path, f"part-{indx:06d}.parquet"))
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            list(executor.map(write_member, range(len(self))))
+        return path
 
 
-# Do we need an EmbeddingSet class?
 class EmbeddingSet(object):
-    """Represents embeddings and labels"""
+    """
+    Represents embeddings and labels
+
+    Embeddings are either held in memory, or persisted with `save` as an on-disk store (a
+    directory with the raw float32/float16 vectors, their metadata, and a table of identifiers
+    and labels) that `open` memory-maps. Slicing an opened EmbeddingSet gives views of the
+    store, gathering vectors by identifier reads only the requested rows, and appending writes
+    the new rows at the end of the store.
+    """
 
     embeddings: np.ndarray
     labels: list
+
+    def __init__(
+        self,
+        embeddings: np.ndarray = None,
+        labels: list = None,
+        identifiers: List[str] = None,
+    ):
+        """
+        :param embeddings: embedding vectors, a np.ndarray with shape of (n, <vector size>) [Default: None - empty EmbeddingSet]
+        :param labels: list of n labels [Default: None - no labels]
+        :param identifiers: list of n identifiers, used to gather vectors [Default: the row numbers]
+        """
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        self.embeddings = np.asarray(embeddings)
+        n_vectors = len(self.embeddings)
+        self.labels = list(labels) if labels is not None else [None] * n_vectors
+        self.identifiers = (
+            [str(identifier) for identifier in identifiers]
+            if identifiers is not None
+            else [str(i) for i in range(n_vectors)]
+        )
+        if not len(self.labels) == len(self.identifiers) == n_vectors:
+            raise ValueError("The numbers of embeddings, labels and identifiers must be the same.")
+        self.path: Union[str, None] = None
+        self._positions: Union[Tuple[pd.Index, np.ndarray], None] = None
+
+    @classmethod
+    def open(cls, path: str) -> "EmbeddingSet":
+        """
+        Open an EmbeddingSet saved with `save`, memory-mapping its vectors.
+
+        :param path: path to the EmbeddingSet directory
+        :return: EmbeddingSet
+        """
+        with open(os.path.join(path, EMBEDDING_SET_META_FILE_NAME), "r") as f:
+            meta = json.load(f)
+        check_binary_version(meta, EMBEDDING_SET_VERSION, path)
+        table = pd.read_csv(
+            os.path.join(path, EMBEDDING_SET_LABELS_FILE_NAME),
+            sep="\t",
+            dtype=str,
+            keep_default_na=False,
+        )
+
+        instance = cls.__new__(cls)
+        instance.path = path
+        instance._positions = None
+        instance._meta = meta
+        instance.embeddings = instance._map_vectors()
+        instance.identifiers = table["identifier"].tolist()
+        instance.labels = [label if label != "" else None for label in table["label"].tolist()]
+        return instance
+
+    def _map_vectors(self) -> np.ndarray:
+        """
+        Memory-map the vectors of the on-disk store.
+        """
+        shape = (self._meta["length"], self._meta["dim"])
+        if shape[0] == 0:
+            return np.empty(shape, dtype=self._meta["dtype"])
+        return np.memmap(
+            os.path.join(self.path, EMBEDDING_SET_VECTORS_FILE_NAME),
+            dtype=self._meta["dtype"],
+            mode="r",
+            shape=shape,
+        )
+
+    def _write_meta(self) -> NoReturn:
+        meta_path = os.path.join(self.path, EMBEDDING_SET_META_FILE_NAME)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(self._meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def save(self, path: str, dtype: str = None) -> str:
+        """
+        Persist the EmbeddingSet as an on-disk store, which can be memory-mapped by `open`.
+
+        :param path: path to the EmbeddingSet directory
+        :param dtype: dtype of the stored vectors, e.g. float32 or float16 [Default: float32,
+            or the dtype of the vectors if they are float16]
+        :return: path to the EmbeddingSet directory
+        """
+        if dtype is None:
+            dtype = "float16" if self.embeddings.dtype == np.float16 else "float32"
+        os.makedirs(path, exist_ok=True)
+
+        # written to a temporary file first, since the vectors may be memory-mapped from the
+        # file being replaced (when saving an opened EmbeddingSet to its own directory)
+        vectors_path = os.path.join(path, EMBEDDING_SET_VECTORS_FILE_NAME)
+        tmp_path = f"{vectors_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                # written in blocks, so that memory-mapped vectors are not loaded at once
+                for offset in range(0, len(self.embeddings), EMBEDDING_SET_WRITE_BATCH_SIZE):
+                    block = self.embeddings[offset : offset + EMBEDDING_SET_WRITE_BATCH_SIZE]
+                    f.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+            os.replace(tmp_path, vectors_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._write_labels(path, self.identifiers, self.labels, mode="w")
+
+        saved = EmbeddingSet.__new__(EmbeddingSet)
+        saved.path = path
+        saved._meta = {
+            "version": EMBEDDING_SET_VERSION,
+            "dtype": np.dtype(dtype).name,
+            "dim": self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0,
+            "length": len(self.embeddings),
+        }
+        saved._write_meta()
+        return path
+
+    @staticmethod
+    def _write_labels(path: str, identifiers: list, labels: list, mode: str) -> NoReturn:
+        pd.DataFrame(
+            {
+                "identifier": identifiers,
+                "label": ["" if label is None else str(label) for label in labels],
+            }
+        ).to_csv(
+            os.path.join(path, EMBEDDING_SET_LABELS_FILE_NAME),
+            sep="\t",
+            index=False,
+            header=mode == "w",
+            mode=mode,
+        )
+
+    def append(
+        self, embeddings: np.ndarray, labels: list = None, identifiers: List[str] = None
+    ) -> NoReturn:
+        """
+        Add vectors to the EmbeddingSet. For opened EmbeddingSets, the vectors are appended to
+        the on-disk store.
+
+        :param embeddings: embedding vectors, a np.ndarray with shape of (n, <vector size>)
+        :param labels: list of n labels [Default: None - no labels]
+        :param identifiers: list of n identifiers [Default: the row numbers]
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings))
+        n_vectors = len(embeddings)
+        labels = list(labels) if labels is not None else [None] * n_vectors
+        identifiers = (
+            [str(identifier) for identifier in identifiers]
+            if identifiers is not None
+            else [str(i) for i in range(len(self), len(self) + n_vectors)]
+        )
+        if not len(labels) == len(identifiers) == n_vectors:
+            raise ValueError("The numbers of embeddings, labels and identifiers must be the same.")
+        if len(self) > 0 and embeddings.shape[1] != self.embeddings.shape[1]:
+            raise ValueError(
+                f"Vectors of size {embeddings.shape[1]} can not be added to an EmbeddingSet of "
+                f"vectors of size {self.embeddings.shape[1]}."
+            )
+
+        if self.path is None:
+            self.embeddings = (
+                np.concatenate((self.embeddings, embeddings)) if len(self) > 0 else embeddings
+            )
+        else:
+            with open(os.path.join(self.path, EMBEDDING_SET_VECTORS_FILE_NAME), "ab") as f:
+                f.write(np.ascontiguousarray(embeddings, dtype=self._meta["dtype"]).tobytes())
+            self._write_labels(self.path, identifiers, labels, mode="a")
+            self._meta["length"] += n_vectors
+            self._meta["dim"] = embeddings.shape[1]
+            self._write_meta()
+            self.embeddings = self._map_vectors()
+
+        self.labels.extend(labels)
+        self.identifiers.extend(identifiers)
+        self._positions = None
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def __getitem__(self, key) -> Union[np.ndarray, "EmbeddingSet"]:
+        """
+        Get a vector by position, or an EmbeddingSet of the selected vectors. Slices of opened
+        EmbeddingSets are views of the on-disk store.
+        """
+        if isinstance(key, (int, np.integer)):
+            return self.embeddings[key]
+        selection = np.arange(len(self))[key]
+        subset = EmbeddingSet.__new__(EmbeddingSet)
+        subset.embeddings = self.embeddings[key]
+        subset.labels = [self.labels[i] for i in selection.tolist()]
+        subset.identifiers = [self.identifiers[i] for i in selection.tolist()]
+        subset.path = None
+        subset._positions = None
+        return subset
+
+    def gather(self, identifiers: List[str]) -> np.ndarray:
+        """
+        Get vectors by identifier, reading only the requested rows. Duplicated identifiers
+        resolve to their first vector.
+
+        :param identifiers: identifiers of the vectors
+        :return: np.ndarray with one row per identifier
+        """
+        if self._positions is None:
+            stored = pd.Index(self.identifiers)
+            first = ~stored.duplicated(keep="first")
+            self._positions = (stored[first], np.flatnonzero(first))
+        index, rows = self._positions
+        found = index.get_indexer([str(identifier) for identifier in identifiers])
+        positions = np.full(len(found), -1, dtype=np.int64)
+        positions[found >= 0] = rows[found[found >= 0]]
+        if (positions < 0).any():
+            missing = [identifiers[i] for i in np.flatnonzero(positions < 0)[:5]]
+            raise KeyError(f"Identifiers not in the EmbeddingSet: {missing}")
+
+        # read the rows in storage order, for sequential access to memory-mapped vectors
+        order = np.argsort(positions, kind="stable")
+        gathered = np.empty(
+            (len(positions), self.embeddings.shape[1]), dtype=self.embeddings.dtype
+        )
+        gathered[order] = self.embeddings[positions[order]]
+        return gathered
+
+    def __repr__(self):
+        if self.path:
+            return f"EmbeddingSet({self.path}, n={len(self)})"
+        return f"EmbeddingSet(n={len(self)})"
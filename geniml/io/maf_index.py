@@ -0,0 +1,166 @@
+import logging
+from typing import List
+
+import numpy as np
+
+from .const import MAF_INDEX_EXT, MAF_INDEX_MAGIC, MAF_INDEX_VERSION
+from .utils import (
+    binary_is_fresh,
+    check_binary_version,
+    is_gzip_file,
+    iter_lines,
+    iter_uncompressed,
+    read_columnar_file,
+    read_uncompressed_range,
+    source_stat,
+    write_columnar_file,
+)
+
+_LOGGER = logging.getLogger("bbclient")
+
+
+def maf_index_path(file_path: str) -> str:
+    """
+    Get the path of the line-offset index sidecar for a MAF file.
+
+    :param file_path: path to MAF file
+    :return: path to the index
+    """
+    return file_path + MAF_INDEX_EXT
+
+
+class MafIndex:
+    """
+    Line-offset index of a MAF file, for random access to its rows without loading the file.
+
+    Like `BedIndex`, the index stores the byte offset of every row (the header excluded) and the
+    layout of the gzip members of compressed files, and is persisted next to the MAF file.
+    """
+
+    def __init__(self, path: str, header: dict, columns: dict):
+        """
+        :param path: path to the indexed MAF file
+        :param header: index metadata
+        :param columns: index arrays
+        """
+        self.path = path
+        self.compressed: bool = header["compressed"]
+        self._header = header
+        self.offsets: np.ndarray = columns["offsets"]
+        self.member_offsets: np.ndarray = columns["member_offsets"]
+        self.member_starts: np.ndarray = columns["member_starts"]
+
+    @classmethod
+    def build(cls, path: str) -> "MafIndex":
+        """
+        Index a MAF file with a single pass over it. The first line is the header; blank lines
+        are not indexed.
+
+        :param path: path to MAF file
+        :return: MafIndex
+        """
+        compressed = is_gzip_file(path)
+        member_offsets, member_starts = [], []
+        offsets = []
+        is_header = True
+
+        chunks = iter_uncompressed(path, compressed, member_offsets, member_starts)
+        for line_offsets, lines in iter_lines(chunks):
+            keep = [i for i, line in enumerate(lines) if line.strip()]
+            if is_header and keep:
+                keep = keep[1:]
+                is_header = False
+            offsets.append(line_offsets[keep])
+
+        header = {
+            "version": MAF_INDEX_VERSION,
+            "compressed": compressed,
+            "source": source_stat(path),
+        }
+        columns = {
+            "offsets": (
+                np.concatenate(offsets).astype(np.uint64) if offsets else np.empty(0, np.uint64)
+            ),
+            "member_offsets": np.asarray(member_offsets, dtype=np.uint64),
+            "member_starts": np.asarray(member_starts, dtype=np.uint64),
+        }
+        return cls(path, header, columns)
+
+    @classmethod
+    def load(cls, path: str, index_path: str = None) -> "MafIndex":
+        """
+        Load (memory-map) a persisted index.
+
+        :param path: path to the indexed MAF file
+        :param index_path: path to the index [Default: `<path>.mafidx`]
+        :return: MafIndex
+        """
+        index_path = index_path or maf_index_path(path)
+        header, columns = read_columnar_file(index_path, MAF_INDEX_MAGIC)
+        check_binary_version(header, MAF_INDEX_VERSION, index_path)
+        return cls(path, header, columns)
+
+    @classmethod
+    def open(cls, path: str, persist: bool = True) -> "MafIndex":
+        """
+        Load the index of a MAF file, building (and persisting) it if it is missing or stale.
+
+        :param path: path to MAF file
+        :param persist: whether to save a newly built index next to the MAF file
+        :return: MafIndex
+        """
+        index_path = maf_index_path(path)
+        if binary_is_fresh(index_path, path, MAF_INDEX_MAGIC, MAF_INDEX_VERSION):
+            return cls.load(path, index_path)
+
+        index = cls.build(path)
+        if persist:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                _LOGGER.warning(f"Could not save index of '{path}', keeping it in memory: {e}")
+        return index
+
+    def save(self, index_path: str = None) -> str:
+        """
+        Persist the index.
+
+        :param index_path: path to the index [Default: `<path>.mafidx`]
+        :return: path to the index
+        """
+        index_path = index_path or maf_index_path(self.path)
+        columns = {
+            "offsets": self.offsets,
+            "member_offsets": self.member_offsets,
+            "member_starts": self.member_starts,
+        }
+        write_columnar_file(index_path, MAF_INDEX_MAGIC, self._header, columns)
+        return index_path
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_lines(self, indices: np.ndarray) -> List[bytes]:
+        """
+        Read rows by index, in the given order. Consecutive rows are read together.
+
+        :param indices: row indices
+        :return: rows, without their line endings
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return []
+
+        lines = []
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        for run in np.split(indices, breaks):
+            first, last = int(run[0]), int(run[-1])
+            base = int(self.offsets[first])
+            size = int(self.offsets[last + 1]) - base if last + 1 < len(self) else -1
+            data = read_uncompressed_range(
+                self.path, self.compressed, self.member_offsets, self.member_starts, base, size
+            )
+            for offset in (self.offsets[first : last + 1] - base).tolist():
+                line_end = data.find(b"\n", offset)
+                lines.append(data[offset : line_end if line_end != -1 else None].rstrip(b"\r"))
+        return lines
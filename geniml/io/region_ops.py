@@ -0,0 +1,125 @@
+from typing import Tuple
+
+import numpy as np
+
+from .chromosomes import natural_chrom_ranks
+
+# (chromosome codes, starts, ends) of a batch of regions
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def sort_order(
+    chrom_names: np.ndarray, chrom_codes: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """
+    Order regions by chromosome (in natural order), start and end, like `sort -k1,1V -k2,2n`.
+
+    :param chrom_names: chromosome names
+    :param chrom_codes: index of each region's chromosome in chrom_names
+    :param starts: start position of each region
+    :param ends: end position of each region
+    :return: indices that sort the regions
+    """
+    ranks = natural_chrom_ranks(chrom_names)[chrom_codes]
+    return np.lexsort((ends, starts, ranks))
+
+
+def merge_sorted(
+    chrom_codes: np.ndarray, starts: np.ndarray, ends: np.ndarray, distance: int = 0
+) -> Columns:
+    """
+    Merge sorted regions that overlap, or are at most `distance` bases apart, like
+    `bedtools merge -d`.
+
+    :param chrom_codes: chromosome code of each region, sorted by chromosome
+    :param starts: start position of each region, sorted within each chromosome
+    :param ends: end position of each region
+    :param distance: maximum gap between merged regions; 0 merges book-ended regions
+    :return: merged regions
+    """
+    if len(starts) == 0:
+        return chrom_codes, starts, ends
+
+    new_chrom = chrom_codes[1:] != chrom_codes[:-1]
+    # running maximum of the ends within each chromosome, with the chromosome as the high bits
+    # of the key so that a single accumulate never carries an end over into the next chromosome
+    group = np.concatenate(([0], np.cumsum(new_chrom))).astype(np.int64) << 40
+    reach = np.maximum.accumulate(group + ends) - group
+
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = new_chrom | (starts[1:] - reach[:-1] > distance)
+    firsts = np.flatnonzero(first)
+    return chrom_codes[firsts], starts[firsts], np.maximum.reduceat(ends, firsts)
+
+
+def subtract_overlaps(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    query_idx: np.ndarray,
+    cut_starts: np.ndarray,
+    cut_ends: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Remove the overlapping parts of other regions from regions, like `bedtools subtract`.
+
+    The overlapping regions must not overlap each other, and each region's overlaps must be
+    given in position order (as returned by `IntervalIndex.overlaps` on merged regions).
+
+    :param starts: start position of each region
+    :param ends: end position of each region
+    :param query_idx: region of each overlap
+    :param cut_starts: start position of each overlapping region
+    :param cut_ends: end position of each overlapping region
+    :return: original region of each remaining piece, and the starts and ends of the pieces, in
+        the original order of the regions
+    """
+    first = np.ones(len(query_idx), dtype=bool)
+    first[1:] = query_idx[1:] != query_idx[:-1]
+    last = np.ones(len(query_idx), dtype=bool)
+    last[:-1] = first[1:]
+
+    # the piece before each overlap starts at the end of the previous overlap (or the region)
+    gap_starts = np.roll(cut_ends, 1)
+    gap_starts[first] = starts[query_idx[first]]
+    untouched = np.setdiff1d(np.arange(len(starts)), query_idx, assume_unique=False)
+
+    owners = np.concatenate((query_idx, query_idx[last], untouched))
+    piece_starts = np.concatenate((gap_starts, cut_ends[last], starts[untouched]))
+    piece_ends = np.concatenate((cut_starts, ends[query_idx[last]], ends[untouched]))
+
+    keep = piece_ends > piece_starts
+    owners, piece_starts, piece_ends = owners[keep], piece_starts[keep], piece_ends[keep]
+    order = np.argsort(owners, kind="stable")
+    return owners[order], piece_starts[order], piece_ends[order]
+
+
+def complement_merged(
+    chrom_codes: np.ndarray, starts: np.ndarray, ends: np.ndarray, chrom_sizes: np.ndarray
+) -> Columns:
+    """
+    Get the parts of the genome not covered by merged regions, like `bedtools complement`.
+
+    :param chrom_codes: chromosome code of each region (index into chrom_sizes), sorted by
+        chromosome
+    :param starts: start position of each region, sorted within each chromosome
+    :param ends: end position of each region
+    :param chrom_sizes: size of each chromosome
+    :return: uncovered regions, grouped by chromosome code
+    """
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = chrom_codes[1:] != chrom_codes[:-1]
+    last = np.ones(len(starts), dtype=bool)
+    last[:-1] = first[1:]
+
+    gap_starts = np.roll(ends, 1)
+    gap_starts[first] = 0
+    # the gap after the last region of each chromosome, or the whole chromosome if it is empty
+    tail_starts = np.zeros(len(chrom_sizes), dtype=ends.dtype)
+    tail_starts[chrom_codes[last]] = ends[last]
+
+    codes = np.concatenate((chrom_codes, np.arange(len(chrom_sizes))))
+    piece_starts = np.concatenate((gap_starts, tail_starts))
+    piece_ends = np.concatenate((np.minimum(starts, chrom_sizes[chrom_codes]), chrom_sizes))
+
+    keep = piece_ends > piece_starts
+    return codes[keep], piece_starts[keep], piece_ends[keep]
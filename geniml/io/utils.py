@@ -1,9 +1,17 @@
 import gzip
+import json
 import os
+import struct
+import zlib
 from hashlib import md5
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
 
 from .const import (
+    BED_IDENTIFIER_CHUNK_SIZE,
+    BED_INDEX_READ_CHUNK_SIZE,
+    CHROM_CODE_DTYPE,
     MAF_CENTER_COL_NAME,
     MAF_CHROMOSOME_COL_NAME,
     MAF_COLUMN,
@@ -14,7 +22,15 @@ from .const import (
     MAF_NCBI_BUILD_COL_NAME,
     MAF_START_COL_NAME,
     MAF_STRAND_COL_NAME,
+    REGION_COORD_DTYPE,
+    REGIONSET_BINARY_ALIGNMENT,
+    REGIONSET_BINARY_EXT,
+    REGIONSET_BINARY_MAGIC,
+    REGIONSET_BINARY_VERSION,
 )
+from .exceptions import BinaryFileReadError
+
+GZIP_MAGIC = b"\x1f\x8b"
 
 
 def is_gzipped(file: str) -> bool:
@@ -28,6 +44,131 @@ def is_gzipped(file: str) -> bool:
     return file_extension == ".gz"
 
 
+def is_gzip_file(file_path: str) -> bool:
+    """
+    Check if a file is gzip (or BGZF) compressed by looking at its magic bytes.
+
+    :param file_path: path to file
+    :return: True if the file is gzip compressed
+    """
+    with open(file_path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def iter_uncompressed(
+    file_path: str,
+    compressed: bool,
+    member_offsets: List[int],
+    member_starts: List[int],
+    chunk_size: int = BED_INDEX_READ_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Stream the (decompressed) bytes of a file, recording the layout of its gzip members.
+
+    Every gzip member (every block, for BGZF files) can be decompressed on its own, so
+    recording where each member starts, both in the compressed file and in the decompressed
+    stream, allows seeking close to any decompressed offset later on.
+
+    :param file_path: path to file
+    :param compressed: whether the file is gzip compressed
+    :param member_offsets: list that receives the compressed offset of each member
+    :param member_starts: list that receives the decompressed offset of each member
+    :param chunk_size: number of bytes to read at a time
+    """
+    with open(file_path, "rb") as raw:
+        if not compressed:
+            member_offsets.append(0)
+            member_starts.append(0)
+            while True:
+                chunk = raw.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        consumed = 0
+        produced = 0
+        decompressor = None
+        pending = b""
+        while True:
+            if not pending:
+                pending = raw.read(chunk_size)
+                if not pending:
+                    break
+            if decompressor is None:
+                member_offsets.append(consumed)
+                member_starts.append(produced)
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            out = decompressor.decompress(pending)
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                consumed += len(pending) - len(unused)
+                pending = unused
+                decompressor = None
+            else:
+                consumed += len(pending)
+                pending = b""
+            if out:
+                produced += len(out)
+                yield out
+
+
+def read_uncompressed_range(
+    file_path: str,
+    compressed: bool,
+    member_offsets: np.ndarray,
+    member_starts: np.ndarray,
+    offset: int,
+    size: int,
+) -> bytes:
+    """
+    Read a range of the (decompressed) bytes of a file, starting at the closest gzip member.
+
+    :param file_path: path to file
+    :param compressed: whether the file is gzip compressed
+    :param member_offsets: compressed offset of each gzip member (see `iter_uncompressed`)
+    :param member_starts: decompressed offset of each gzip member
+    :param offset: offset in the decompressed file
+    :param size: number of bytes to read, -1 to read until the end of the file
+    :return: bytes
+    """
+    with open(file_path, "rb") as raw:
+        if not compressed:
+            raw.seek(offset)
+            return raw.read(size)
+
+        member = int(np.searchsorted(member_starts, offset, side="right")) - 1
+        raw.seek(int(member_offsets[member]))
+        # GzipFile reads on from the current position, which is the start of a member
+        with gzip.GzipFile(fileobj=raw) as f:
+            f.seek(offset - int(member_starts[member]))
+            return f.read(size)
+
+
+def iter_lines(chunks: Iterator[bytes]) -> Iterator[Tuple[np.ndarray, List[bytes]]]:
+    """
+    Split a stream of bytes into lines, keeping track of the offset at which each line starts.
+
+    :param chunks: stream of bytes
+    :return: generator of (line offsets, lines) batches
+    """
+    carry = b""
+    position = 0
+    for chunk in chunks:
+        buffer = carry + chunk
+        last_newline = buffer.rfind(b"\n")
+        if last_newline == -1:
+            carry = buffer
+            continue
+        lines = buffer[:last_newline].split(b"\n")
+        lengths = np.fromiter((len(line) + 1 for line in lines), dtype=np.int64, count=len(lines))
+        offsets = position + np.concatenate(([0], np.cumsum(lengths[:-1])))
+        yield offsets, lines
+        carry = buffer[last_newline + 1 :]
+        position += last_newline + 1
+    if carry:
+        yield np.array([position], dtype=np.int64), [carry]
+
+
 def extract_maf_col_positions(file: str) -> Dict[MAF_COLUMN, Union[int, None]]:
     """
     Extract the column positions of the MAF file.
@@ -95,3 +236,312 @@ def compute_md5sum_bedset(bedset: List[str]) -> str:
     :return: md5sum of the bedset
     """
     return md5("".join(bedset).encode()).hexdigest()
+
+
+class JoinedDigest:
+    """
+    md5 digest of the comma-joined values of a column, fed chunk by chunk.
+
+    Equivalent to `md5(",".join(values).encode("utf-8"))` without building the joined string.
+    """
+
+    def __init__(self):
+        self._md5 = md5()
+        self._empty = True
+
+    def update(self, values: List[bytes]) -> None:
+        """
+        Add the next chunk of values.
+
+        :param values: utf-8 encoded values
+        """
+        if not values:
+            return
+        if not self._empty:
+            self._md5.update(b",")
+        self._md5.update(b",".join(values))
+        self._empty = False
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+
+def combine_bed_digests(chr_digest: str, start_digest: str, end_digest: str) -> str:
+    """
+    Combine the column digests of a bed file into the bed identifier.
+
+    :param chr_digest: digest of the chromosome column
+    :param start_digest: digest of the start column
+    :param end_digest: digest of the end column
+    :return: bed identifier
+    """
+    return md5(",".join([chr_digest, start_digest, end_digest]).encode("utf-8")).hexdigest()
+
+
+def compute_bed_identifier_from_columns(
+    chrom_names: np.ndarray,
+    chrom_codes: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    chunk_size: int = BED_IDENTIFIER_CHUNK_SIZE,
+) -> str:
+    """
+    Compute the bed identifier of region columns, hashing them chunk by chunk.
+
+    :param chrom_names: chromosome names
+    :param chrom_codes: index of each region's chromosome in chrom_names
+    :param starts: start position of each region
+    :param ends: end position of each region
+    :param chunk_size: number of regions to hash at a time
+    :return: bed identifier
+    """
+    encoded_names = np.asarray([str(name).encode("utf-8") for name in chrom_names], dtype=object)
+    chr_digest, start_digest, end_digest = JoinedDigest(), JoinedDigest(), JoinedDigest()
+    for i in range(0, len(starts), chunk_size):
+        chr_digest.update(encoded_names[chrom_codes[i : i + chunk_size]].tolist())
+        start_digest.update([b"%d" % v for v in starts[i : i + chunk_size].tolist()])
+        end_digest.update([b"%d" % v for v in ends[i : i + chunk_size].tolist()])
+    return combine_bed_digests(
+        chr_digest.hexdigest(), start_digest.hexdigest(), end_digest.hexdigest()
+    )
+
+
+def regionset_binary_path(file_path: str) -> str:
+    """
+    Get the path of the binary sidecar for a bed file.
+
+    :param file_path: path to bed file
+    :return: path to the binary sidecar
+    """
+    return file_path + REGIONSET_BINARY_EXT
+
+
+def source_stat(file_path: str) -> Dict[str, int]:
+    """
+    Get the size and modification time of a file, used to detect stale binary sidecars.
+
+    :param file_path: path to file
+    :return: dictionary with size and mtime in nanoseconds
+    """
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _pad_to_alignment(offset: int) -> int:
+    """
+    Round an offset up to the binary format alignment.
+
+    :param offset: byte offset
+    :return: aligned byte offset
+    """
+    return -(-offset // REGIONSET_BINARY_ALIGNMENT) * REGIONSET_BINARY_ALIGNMENT
+
+
+def write_columnar_file(
+    file_path: str, magic: bytes, header: dict, columns: Dict[str, np.ndarray]
+) -> None:
+    """
+    Write a set of 1-D arrays to a memory-mappable binary file.
+
+    The file holds the magic bytes, a small JSON header (the given header plus the column
+    layout) and the raw column arrays, each aligned so it can be opened with `np.memmap`. The
+    file is written to a temporary path first and moved into place, so concurrent readers
+    never see a partial file.
+
+    :param file_path: path to the file to write
+    :param magic: magic bytes identifying the file type
+    :param header: JSON serializable metadata to store with the columns
+    :param columns: named 1-D arrays to store
+    """
+    columns = {name: np.ascontiguousarray(array) for name, array in columns.items()}
+    header = dict(header)
+    header["columns"] = {}
+
+    # the header size depends on the layout, so lay out the columns relative to its end
+    offset = 0
+    for name, array in columns.items():
+        header["columns"][name] = {
+            "dtype": array.dtype.str,
+            "length": len(array),
+            "offset": offset,
+        }
+        offset = _pad_to_alignment(offset + array.nbytes)
+
+    prefix_size = len(magic) + 8
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _pad_to_alignment(prefix_size + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - prefix_size, b" ")
+
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(magic)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in columns.items():
+                f.seek(data_start + header["columns"][name]["offset"])
+                # write straight from the array (or its memory map), without a copy
+                f.write(memoryview(array).cast("B"))
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_columnar_header(file_path: str, magic: bytes) -> Tuple[dict, int]:
+    """
+    Read the header of a file written by `write_columnar_file`.
+
+    :param file_path: path to the file
+    :param magic: expected magic bytes
+    :return: header and the byte offset at which the column data starts
+    """
+    with open(file_path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise BinaryFileReadError(f"Unexpected binary file type: '{file_path}'")
+        try:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+        except (struct.error, ValueError):
+            raise BinaryFileReadError(f"Corrupt binary file header: '{file_path}'")
+    return header, len(magic) + 8 + header_size
+
+
+def read_columnar_file(file_path: str, magic: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Open a file written by `write_columnar_file`. Columns are memory-mapped read-only,
+    nothing is copied.
+
+    :param file_path: path to the file
+    :param magic: expected magic bytes
+    :return: header and the named columns
+    """
+    header, data_start = read_columnar_header(file_path, magic)
+    columns = {}
+    for name, column in header["columns"].items():
+        if column["length"] == 0:
+            # np.memmap cannot map zero bytes
+            columns[name] = np.empty(0, dtype=column["dtype"])
+            continue
+        columns[name] = np.memmap(
+            file_path,
+            dtype=column["dtype"],
+            mode="r",
+            offset=data_start + column["offset"],
+            shape=(column["length"],),
+        )
+    return header, columns
+
+
+def write_regionset_binary(
+    file_path: str,
+    chrom_names: np.ndarray,
+    chrom_codes: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    identifier: Union[str, None] = None,
+    source_path: Union[str, None] = None,
+) -> None:
+    """
+    Write region columns to the binary RegionSet format.
+
+    :param file_path: path to the binary file to write
+    :param chrom_names: chromosome names
+    :param chrom_codes: index of each region's chromosome in chrom_names
+    :param starts: start position of each region
+    :param ends: end position of each region
+    :param identifier: bed identifier of the region set, if already known
+    :param source_path: path to the bed file the columns were read from
+    """
+    header = {
+        "version": REGIONSET_BINARY_VERSION,
+        "chrom_names": [str(name) for name in chrom_names],
+        "identifier": identifier,
+        "source": source_stat(source_path) if source_path else None,
+    }
+    columns = {
+        "chrom_codes": np.asarray(chrom_codes, dtype=CHROM_CODE_DTYPE),
+        "starts": np.asarray(starts, dtype=REGION_COORD_DTYPE),
+        "ends": np.asarray(ends, dtype=REGION_COORD_DTYPE),
+    }
+    write_columnar_file(file_path, REGIONSET_BINARY_MAGIC, header, columns)
+
+
+def check_binary_version(header: dict, version: int, file_path: str) -> None:
+    """
+    Make sure a binary file was written with a supported format version.
+
+    :param header: header of the binary file
+    :param version: supported version
+    :param file_path: path to the binary file
+    """
+    if header.get("version") != version:
+        raise BinaryFileReadError(
+            f"Unsupported binary format version {header.get('version')} in '{file_path}'"
+        )
+
+
+def read_regionset_binary(
+    file_path: str,
+) -> Tuple[dict, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Open a binary RegionSet file. Columns are memory-mapped read-only, nothing is copied.
+
+    :param file_path: path to the binary file
+    :return: header, chromosome names, chromosome codes, starts and ends
+    """
+    header, columns = read_columnar_file(file_path, REGIONSET_BINARY_MAGIC)
+    check_binary_version(header, REGIONSET_BINARY_VERSION, file_path)
+    chrom_names = np.asarray(header["chrom_names"], dtype=object)
+
+    return header, chrom_names, columns["chrom_codes"], columns["starts"], columns["ends"]
+
+
+def binary_is_fresh(binary_path: str, source_path: str, magic: bytes, version: int) -> bool:
+    """
+    Check whether a binary sidecar exists and was written from the current version of a file.
+
+    :param binary_path: path to the binary file
+    :param source_path: path to the file the binary file was derived from
+    :param magic: expected magic bytes of the binary file
+    :param version: supported format version
+    :return: True if the binary file can be used instead of re-reading the source file
+    """
+    if not os.path.isfile(binary_path):
+        return False
+    try:
+        header, _ = read_columnar_header(binary_path, magic)
+    except (OSError, BinaryFileReadError):
+        return False
+    return header.get("version") == version and header.get("source") == source_stat(source_path)
+
+
+def regionset_binary_is_fresh(binary_path: str, source_path: str) -> bool:
+    """
+    Check whether a binary RegionSet sidecar exists and was written from the current version
+    of a bed file.
+
+    :param binary_path: path to the binary file
+    :param source_path: path to the bed file
+    :return: True if the binary file can be used instead of the bed file
+    """
+    return binary_is_fresh(
+        binary_path, source_path, REGIONSET_BINARY_MAGIC, REGIONSET_BINARY_VERSION
+    )
+
+
+def expand_ranges(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expand half-open ranges [lo, hi) into the flat list of positions they cover.
+
+    :param lo: start of each range
+    :param hi: end of each range
+    :return: index of the range each position came from, and the positions
+    """
+    counts = np.maximum(hi - lo, 0)
+    total = int(counts.sum())
+    owners = np.repeat(np.arange(len(lo)), counts)
+    # position within each range: global arange minus the start of the owner's run
+    run_starts = np.cumsum(counts) - counts
+    positions = np.arange(total) - np.repeat(run_starts, counts) + np.repeat(lo, counts)
+    return owners, positions
@@ -3,6 +3,7 @@ from typing import Literal
 MODULE_NAME = "region2vec"
 LR_TYPES = Literal["constant", "exponential", "step"]
 POOLING_TYPES = Literal["mean", "max"]
+EMBEDDING_DTYPES = Literal["float32", "float16", "int8"]
 MAX_WAIT_TIME = 10800
 
 DEFAULT_EPOCHS = 100
@@ -15,12 +16,35 @@ DEFAULT_EPOCHS = 10
 DEFAULT_INIT_LR = 0.1  # https://github.com/databio/gitk/issues/6#issuecomment-1476273162
 DEFAULT_MIN_LR = 0.0001  # gensim default
 DEFAULT_NS_POWER = 0.75
+# regions pooled together by Region2VecExModel.encode
+DEFAULT_ENCODE_BATCH_SIZE = 100_000
+# region sets handed to a worker at a time by Region2VecExModel.encode_regionsets
+ENCODE_REGIONSETS_TASKS_PER_CHUNK = 4
 
 CONFIG_FILE_NAME = "config.yaml"
 MODEL_FILE_NAME = "checkpoint.pt"
 UNIVERSE_FILE_NAME = "universe.bed"
+EMBEDDING_TABLE_FILE_NAME = "embeddings.bin"
+# torch checkpoints written next to the gensim ones during training
+TORCH_CHECKPOINT_EXT = ".pt"
+CHECKPOINT_IDS_KEY = "ids"
+CHECKPOINT_VECTORS_KEY = "vectors"
+
+EMBEDDING_TABLE_MAGIC = b"GENIMLET"
+EMBEDDING_TABLE_VERSION = 1
+# int8 tables store round(weight / scale), with scale = max(abs(row)) / INT8_MAX per row
+INT8_MAX = 127
+
+# packed token corpora of Region2VecDataset
+TOKEN_CORPUS_EXT = ".r2vcorpus"
+TOKEN_CORPUS_MAGIC = b"GENIMLTC"
+TOKEN_CORPUS_VERSION = 1
+# documents loaded ahead of gensim, and threads loading them
+DEFAULT_PREFETCH = 64
+DEFAULT_PREFETCH_WORKERS = 4
 
 POOLING_METHOD_KEY = "pooling_method"
 EMBEDDING_DIM_KEY = "embedding_dim"
 EMBEDDING_DIM_KEY_OLD = "embedding_size"
 VOCAB_SIZE_KEY = "vocab_size"
+EMBEDDING_DTYPE_KEY = "embedding_dtype"
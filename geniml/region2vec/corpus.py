@@ -0,0 +1,90 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from gtars.utils import read_tokens_from_gtok
+
+from ..io.utils import check_binary_version, read_columnar_file, write_columnar_file
+from .const import DEFAULT_PREFETCH_WORKERS, TOKEN_CORPUS_MAGIC, TOKEN_CORPUS_VERSION
+
+
+class TokenCorpus:
+    """
+    Packed corpus of tokenized region sets: the tokens of all documents concatenated in one
+    array, and the offsets of each document in it, in a single memory-mappable file.
+
+    Reading a document is a slice of the mapped tokens, so iterating a corpus does not open a
+    file per document, which dominates on network storage when a corpus is made of many small
+    `.gtok` files.
+    """
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray, path: str = None):
+        """
+        :param tokens: tokens of all documents
+        :param offsets: start of each document in tokens, and the end of the last one
+        :param path: path of the file the corpus is mapped from
+        """
+        self.tokens = tokens
+        self.offsets = offsets
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> "TokenCorpus":
+        """
+        Memory-map a corpus packed with `pack`.
+
+        :param path: path to the corpus
+        :return: TokenCorpus
+        """
+        header, columns = read_columnar_file(path, TOKEN_CORPUS_MAGIC)
+        check_binary_version(header, TOKEN_CORPUS_VERSION, path)
+        return cls(columns["tokens"], columns["offsets"], path)
+
+    @classmethod
+    def pack(
+        cls, gtok_files: List[str], path: str, num_workers: int = DEFAULT_PREFETCH_WORKERS
+    ) -> "TokenCorpus":
+        """
+        Pack `.gtok` files into a corpus, one document per file, in order. Tokens are spooled
+        to a temporary file as they are read, so packing holds only a few documents in memory.
+
+        :param gtok_files: paths to the `.gtok` files
+        :param path: path to the corpus to write
+        :param num_workers: number of threads reading `.gtok` files
+        :return: the packed corpus, memory-mapped
+        """
+        lengths = np.zeros(len(gtok_files), dtype=np.int64)
+        tokens_path = f"{path}.{os.getpid()}.tokens.tmp"
+        try:
+            with open(tokens_path, "wb") as f, ThreadPoolExecutor(num_workers) as executor:
+                for i, tokens in enumerate(executor.map(read_tokens_from_gtok, gtok_files)):
+                    tokens = np.asarray(tokens, dtype=np.uint32)
+                    f.write(memoryview(tokens).cast("B"))
+                    lengths[i] = len(tokens)
+
+            n_tokens = int(lengths.sum())
+            tokens = (
+                np.memmap(tokens_path, dtype=np.uint32, mode="r", shape=(n_tokens,))
+                if n_tokens > 0
+                else np.empty(0, dtype=np.uint32)
+            )
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            header = {"version": TOKEN_CORPUS_VERSION, "n_documents": len(gtok_files)}
+            write_columnar_file(
+                path, TOKEN_CORPUS_MAGIC, header, {"tokens": tokens, "offsets": offsets}
+            )
+            del tokens
+        finally:
+            if os.path.exists(tokens_path):
+                os.remove(tokens_path)
+        return cls.load(path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.tokens[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __repr__(self):
+        return f"TokenCorpus(path={self.path}, documents={len(self)}, tokens={len(self.tokens)})"
@@ -0,0 +1,160 @@
+from typing import Union
+
+import numpy as np
+
+try:
+    import torch
+    import torch.nn.functional as F
+except ImportError:
+    raise ImportError(
+        "Please install Machine Learning dependencies by running 'pip install geniml[ml]'"
+    )
+
+from ..io.utils import check_binary_version, read_columnar_file, write_columnar_file
+from .const import (
+    EMBEDDING_DTYPES,
+    EMBEDDING_TABLE_MAGIC,
+    EMBEDDING_TABLE_VERSION,
+    INT8_MAX,
+    POOLING_TYPES,
+)
+
+
+class EmbeddingTable:
+    """
+    Read-only embedding table of a Region2Vec model, stored as float32, float16 or int8 (with
+    a float32 scale per row) in a memory-mappable file.
+
+    Loading a table maps the file without reading it, so it is near instant, and the pages of
+    the table are shared through the page cache by every process serving lookups from it (e.g.
+    the workers of `Region2VecExModel.encode_regionsets`). Rows are dequantized to float32 only
+    when they are looked up.
+    """
+
+    def __init__(self, weights: np.ndarray, scales: np.ndarray = None, path: str = None):
+        """
+        :param weights: vocab size by embedding dim table
+        :param scales: scale of each row of an int8 table
+        :param path: path of the file the table is mapped from
+        """
+        self.weights = weights
+        self.scales = scales
+        self.path = path
+
+    @classmethod
+    def from_weights(
+        cls, weights: Union[np.ndarray, torch.Tensor], dtype: EMBEDDING_DTYPES = "float16"
+    ) -> "EmbeddingTable":
+        """
+        Quantize a float embedding table.
+
+        :param weights: vocab size by embedding dim table
+        :param dtype: storage type of the table
+        :return: EmbeddingTable
+        """
+        if isinstance(weights, torch.Tensor):
+            weights = weights.detach().cpu().numpy()
+        weights = np.asarray(weights, dtype=np.float32)
+        if dtype in ["float32", "float16"]:
+            return cls(weights.astype(dtype))
+        if dtype != "int8":
+            raise ValueError(f"dtype must be one of {EMBEDDING_DTYPES}")
+
+        scales = np.abs(weights).max(axis=1, initial=0) / INT8_MAX
+        # all-zero rows quantize to zeros whatever their scale
+        scales[scales == 0] = 1
+        quantized = np.rint(weights / scales[:, None]).clip(-INT8_MAX, INT8_MAX)
+        return cls(quantized.astype(np.int8), scales.astype(np.float32))
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingTable":
+        """
+        Memory-map a table saved with `save`.
+
+        :param path: path to the table
+        :return: EmbeddingTable
+        """
+        header, columns = read_columnar_file(path, EMBEDDING_TABLE_MAGIC)
+        check_binary_version(header, EMBEDDING_TABLE_VERSION, path)
+        weights = columns["weights"].reshape(header["vocab_size"], header["embedding_dim"])
+        scales = columns["scales"] if header["dtype"] == "int8" else None
+        return cls(weights, scales, path)
+
+    def save(self, path: str) -> str:
+        """
+        Write the table to a memory-mappable file.
+
+        :param path: path to the table
+        :return: path to the table
+        """
+        header = {
+            "version": EMBEDDING_TABLE_VERSION,
+            "dtype": self.dtype,
+            "vocab_size": self.vocab_size,
+            "embedding_dim": self.embedding_dim,
+        }
+        columns = {"weights": self.weights.reshape(-1)}
+        if self.scales is not None:
+            columns["scales"] = self.scales
+        write_columnar_file(path, EMBEDDING_TABLE_MAGIC, header, columns)
+        return path
+
+    @property
+    def dtype(self) -> str:
+        return self.weights.dtype.name
+
+    @property
+    def shape(self) -> tuple:
+        return self.weights.shape
+
+    @property
+    def vocab_size(self) -> int:
+        return self.weights.shape[0]
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.weights.shape[1]
+
+    def __len__(self):
+        return self.vocab_size
+
+    def lookup(self, ids: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+        """
+        Get the float32 embeddings of a list of token ids.
+
+        :param ids: token ids
+        :return: one row per token id
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = self.weights[ids].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[ids][:, None]
+        return torch.from_numpy(rows)
+
+    def dequantize(self) -> torch.Tensor:
+        """
+        Get the whole table as float32.
+
+        :return: vocab size by embedding dim tensor
+        """
+        return self.lookup(np.arange(self.vocab_size))
+
+    def embedding_bag(
+        self, ids: torch.Tensor, offsets: torch.Tensor, mode: POOLING_TYPES = "mean"
+    ) -> torch.Tensor:
+        """
+        Pool the embeddings of bags of tokens, like `torch.nn.functional.embedding_bag`.
+
+        :param ids: token ids of all the bags
+        :param offsets: start of each bag in ids
+        :param mode: pooling of the embeddings of a bag
+        :return: one row per bag
+        """
+        # dequantize the distinct rows of the bags only
+        unique_ids, positions = np.unique(np.asarray(ids), return_inverse=True)
+        return F.embedding_bag(
+            torch.from_numpy(positions.reshape(-1).astype(np.int64)),
+            self.lookup(unique_ids),
+            offsets,
+            mode=mode,
+        )
@@ -1,11 +1,13 @@
 import os
 from logging import getLogger
+from multiprocessing import Pool
 from typing import List, Union
 
 import numpy as np
 
 try:
     import torch
+    import torch.nn.functional as F
 except ImportError:
     raise ImportError(
         "Please install Machine Learning dependencies by running 'pip install geniml[ml]'"
@@ -14,28 +16,38 @@ except ImportError:
 from gtars.tokenizers import Region as GRegion
 from gtars.tokenizers import RegionSet as GRegionSet
 from huggingface_hub import hf_hub_download
-from rich.progress import track
 
 from ..io import Region, RegionSet
+from ..io.const import REGIONSET_CHUNK_SIZE
 from ..models import ExModel
 from ..tokenization.main import Tokenizer, TreeTokenizer
 from .const import (
     CONFIG_FILE_NAME,
     DEFAULT_EMBEDDING_DIM,
+    DEFAULT_ENCODE_BATCH_SIZE,
     DEFAULT_EPOCHS,
     DEFAULT_MIN_COUNT,
     DEFAULT_WINDOW_SIZE,
+    EMBEDDING_DTYPE_KEY,
+    EMBEDDING_DTYPES,
+    EMBEDDING_TABLE_FILE_NAME,
+    ENCODE_REGIONSETS_TASKS_PER_CHUNK,
     MODEL_FILE_NAME,
     MODULE_NAME,
     POOLING_METHOD_KEY,
     POOLING_TYPES,
     UNIVERSE_FILE_NAME,
 )
+from .embedding_table import EmbeddingTable
 from .models import Region2Vec
 from .utils import (
     Region2VecDataset,
+    copy_gensim_weights,
     export_region2vec_model,
     load_local_region2vec_model,
+    load_local_region2vec_table,
+    load_region2vec_checkpoint,
+    load_region2vec_config,
     train_region2vec_model,
 )
 
@@ -45,6 +57,93 @@ _LOGGER = getLogger(MODULE_NAME)
 # demote gensim logger to warning
 _GENSIM_LOGGER.setLevel("WARNING")
 
+# tokenizer and embeddings of the encode_regionsets worker processes
+_WORKER_STATE = {}
+
+
+def _embedding_bag(
+    embeddings: Union[torch.Tensor, EmbeddingTable],
+    ids: torch.Tensor,
+    offsets: torch.Tensor,
+    pooling: POOLING_TYPES,
+) -> torch.Tensor:
+    """
+    Pool the embeddings of bags of tokens, from the weights of a model or an embedding table.
+    """
+    if isinstance(embeddings, EmbeddingTable):
+        return embeddings.embedding_bag(ids, offsets, mode=pooling)
+    return F.embedding_bag(ids, embeddings, offsets, mode=pooling)
+
+
+def _pool_regionset(
+    tokenizer: TreeTokenizer,
+    weight: Union[torch.Tensor, EmbeddingTable],
+    query: Union[str, RegionSet],
+    pooling: POOLING_TYPES,
+    chunk_size: int,
+) -> np.ndarray:
+    """
+    Embed a region set as the mean of its region embeddings, streaming its tokens block by
+    block and summing the pooled region embeddings in place.
+
+    :param tokenizer: Tokenizer of the model.
+    :param weight: Weights (or embedding table) of the model.
+    :param query: Path to a BED file, or a RegionSet.
+    :param pooling: Pooling of the token embeddings of each region.
+    :param chunk_size: Number of regions tokenized at a time.
+
+    :return np.ndarray: Region set embedding (NaN if the region set is empty).
+    """
+    total = torch.zeros(weight.shape[1], dtype=torch.float64)
+    n_regions = 0
+    with torch.inference_mode():
+        for offsets, ids in tokenizer.iter_region_tokens(query, chunk_size):
+            if len(offsets) < 2:
+                continue
+            pooled = _embedding_bag(
+                weight,
+                torch.from_numpy(ids.astype(np.int64)),
+                torch.from_numpy(offsets[:-1].astype(np.int64)),
+                pooling,
+            )
+            total += pooled.sum(axis=0, dtype=torch.float64)
+            n_regions += len(offsets) - 1
+    if n_regions == 0:
+        return np.full(weight.shape[1], np.nan, dtype=np.float32)
+    return (total / n_regions).numpy().astype(np.float32)
+
+
+def _init_regionset_worker(
+    universe: str,
+    weight: Union[np.ndarray, EmbeddingTable, str],
+    pooling: str,
+    chunk_size: int,
+):
+    """
+    Load the tokenizer (from its persisted index) and embeddings of an encode_regionsets worker.
+    Embedding tables saved to a file are memory-mapped, so all workers share them.
+    """
+    # the pool already runs one worker per core
+    torch.set_num_threads(1)
+    _WORKER_STATE["tokenizer"] = TreeTokenizer(universe, cache=False)
+    if isinstance(weight, str):
+        weight = EmbeddingTable.load(weight)
+    elif isinstance(weight, np.ndarray):
+        weight = torch.from_numpy(weight)
+    _WORKER_STATE["weight"] = weight
+    _WORKER_STATE["pooling"] = pooling
+    _WORKER_STATE["chunk_size"] = chunk_size
+
+
+def _encode_regionset_worker(query: Union[str, RegionSet]) -> np.ndarray:
+    return _pool_regionset(
+        _WORKER_STATE["tokenizer"],
+        _WORKER_STATE["weight"],
+        query,
+        _WORKER_STATE["pooling"],
+        _WORKER_STATE["chunk_size"],
+    )
+
 
 class Region2VecExModel(ExModel):
     def __init__(
@@ -67,6 +166,7 @@ class Region2VecExModel(ExModel):
         self.tokenizer: TreeTokenizer
         self.trained: bool = False
         self._model: Region2Vec = None
+        self._embeddings: EmbeddingTable = None
         self.pooling_method = pooling_method
 
         if model_path is not None:
@@ -114,10 +214,24 @@ class Region2VecExModel(ExModel):
     @property
     def model(self):
         """
-        Get the core Region2Vec model.
+        Get the core Region2Vec model. Models loaded from an embedding table are built from the
+        dequantized table the first time they are needed.
         """
+        if self._model is None and self._embeddings is not None:
+            self._model = Region2Vec(len(self._embeddings), self._embeddings.embedding_dim)
+            self._model.projection.weight.data = self._embeddings.dequantize()
         return self._model
 
+    @property
+    def _lookup_table(self) -> Union[torch.Tensor, EmbeddingTable]:
+        """
+        Get the embeddings to serve lookups from: the embedding table the model was loaded
+        from, unless the model was built from it.
+        """
+        if self._model is None and self._embeddings is not None:
+            return self._embeddings
+        return self._model.projection.weight.detach().cpu()
+
     def add_tokenizer(self, tokenizer: Tokenizer, **kwargs):
         """
         Add a tokenizer to the model. This should be use when the model
@@ -135,15 +249,22 @@ class Region2VecExModel(ExModel):
 
     def _load_local_model(self, model_path: str, vocab_path: str, config_path: str):
         """
-        Load the model from a checkpoint.
+        Load the model from a checkpoint, or memory-map its embedding table if it was exported
+        as one.
 
-        :param str model_path: Path to the model checkpoint.
+        :param str model_path: Path to the model checkpoint (or embedding table).
         :param str vocab_path: Path to the vocabulary file.
         """
-        _model, tokenizer, config = load_local_region2vec_model(
-            model_path, vocab_path, config_path
-        )
-        self._model = _model
+        if EMBEDDING_DTYPE_KEY in load_region2vec_config(config_path):
+            self._embeddings, tokenizer, config = load_local_region2vec_table(
+                model_path, vocab_path, config_path
+            )
+            self._model = None
+        else:
+            self._model, tokenizer, config = load_local_region2vec_model(
+                model_path, vocab_path, config_path
+            )
+            self._embeddings = None
         self.tokenizer = tokenizer
         self.trained = True
         if POOLING_METHOD_KEY in config:
@@ -155,6 +276,7 @@ class Region2VecExModel(ExModel):
         model_file_name: str = MODEL_FILE_NAME,
         universe_file_name: str = UNIVERSE_FILE_NAME,
         config_file_name: str = CONFIG_FILE_NAME,
+        embedding_table_file_name: str = EMBEDDING_TABLE_FILE_NAME,
         **kwargs,
     ):
         """
@@ -165,11 +287,15 @@ class Region2VecExModel(ExModel):
         :param str model_path: Path to the pre-trained model on huggingface.
         :param str model_file_name: Name of the model file.
         :param str universe_file_name: Name of the universe file.
+        :param str embedding_table_file_name: Name of the embedding table file, used instead of
+            the model file for models exported as an embedding table.
         :param kwargs: Additional keyword arguments to pass to the hf download function.
         """
+        config_path = hf_hub_download(model_path, config_file_name, **kwargs)
+        if EMBEDDING_DTYPE_KEY in load_region2vec_config(config_path):
+            model_file_name = embedding_table_file_name
         model_file_path = hf_hub_download(model_path, model_file_name, **kwargs)
         universe_path = hf_hub_download(model_path, universe_file_name, **kwargs)
-        config_path = hf_hub_download(model_path, config_file_name, **kwargs)
 
         self._load_local_model(model_file_path, universe_path, config_path)
 
@@ -180,17 +306,24 @@ class Region2VecExModel(ExModel):
         model_file_name: str = MODEL_FILE_NAME,
         universe_file_name: str = UNIVERSE_FILE_NAME,
         config_file_name: str = CONFIG_FILE_NAME,
+        embedding_table_file_name: str = EMBEDDING_TABLE_FILE_NAME,
     ) -> "Region2VecExModel":
         """
         Load the model from a set of files that were exported using the export function.
+        Models exported as an embedding table are memory-mapped, so loading them is near
+        instant.
 
         :param str path_to_files: Path to the directory containing the files.
         :param str model_file_name: Name of the model file.
         :param str universe_file_name: Name of the universe file.
+        :param str embedding_table_file_name: Name of the embedding table file, used instead of
+            the model file for models exported as an embedding table.
         """
-        model_file_path = os.path.join(path_to_files, model_file_name)
         universe_file_path = os.path.join(path_to_files, universe_file_name)
         config_file_path = os.path.join(path_to_files, config_file_name)
+        if EMBEDDING_DTYPE_KEY in load_region2vec_config(config_file_path):
+            model_file_name = embedding_table_file_name
+        model_file_path = os.path.join(path_to_files, model_file_name)
 
         instance = cls()
         instance._load_local_model(model_file_path, universe_file_path, config_file_path)
@@ -248,8 +381,8 @@ class Region2VecExModel(ExModel):
 
         :return np.ndarray: Loss values for each epoch.
         """
-        # validate a model exists
-        if self._model is None:
+        # validate a model exists (building it from its embedding table if needed)
+        if self.model is None:
             raise RuntimeError(
                 "Cannot train a model that has not been initialized. Please initialize the model first using a tokenizer or from a huggingface model."
             )
@@ -268,24 +401,35 @@ class Region2VecExModel(ExModel):
         )
 
         # once done training, set the weights of the pytorch model in self._model
-        for id in track(
-            gensim_model.wv.key_to_index,
-            total=len(gensim_model.wv.key_to_index),
-            description="Setting weights.",
-        ):
-            self._model.projection.weight.data[int(id)] = torch.tensor(gensim_model.wv[id])
+        copy_gensim_weights(gensim_model.wv, self._model)
 
         # set the model as trained
         self.trained = True
 
         return True
 
+    def load_checkpoint(self, checkpoint_path: str):
+        """
+        Load the token vectors of a torch checkpoint saved during training (`epoch_{n}.pt` in
+        `save_checkpoint_path`) into the model, without going through gensim.
+
+        :param str checkpoint_path: Path to the checkpoint.
+        """
+        if self.model is None:
+            raise RuntimeError(
+                "Cannot load a checkpoint into a model that has not been initialized. Please initialize the model first using a tokenizer or from a huggingface model."
+            )
+        load_region2vec_checkpoint(checkpoint_path, self._model)
+        self.trained = True
+
     def export(
         self,
         path: str,
         checkpoint_file: str = MODEL_FILE_NAME,
         universe_file: str = UNIVERSE_FILE_NAME,
         config_file: str = CONFIG_FILE_NAME,
+        embedding_dtype: EMBEDDING_DTYPES = None,
+        embedding_table_file: str = EMBEDDING_TABLE_FILE_NAME,
     ):
         """
         Function to facilitate exporting the model in a way that can
@@ -293,29 +437,40 @@ class Region2VecExModel(ExModel):
         weights and the vocabulary.
 
         :param str path: Path to export the model to.
+        :param EMBEDDING_DTYPES embedding_dtype: Export the weights as a memory-mappable
+            embedding table of this type ("float32", "float16" or "int8") instead of a
+            checkpoint.
+        :param str embedding_table_file: Name of the embedding table file.
         """
 
         export_region2vec_model(
-            self._model,
+            self.model,
             self.tokenizer,
             path,
             checkpoint_file=checkpoint_file,
             universe_file=universe_file,
             config_file=config_file,
+            embedding_dtype=embedding_dtype,
+            embedding_table_file=embedding_table_file,
         )
 
     def encode(
         self,
         regions: Union[str, Region, List[Region], RegionSet, GRegionSet],
         pooling: POOLING_TYPES = None,
+        batch_size: int = DEFAULT_ENCODE_BATCH_SIZE,
     ) -> np.ndarray:
         """
         Get the vector for a region.
 
+        All regions are tokenized at once, then the embeddings of the tokens of each region are
+        pooled with a single `embedding_bag` call per batch of regions.
+
         :param regions: Region to get the vector for.
         :param pooling: Pooling type to use.
+        :param batch_size: Number of regions pooled at a time.
 
-        :return np.ndarray: Vector for the region.
+        :return np.ndarray: Vector for the region (float32, one row per region).
         """
         # allow for overriding the pooling method
         pooling = pooling or self.pooling_method
@@ -331,25 +486,83 @@ class Region2VecExModel(ExModel):
         if pooling not in ["mean", "max"]:
             raise ValueError(f"pooling must be one of {POOLING_TYPES}")
 
-        # tokenize the regionm -- need to pass it as a list because the tokenizer expects a list
-        tokens = [self.tokenizer([r]) for r in regions]
-        token_tensors = [
-            torch.tensor(token_set.to_ids(), dtype=torch.long) for token_set in tokens
-        ]
+        # tokenize every region on its own; RegionSets go through the tokenizer's token cache, if any
+        if not isinstance(regions, RegionSet):
+            regions = RegionSet.from_arrays(
+                [r.chr for r in regions], [r.start for r in regions], [r.end for r in regions]
+            )
+        tokens = self.tokenizer.region_tokens(regions)
+        ids = torch.from_numpy(tokens.indices.astype(np.int64))
+        offsets = torch.from_numpy(tokens.indptr.astype(np.int64))
+
+        weight = self._lookup_table
+        n_regions = len(offsets) - 1
+        region_embeddings = np.empty((n_regions, weight.shape[1]), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, n_regions, batch_size):
+                stop = min(start + batch_size, n_regions)
+                first, last = offsets[start], offsets[stop]
+                region_embeddings[start:stop] = (
+                    _embedding_bag(
+                        weight,
+                        ids[first:last],
+                        offsets[start:stop] - first,
+                        pooling,
+                    )
+                    .float()
+                    .numpy()
+                )
 
-        region_embeddings = []
+        return region_embeddings
 
-        for token_tensor in token_tensors:
-            if pooling == "mean":
-                region_embeddings.append(
-                    torch.mean(self._model.projection(token_tensor), axis=0).detach().numpy()
-                )
-            elif pooling == "max":
-                region_embeddings.append(
-                    torch.max(self._model.projection(token_tensor), axis=0).detach().numpy()
-                )
-            else:
-                # this should be unreachable
-                raise ValueError(f"pooling must be one of {POOLING_TYPES}")
+    def encode_regionsets(
+        self,
+        regionsets: List[Union[str, RegionSet]],
+        pooling: POOLING_TYPES = None,
+        workers: int = 1,
+        chunk_size: int = REGIONSET_CHUNK_SIZE,
+    ) -> np.ndarray:
+        """
+        Get one vector per region set: the mean of the vectors of its regions (see `encode`).
+
+        The tokens of every region set are streamed block by block and the pooled region
+        vectors are summed in place, so no region by embedding matrix is built and BED files of
+        any size are embedded in constant memory. Tokens go through the tokenizer's token cache,
+        if any (see `TreeTokenizer.iter_region_tokens`). With several workers, region sets are
+        embedded concurrently by a pool of processes, each loading the tokenizer from its
+        persisted index, without a token cache.
+
+        :param regionsets: Paths to BED files, or RegionSets.
+        :param pooling: Pooling type to use for the tokens of each region.
+        :param workers: Number of processes embedding region sets.
+        :param chunk_size: Number of regions tokenized at a time.
+
+        :return np.ndarray: Vectors of the region sets (float32, one row per region set, NaN
+            for empty region sets).
+        """
+        pooling = pooling or self.pooling_method
+        if pooling not in ["mean", "max"]:
+            raise ValueError(f"pooling must be one of {POOLING_TYPES}")
+
+        weight = self._lookup_table
+        embeddings = np.empty((len(regionsets), weight.shape[1]), dtype=np.float32)
+        if workers <= 1:
+            for i, query in enumerate(regionsets):
+                embeddings[i] = _pool_regionset(self.tokenizer, weight, query, pooling, chunk_size)
+            return embeddings
 
-        return np.vstack(region_embeddings)
+        # workers map the embedding table file rather than receiving a copy of the weights
+        if isinstance(weight, EmbeddingTable):
+            shared_weight = weight.path or weight
+        else:
+            shared_weight = weight.numpy()
+        initargs = (self.tokenizer._universe_path, shared_weight, pooling, chunk_size)
+        with Pool(workers, initializer=_init_regionset_worker, initargs=initargs) as pool:
+            results = pool.imap(
+                _encode_regionset_worker,
+                regionsets,
+                chunksize=ENCODE_REGIONSETS_TASKS_PER_CHUNK,
+            )
+            for i, embedding in enumerate(results):
+                embeddings[i] = embedding
+        return embeddings
@@ -6,6 +6,7 @@ import select
 import shutil
 import sys
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Dict, List, Tuple, Union
 
@@ -21,26 +22,38 @@ from gtars.utils import read_tokens_from_gtok
 from yaml import safe_dump, safe_load
 
 if TYPE_CHECKING:
+    from gensim.models import KeyedVectors
     from gensim.models import Word2Vec as GensimWord2Vec
 
 from ..const import GTOK_EXT
 from ..tokenization.main import Tokenizer, TreeTokenizer
 from .const import (
+    CHECKPOINT_IDS_KEY,
+    CHECKPOINT_VECTORS_KEY,
     CONFIG_FILE_NAME,
     DEFAULT_EMBEDDING_DIM,
     DEFAULT_EPOCHS,
     DEFAULT_INIT_LR,
     DEFAULT_MIN_COUNT,
     DEFAULT_MIN_LR,
+    DEFAULT_PREFETCH,
+    DEFAULT_PREFETCH_WORKERS,
     DEFAULT_WINDOW_SIZE,
     EMBEDDING_DIM_KEY,
     EMBEDDING_DIM_KEY_OLD,
+    EMBEDDING_DTYPE_KEY,
+    EMBEDDING_DTYPES,
+    EMBEDDING_TABLE_FILE_NAME,
     LR_TYPES,
     MODEL_FILE_NAME,
     MODULE_NAME,
+    TOKEN_CORPUS_EXT,
+    TORCH_CHECKPOINT_EXT,
     UNIVERSE_FILE_NAME,
     VOCAB_SIZE_KEY,
 )
+from .corpus import TokenCorpus
+from .embedding_table import EmbeddingTable
 from .models import Region2Vec
 
 _LOGGER = logging.getLogger(MODULE_NAME)
@@ -413,6 +426,8 @@ def export_region2vec_model(
     checkpoint_file: str = MODEL_FILE_NAME,
     universe_file: str = UNIVERSE_FILE_NAME,
     config_file: str = CONFIG_FILE_NAME,
+    embedding_dtype: EMBEDDING_DTYPES = None,
+    embedding_table_file: str = EMBEDDING_TABLE_FILE_NAME,
     **kwargs: Dict[str, any],
 ):
     """
@@ -424,6 +439,9 @@ def export_region2vec_model(
     :param str checkpoint_file: The name of the checkpoint file to export
     :param str universe_file: The name of the universe file to export
     :param str config_file: The name of the config file to export
+    :param EMBEDDING_DTYPES embedding_dtype: Export the weights as a memory-mappable embedding
+        table of this type (see `EmbeddingTable`) instead of a checkpoint
+    :param str embedding_table_file: The name of the embedding table file to export
     :param Dict[str, any] kwargs: Any additional arguments to pass to the config file
     """
     # make sure the path exists
@@ -431,7 +449,12 @@ def export_region2vec_model(
         os.makedirs(path)
 
     # export the model weights
-    torch.save(model.state_dict(), os.path.join(path, checkpoint_file))
+    if embedding_dtype is None:
+        torch.save(model.state_dict(), os.path.join(path, checkpoint_file))
+    else:
+        EmbeddingTable.from_weights(model.projection.weight, embedding_dtype).save(
+            os.path.join(path, embedding_table_file)
+        )
 
     # export the vocabulary
     with open(os.path.join(path, universe_file), "a") as f:
@@ -443,6 +466,8 @@ def export_region2vec_model(
         VOCAB_SIZE_KEY: len(tokenizer),
         EMBEDDING_DIM_KEY: model.embedding_dim,
     }
+    if embedding_dtype is not None:
+        config[EMBEDDING_DTYPE_KEY] = embedding_dtype
     if kwargs:
         config.update(kwargs)
 
@@ -469,8 +494,7 @@ def load_local_region2vec_model(
     params = torch.load(model_path)
 
     # get the model config (vocab size, embedding size)
-    with open(config_path, "r") as f:
-        config = safe_load(f)
+    config = load_region2vec_config(config_path)
 
     # try with new key first, then old key for backwards compatibility
     embedding_dim = config.get(EMBEDDING_DIM_KEY, config.get(EMBEDDING_DIM_KEY_OLD))
@@ -494,12 +518,44 @@ def load_local_region2vec_model(
     return model, tokenizer, config
 
 
+def load_region2vec_config(config_path: str) -> dict:
+    """
+    Load the config of a region2vec model
+
+    :param str config_path: The path to the model config file
+    """
+    with open(config_path, "r") as f:
+        return safe_load(f)
+
+
+def load_local_region2vec_table(
+    table_path: str,
+    vocab_path: str,
+    config_path: str,
+) -> Tuple[EmbeddingTable, TreeTokenizer, dict]:
+    """
+    Load a region2vec model exported as an embedding table from a local directory. The table
+    is memory-mapped, not read.
+
+    :param str table_path: The path to the embedding table file
+    :param str vocab_path: The path to the model vocabulary file
+    :param str config_path: The path to the model config file
+    """
+    tokenizer = TreeTokenizer(vocab_path)
+    table = EmbeddingTable.load(table_path)
+    config = load_region2vec_config(config_path)
+    return table, tokenizer, config
+
+
 class Region2VecDataset:
     def __init__(
         self,
         data: Union[str, List[str]],
         shuffle: bool = True,
         convert_to_str: bool = False,
+        prefetch: int = DEFAULT_PREFETCH,
+        num_workers: int = DEFAULT_PREFETCH_WORKERS,
+        seed: int = None,
     ):
         """
         Initialize a Region2VecDataset.
@@ -507,49 +563,171 @@ class Region2VecDataset:
         The Region2VecDataset is a special dataset that takes advantage of `.gtok` files. These are
         optimized files that contain the tokenized representation of a region set in binary format.
         This allows for much faster loading of the data, and is the recommended way to load data
-        for training.
+        for training. Many `.gtok` files can be packed into a single memory-mapped corpus file
+        (see `TokenCorpus.pack`), which avoids opening a file per region set on every epoch.
+
+        Region sets are loaded (and shuffled) ahead of the consumer by a pool of threads, so
+        gensim workers are not left waiting on storage.
 
-        :param Union[str, List[RegionSet]] data: The data to use for the dataset. This is either a path to a directory container region set files, or a list of region sets.
-        :param Tokenizer tokenizer: The tokenizer to use for the dataset.
+        :param Union[str, List[RegionSet]] data: The data to use for the dataset. This is either a path to a directory container region set files, a path to a packed corpus, or a list of region set files.
         :param bool shuffle: Whether or not to shuffle the data before yielding it.
         :param bool convert_to_str: Whether or not to convert the tokens to strings before yielding them.
+        :param int prefetch: Number of region sets loaded ahead while iterating.
+        :param int num_workers: Number of threads loading region sets.
+        :param int seed: Seed for shuffling the tokens.
         """
         self.data = data
         self.shuffle = shuffle
         self.convert_to_str = convert_to_str
-
-        if isinstance(data, str):
+        self.prefetch = max(prefetch, 1)
+        self.num_workers = num_workers
+        self._rng = np.random.default_rng(seed)
+        self._corpus: TokenCorpus = None
+
+        if isinstance(data, str) and os.path.isfile(data) and data.endswith(TOKEN_CORPUS_EXT):
+            self._corpus = TokenCorpus.load(data)
+        elif isinstance(data, str):
             self.data = glob.glob(os.path.join(data, f"*.{GTOK_EXT}"))
         elif isinstance(data, list) and isinstance(data[0], str):
             self.data = data
         else:
             raise ValueError(f"Unknown data type: {type(data)}. Expected str or List[str].")
 
+    def pack(self, path: str) -> "Region2VecDataset":
+        """
+        Pack the `.gtok` files of the dataset into a memory-mapped corpus file.
+
+        :param str path: The path to the corpus file to write (ending with `.r2vcorpus`).
+        :return Region2VecDataset: A dataset over the packed corpus, with the same settings.
+        """
+        TokenCorpus.pack(self.data, path, num_workers=self.num_workers)
+        dataset = Region2VecDataset(
+            path,
+            shuffle=self.shuffle,
+            convert_to_str=self.convert_to_str,
+            prefetch=self.prefetch,
+            num_workers=self.num_workers,
+        )
+        dataset._rng = self._rng
+        return dataset
+
     def __len__(self):
+        if self._corpus is not None:
+            return len(self._corpus)
         return len(self.data)
 
-    def __getitem__(self, idx):
+    def _load(self, idx: int) -> np.ndarray:
+        if self._corpus is not None:
+            return self._corpus[idx]
+        return np.asarray(read_tokens_from_gtok(self.data[idx]))
+
+    def _tokens(self, idx: int, rng: np.random.Generator) -> np.ndarray:
         # load the data
-        tokens = read_tokens_from_gtok(self.data[idx])
+        tokens = self._load(idx)
 
         # shuffle the data if necessary
         if self.shuffle:
-            random.shuffle(tokens)
-
-        # return the tokens
+            tokens = tokens[rng.permutation(len(tokens))]
         return tokens
 
+    def _prefetched(self, idx: int, rng: np.random.Generator) -> list:
+        tokens = self._tokens(idx, rng)
+        if self.convert_to_str:
+            return tokens.astype(str).tolist()
+        return tokens.tolist()
+
+    def __getitem__(self, idx):
+        return self._tokens(idx, self._rng).tolist()
+
     def __iter__(self):
         if len(self) == 0:
             return
-        for idx in range(len(self)):
-            tokens = self[idx]
-            if self.convert_to_str:
-                tokens = [str(token) for token in tokens]
-            yield tokens
+        # one generator per region set, so threads never share one
+        seeds = self._rng.integers(np.iinfo(np.int64).max, size=len(self))
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            pending = deque()
+            for idx in range(len(self)):
+                pending.append(
+                    executor.submit(self._prefetched, idx, np.random.default_rng(seeds[idx]))
+                )
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
     def __repr__(self):
-        return f"Region2VecDataset(data={self.data}, shuffle={self.shuffle})"
+        data = self._corpus.path if self._corpus is not None else self.data
+        return f"Region2VecDataset(data={data}, shuffle={self.shuffle})"
+
+
+def gensim_token_ids(wv: "KeyedVectors") -> np.ndarray:
+    """
+    Get the token id of every row of the vectors of a gensim model (keys are token ids, as
+    ints or strings).
+
+    :param KeyedVectors wv: The vectors of a gensim model
+    :return np.ndarray: The token id of each row of `wv.vectors`
+    """
+    return np.fromiter((int(key) for key in wv.index_to_key), np.int64, len(wv.index_to_key))
+
+
+def copy_gensim_weights(wv: "KeyedVectors", model: Region2Vec) -> Region2Vec:
+    """
+    Copy the vectors of a trained gensim model into the projection of a torch model, in a
+    single scatter. Tokens missing from the gensim vocabulary keep their weights.
+
+    :param KeyedVectors wv: The vectors of a gensim model
+    :param Region2Vec model: The torch model to copy the vectors into
+    :return Region2Vec: The torch model
+    """
+    ids = torch.from_numpy(gensim_token_ids(wv))
+    with torch.no_grad():
+        model.projection.weight[ids] = torch.from_numpy(wv.vectors).to(
+            model.projection.weight.dtype
+        )
+    return model
+
+
+def save_region2vec_checkpoint(wv: "KeyedVectors", path: str) -> str:
+    """
+    Save the vectors of a gensim model as a torch checkpoint: the token ids and their vectors,
+    which load straight into a torch model (see `load_region2vec_checkpoint`).
+
+    :param KeyedVectors wv: The vectors of a gensim model
+    :param str path: The path to save the checkpoint to
+    :return str: The path to the checkpoint
+    """
+    torch.save(
+        {
+            CHECKPOINT_IDS_KEY: torch.from_numpy(gensim_token_ids(wv)),
+            CHECKPOINT_VECTORS_KEY: torch.from_numpy(wv.vectors),
+        },
+        path,
+    )
+    return path
+
+
+def load_region2vec_checkpoint(path: str, model: Region2Vec) -> Region2Vec:
+    """
+    Load a torch checkpoint saved during training into a torch model, without gensim. The
+    checkpoint is memory-mapped, so its vectors are copied straight from the file into the
+    model.
+
+    :param str path: The path to the checkpoint
+    :param Region2Vec model: The torch model to load the vectors into
+    :return Region2Vec: The torch model
+    """
+    checkpoint = torch.load(path, mmap=True, weights_only=True)
+    ids = checkpoint[CHECKPOINT_IDS_KEY]
+    if len(ids) > 0 and int(ids.max()) >= model.vocab_size:
+        raise ValueError(
+            f"Checkpoint has token id {int(ids.max())}, but the model only has {model.vocab_size} tokens."
+        )
+    with torch.no_grad():
+        model.projection.weight[ids] = checkpoint[CHECKPOINT_VECTORS_KEY].to(
+            model.projection.weight.dtype
+        )
+    return model
 
 
 def train_region2vec_model(
@@ -574,7 +752,9 @@ def train_region2vec_model(
     :param int min_count: Minimum count for a region to be included in the vocabulary.
     :param int num_cpus: Number of cpus to use for training.
     :param int seed: Seed to use for training.
-    :param str save_checkpoint_path: Path to save the model checkpoints to.
+    :param str save_checkpoint_path: Path to save the model checkpoints to. Every epoch is
+        saved as a gensim model (`epoch_{n}.model`, to resume training) and as a torch
+        checkpoint of the token vectors (`epoch_{n}.pt`, see `load_region2vec_checkpoint`).
     :param dict gensim_params: Additional parameters to pass to the gensim model.
     :param str load_from_checkpoint: Path to a checkpoint to load from.
 
@@ -604,6 +784,12 @@ def train_region2vec_model(
                     os.makedirs(save_checkpoint_path)
                 # save the model
                 model.save(os.path.join(save_checkpoint_path, f"epoch_{self.epoch}.model"))
+                save_region2vec_checkpoint(
+                    model.wv,
+                    os.path.join(
+                        save_checkpoint_path, f"epoch_{self.epoch}{TORCH_CHECKPOINT_EXT}"
+                    ),
+                )
 
     # create gensim model that will be used to train
     if load_from_checkpoint is not None:
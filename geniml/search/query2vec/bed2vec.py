@@ -37,10 +37,5 @@ class BED2Vec(Query2Vec):
 
         :return: the region set embedding
         """
-        # if query is a BED file name, read it as a RegionSet class
-        if isinstance(query, str):
-            query = RegionSet(query)
-
-        region_embeddings = self.model.encode(query)
-        # BED embedding: averaging region embeddings
-        return np.mean(region_embeddings, axis=0)
+        # BED embedding: averaging region embeddings, streamed from the BED file
+        return self.model.encode_regionsets([query])[0]
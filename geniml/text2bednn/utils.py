@@ -1,12 +1,19 @@
 import logging
-from typing import Dict, List, Set, Union
+from typing import Dict, List, Set, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
 try:
     import torch
-    from torch.utils.data import DataLoader, TensorDataset
+    from torch.utils.data import (
+        BatchSampler,
+        DataLoader,
+        Dataset,
+        RandomSampler,
+        SequentialSampler,
+        TensorDataset,
+    )
 except ImportError:
     raise ImportError(
         "Please install Machine Learning dependencies by running 'pip install geniml[ml]'"
@@ -42,6 +49,15 @@ def arrays_to_torch_dataloader(
     :param shuffle: shuffle dataset or not
     :return: a Dataset for pytorch training in format of torch.DataLoader
     """
+    if isinstance(X, np.memmap) or isinstance(Y, np.memmap):
+        # gather each batch from the memory-mapped vectors instead of loading them as a whole
+        sampler = RandomSampler(X) if shuffle else SequentialSampler(X)
+        return DataLoader(
+            ArrayBatchDataset(X, Y, target),
+            sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False),
+            batch_size=None,
+        )
+
     tensor_X = torch.from_numpy(dtype_check(X))
     tensor_Y = torch.from_numpy(dtype_check(Y))
     tensor_target = torch.from_numpy(dtype_check(target))
@@ -50,6 +66,29 @@ def arrays_to_torch_dataloader(
     return DataLoader(my_dataset, batch_size=batch_size, shuffle=shuffle)
 
 
+class ArrayBatchDataset(Dataset):
+    """
+    Dataset over (possibly memory-mapped) arrays that is indexed by batches of rows, so that
+    each batch is gathered with a single read and the arrays are never loaded as a whole.
+    """
+
+    def __init__(self, *arrays: np.ndarray):
+        """
+        :param arrays: arrays with the same number of rows
+        """
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays[0])
+
+    def __getitem__(self, indices: List[int]) -> Tuple[torch.Tensor, ...]:
+        # rows are read in storage order; the order of rows within a batch does not matter
+        indices = np.sort(np.asarray(indices))
+        return tuple(
+            torch.from_numpy(dtype_check(np.asarray(array[indices]))) for array in self.arrays
+        )
+
+
 def dtype_check(vecs: np.ndarray) -> np.ndarray:
     """
     Since the default float in np is float64, but in pytorch tensor it's float32,
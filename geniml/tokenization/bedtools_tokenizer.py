@@ -1,56 +1,219 @@
-from . import FileTokenizer
+import glob
+import os
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from logging import getLogger
+from typing import Iterator, List, NamedTuple, Set, Tuple
+
+from ..const import PKG_NAME
+from ..io.utils import is_gzip_file
+from .const import BEDTOOLS_TASKS_PER_WORKER
+from .main import FileTokenizer
+from .utils import time_str
+
+_LOGGER = getLogger(PKG_NAME)
+
+
+class FileTokenization(NamedTuple):
+    """Timing of the tokenization of a BED file."""
+
+    input_path: str
+    output_path: str
+    n_bytes: int
+    n_tokens: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Size of the BED file tokenized per second, in MB/s."""
+        return self.n_bytes / 1e6 / max(self.seconds, 1e-9)
+
+
+def glob_root(pattern: str) -> str:
+    """Gets the directory a glob pattern is rooted at: its leading parts without wildcards.
+
+    Args:
+        pattern (str): Glob pattern (or path).
+
+    Returns:
+        str: The root directory of the pattern.
+    """
+    root = []
+    for part in pattern.split(os.sep)[:-1]:
+        if glob.has_magic(part):
+            break
+        root.append(part)
+    return os.sep.join(root) or ("/" if pattern.startswith(os.sep) else ".")
+
+
+def iter_input_files(input_globs: List[str]) -> Iterator[Tuple[str, str]]:
+    """Expands glob patterns lazily, so that tokenization starts before all files are listed.
+
+    Args:
+        input_globs (list[str]): Glob patterns (or paths) of BED files.
+
+    Yields:
+        tuple[str, str]: Paths of the matched files, each once, in the order of the patterns,
+            and their path relative to the root of their pattern (see `glob_root`).
+    """
+    seen = set()
+    for pattern in input_globs:
+        root = glob_root(pattern)
+        for path in glob.iglob(pattern, recursive=True):
+            if os.path.isfile(path) and path not in seen:
+                seen.add(path)
+                yield path, os.path.relpath(path, root)
 
 
 class BEDToolsTokenizer(FileTokenizer):
-    """A tokenizer that uses bedtools to tokenize BED files"""
+    """A tokenizer that uses bedtools to tokenize BED files.
+
+    Every BED file is tokenized with `bedtools intersect -a universe -b file -u -f fraction`,
+    which writes the universe regions hit by the file. The file is decompressed (if needed)
+    and sorted through pipes, without temporary files. Several files are tokenized
+    concurrently by num_workers bedtools processes.
+    """
 
-    def __init__(self, bedtools_path: str, universe_path: str = None):
+    def __init__(
+        self,
+        bedtools_path: str = "bedtools",
+        universe_path: str = None,
+        fraction: float = 1e-9,
+        num_workers: int = 1,
+    ):
         """Initialize a BEDToolsTokenizer
 
         Args:
             bedtools_path (str): Path to a bedtools binary.
             universe_path (str): Path to a universe BED file.
+            fraction (float): Minimum overlap, as a fraction of a universe region.
+            num_workers (int): Number of files tokenized concurrently.
         """
         self.bedtools_path = bedtools_path
         self.universe_path = universe_path
+        self.fraction = fraction
+        self.num_workers = num_workers
 
-    def tokenize(self, input_globs: list[str], universe_path: str = None) -> RegionSet:
-        """Tokenize a RegionSet using bedtools"""
+    def tokenize(
+        self, input_globs: List[str], output_folder: str, universe_path: str = None
+    ) -> List[FileTokenization]:
+        """Tokenize BED files using bedtools.
+
+        Files are globbed lazily and handed to the workers as they free up, with at most a few
+        files per worker queued ahead, so memory use does not depend on the number of files.
+        The tokens of a file are written to output_folder, at the path of the file relative to
+        the directory its glob pattern is rooted at (e.g. `a/x.bed` for `*/x.bed`).
+
+        Args:
+            input_globs (list[str]): Glob patterns (or paths) of BED files.
+            output_folder (str): The folder to store tokenized BED files.
+            universe_path (str, optional): Path to a universe BED file. Defaults to the
+                universe of the tokenizer.
 
+        Returns:
+            list[FileTokenization]: Timing of every tokenized file, in completion order.
+        """
         universe_path = universe_path or self.universe_path
+        if universe_path is None:
+            raise ValueError("A universe is required to tokenize BED files.")
+        os.makedirs(output_folder, exist_ok=True)
 
-        # loop through globs and tokenize each file
-        for glob in input_globs:
-            for path in glob.glob(glob):
-                _tokenize_one(path, universe_path)
-
-    def _tokenize_one(self, input_path: str, universe_path: str):
-        output_path = os.path.join(input_path, "tokenized.bed")
-        bedtools_path = self.bedtools_path
-        # bedtools can't actually read from stdin, so we have to use a temporary file...
-
-        # sort_process = subprocess.Popen(shlex.split(f"sort -k1,1V -k2,2n {input_path}"), stdout=subprocess.PIPE)
-        # bedtools_process = subprocess.Popen(
-        #     shlex.split(f"{bedtools_path} intersect -a {universe} -b  -u -f {fraction}"),
-        #     stdin = sort_process.stdout,
-        #     stdout = output_file,
-        # )
-        # bedtools_process.communicate()
-
-        # get a temporary file path using tempfile
-        import templfile
-
-        with tempfile.NamedTemporaryFile() as temp_path, open(output_path, "w") as output_file:
-            # sort the input file
-            sort_process = subprocess.Popen(
-                shlex.split(f"sort -k1,1V -k2,2n {input_path}"), stdout=temp_path
-            )
-            sort_process.communicate()
-            # tokenize the sorted file
-            bedtools_process = subprocess.Popen(
-                shlex.split(
-                    f"{bedtools_path} intersect -a {universe} -b {temp_path} -u -f {fraction}"
-                ),
-                stdout=output_file,
+        results = []
+        start = time.perf_counter()
+        max_pending = self.num_workers * BEDTOOLS_TASKS_PER_WORKER
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            pending: Set[Future] = set()
+            output_paths = set()
+            for path, relative_path in iter_input_files(input_globs):
+                output_path = os.path.normpath(os.path.join(output_folder, relative_path))
+                # two pipelines must never write the same file
+                if output_path in output_paths:
+                    raise ValueError(
+                        f"Several input files would be tokenized to '{output_path}' "
+                        f"(the last one is '{path}'), use patterns with distinct roots."
+                    )
+                output_paths.add(output_path)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(self._report(future.result()) for future in done)
+                pending.add(executor.submit(self._tokenize_one, path, output_path, universe_path))
+            for future in pending:
+                results.append(self._report(future.result()))
+
+        elapsed = time.perf_counter() - start
+        n_bytes = sum(result.n_bytes for result in results)
+        _LOGGER.info(
+            f"Tokenized {len(results)} files ({n_bytes / 1e6:.1f} MB) in {time_str(elapsed)}: "
+            f"{len(results) / max(elapsed, 1e-9):.1f} files/s, "
+            f"{n_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s"
+        )
+        return results
+
+    @staticmethod
+    def _report(result: FileTokenization) -> FileTokenization:
+        _LOGGER.info(
+            f"Tokenized {result.input_path}: {result.n_tokens} tokens in "
+            f"{time_str(result.seconds)} ({result.throughput:.1f} MB/s)"
+        )
+        return result
+
+    def _tokenize_one(
+        self, input_path: str, output_path: str, universe_path: str
+    ) -> FileTokenization:
+        """Tokenize a BED file with a `[gzip -dc |] sort | bedtools intersect` pipeline."""
+        start = time.perf_counter()
+        bedtools_args = [self.bedtools_path, "intersect", "-a", universe_path]
+        bedtools_args += ["-b", "stdin", "-u", "-f", str(self.fraction)]
+        processes = []
+        try:
+            if is_gzip_file(input_path):
+                processes.append(
+                    subprocess.Popen(["gzip", "-dc", input_path], stdout=subprocess.PIPE)
+                )
+                sort_args = ["sort", "-k1,1V", "-k2,2n"]
+            else:
+                sort_args = ["sort", "-k1,1V", "-k2,2n", input_path]
+            processes.append(
+                subprocess.Popen(
+                    sort_args,
+                    stdin=processes[-1].stdout if processes else None,
+                    stdout=subprocess.PIPE,
+                )
             )
-            bedtools_process.communicate()
+            with open(output_path, "wb") as output_file:
+                processes.append(
+                    subprocess.Popen(
+                        bedtools_args,
+                        stdin=processes[-1].stdout,
+                        stdout=output_file,
+                        stderr=subprocess.PIPE,
+                    )
+                )
+                # each pipe is only read by the next process of the pipeline
+                for process in processes[:-1]:
+                    process.stdout.close()
+                _, stderr = processes[-1].communicate()
+        except BaseException:
+            # don't leave the rest of the pipeline behind if a process failed to start
+            for process in processes:
+                process.kill()
+                process.wait()
+            raise
+        # bedtools errors explain the failures of the processes feeding it
+        for process in reversed(processes):
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(
+                    process.returncode, process.args, stderr=stderr
+                )
+
+        with open(output_path, "rb") as output_file:
+            n_tokens = sum(line.endswith(b"\n") for line in output_file)
+        return FileTokenization(
+            input_path,
+            output_path,
+            os.path.getsize(input_path),
+            n_tokens,
+            time.perf_counter() - start,
+        )
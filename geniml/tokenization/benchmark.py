@@ -0,0 +1,479 @@
+"""Benchmark of the tokenization hot path.
+
+Generates (or reuses) a universe, a query BED file and an AnnData object, then measures every
+tokenizer implementation on them: startup time, tokenization throughput (regions/sec) and
+peak RSS. Every implementation runs in its own process, so peak RSS is not polluted by the
+others. Everything runs offline; point `--universe`/`--query`/`--h5ad` at fixtures (e.g. the
+files of `tests/data`) to benchmark fixed inputs.
+
+Usage:
+    python -m geniml.tokenization.benchmark --output results.json
+    python -m geniml.tokenization.benchmark --baseline results.json  # exits 1 on regressions
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scanpy as sc
+import scipy.sparse as sp
+from gtars.tokenizers import TreeTokenizer as GTreeTokenizer
+
+from ..const import PKG_NAME
+from ..io.io import RegionSet
+from .bedtools_tokenizer import BEDToolsTokenizer
+from .const import (
+    BENCHMARK_CELL_DENSITY,
+    BENCHMARK_N_CELLS,
+    BENCHMARK_N_FEATURES,
+    BENCHMARK_QUERY_SIZE,
+    BENCHMARK_REPEAT,
+    BENCHMARK_TOLERANCE,
+    BENCHMARK_UNIVERSE_SIZE,
+)
+from .hard_tokenization_batch import intersect_universe, load_universe
+from .index import tokenizer_index_path
+from .main import AnnDataTokenizer, TreeTokenizer
+
+_LOGGER = getLogger(PKG_NAME)
+
+CHROMS = [f"chr{i}" for i in range(1, 23)] + ["chrX"]
+
+# startup seconds, warm startup seconds (None if the startup is always cold), tokenization
+# callable and number of regions tokenized by a call
+Case = Tuple[float, float, Callable[[], object], int]
+
+
+def _write_bed(path: str, chroms, starts, ends) -> str:
+    pd.DataFrame({"chr": chroms, "start": starts, "end": ends}).to_csv(
+        path, sep="\t", header=False, index=False
+    )
+    return path
+
+
+def make_universe(path: str, n_regions: int, seed: int = 0) -> str:
+    """Writes a synthetic universe: non-overlapping regions of 200 bp to 2 kb, with random
+    gaps, spread over the human chromosomes.
+
+    Args:
+        path (str): Path to the BED file to write.
+        n_regions (int): Number of regions.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        str: The path to the universe.
+    """
+    rng = np.random.default_rng(seed)
+    chroms, starts, ends = [], [], []
+    for chrom, n in zip(CHROMS, rng.multinomial(n_regions, np.full(len(CHROMS), 1 / len(CHROMS)))):
+        lengths = rng.integers(200, 2_000, n)
+        region_ends = np.cumsum(rng.integers(0, 5_000, n) + lengths)
+        chroms.append(np.full(n, chrom, dtype=object))
+        starts.append(region_ends - lengths)
+        ends.append(region_ends)
+    return _write_bed(path, np.concatenate(chroms), np.concatenate(starts), np.concatenate(ends))
+
+
+def make_query(
+    path: str, universe: str, n_regions: int, hit_fraction: float = 0.8, seed: int = 1
+) -> str:
+    """Writes a synthetic query, like a peak file: regions near random universe regions, and
+    regions at random positions, sorted by position.
+
+    Args:
+        path (str): Path to the BED file to write.
+        universe (str): Path to the universe.
+        n_regions (int): Number of regions.
+        hit_fraction (float, optional): Fraction of regions placed on universe regions.
+            Defaults to 0.8.
+        seed (int, optional): Random seed. Defaults to 1.
+
+    Returns:
+        str: The path to the query.
+    """
+    rng = np.random.default_rng(seed)
+    universe = RegionSet(universe)
+    universe_chroms = universe.chrom_names[universe.chrom_codes]
+    n_hits = int(n_regions * hit_fraction)
+    picks = rng.integers(0, len(universe), n_hits)
+    misses = rng.integers(0, len(universe), n_regions - n_hits)
+
+    chroms = np.concatenate([universe_chroms[picks], universe_chroms[misses]])
+    starts = np.concatenate(
+        [
+            np.maximum(universe.starts[picks] + rng.integers(-250, 250, n_hits), 0),
+            rng.integers(0, int(universe.ends.max()), len(misses)),
+        ]
+    )
+    ends = starts + rng.integers(150, 1_000, n_regions)
+    order = np.lexsort((starts, chroms))
+    return _write_bed(path, chroms[order], starts[order], ends[order])
+
+
+def make_anndata(
+    path: str, query: str, n_cells: int, n_features: int, density: float, seed: int = 2
+) -> str:
+    """Writes a synthetic single cell dataset, whose features are the first regions of a
+    query, with binary counts.
+
+    Args:
+        path (str): Path to the `.h5ad` file to write.
+        query (str): Path to the BED file of the features.
+        n_cells (int): Number of cells.
+        n_features (int): Maximum number of features.
+        density (float): Fraction of nonzero counts.
+        seed (int, optional): Random seed. Defaults to 2.
+
+    Returns:
+        str: The path to the `.h5ad` file.
+    """
+    features = pd.read_csv(query, sep="\t", header=None, usecols=[0, 1, 2], nrows=n_features)
+    features.columns = ["chr", "start", "end"]
+    features.index = [f"{c}_{s}_{e}" for c, s, e in features.itertuples(index=False)]
+    rng = np.random.default_rng(seed)
+    counts = rng.binomial(len(features), density, n_cells)
+    indices = [np.sort(rng.choice(len(features), n, replace=False)) for n in counts]
+    X = sp.csr_matrix(
+        (
+            np.ones(counts.sum(), dtype=np.float32),
+            np.concatenate(indices) if indices else np.empty(0, dtype=np.int64),
+            np.concatenate([[0], np.cumsum(counts)]),
+        ),
+        shape=(n_cells, len(features)),
+    )
+    sc.AnnData(X=X, var=features).write_h5ad(path)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    """Gives the peak resident set size of the process, in MB (None if unknown)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def _timed(factory: Callable[[], object]) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = factory()
+    return time.perf_counter() - start, result
+
+
+def _index_startup(factory: Callable[[], object], universe: str) -> Tuple[float, float, object]:
+    """Times the startup of a tokenizer without (cold) and with (warm) its persisted index.
+
+    The index of the universe is removed first, so universe must be a copy in the workdir
+    (see run_benchmark), never a file of the caller.
+    """
+    if os.path.exists(tokenizer_index_path(universe)):
+        os.remove(tokenizer_index_path(universe))
+    cold, _ = _timed(factory)
+    warm, tokenizer = _timed(factory)
+    return cold, warm, tokenizer
+
+
+def _tree_case(inputs: Dict[str, str]) -> Case:
+    cold, warm, tokenizer = _index_startup(
+        lambda: TreeTokenizer(inputs["universe"], cache=False), inputs["universe"]
+    )
+    return cold, warm, lambda: tokenizer.encode(inputs["query"]), inputs["query_size"]
+
+
+def _tree_stream_case(inputs: Dict[str, str]) -> Case:
+    cold, warm, tokenizer = _index_startup(
+        lambda: TreeTokenizer(inputs["universe"], cache=False), inputs["universe"]
+    )
+
+    def run():
+        for _ in tokenizer.tokenize_stream(inputs["query"]):
+            pass
+
+    return cold, warm, run, inputs["query_size"]
+
+
+def _gtars_case(inputs: Dict[str, str]) -> Case:
+    startup, tokenizer = _timed(lambda: GTreeTokenizer(inputs["universe"]))
+    return startup, None, lambda: tokenizer(inputs["query"]).to_ids(), inputs["query_size"]
+
+
+def _hard_case(inputs: Dict[str, str]) -> Case:
+    startup, (_, universe_set) = _timed(lambda: load_universe(inputs["universe"]))
+
+    def run():
+        return intersect_universe(RegionSet(inputs["query"]), universe_set, 1e-9)
+
+    return startup, None, run, inputs["query_size"]
+
+
+def _bedtools_case(inputs: Dict[str, str]) -> Case:
+    tokenizer = BEDToolsTokenizer(universe_path=inputs["universe"])
+    output_folder = os.path.join(inputs["workdir"], "bedtools_tokens")
+
+    def run():
+        return tokenizer.tokenize([inputs["query"]], output_folder)
+
+    return 0.0, None, run, inputs["query_size"]
+
+
+def _anndata_case(inputs: Dict[str, str]) -> Case:
+    cold, warm, tokenizer = _index_startup(
+        lambda: AnnDataTokenizer(inputs["universe"]), inputs["universe"]
+    )
+    return cold, warm, lambda: tokenizer.encode(inputs["h5ad"]), inputs["h5ad_size"]
+
+
+CASES: Dict[str, Callable[[Dict[str, str]], Case]] = {
+    "tree": _tree_case,
+    "tree-stream": _tree_stream_case,
+    "gtars": _gtars_case,
+    "hard": _hard_case,
+    "bedtools": _bedtools_case,
+    "anndata": _anndata_case,
+}
+
+
+def measure_case(name: str, inputs: Dict[str, str], repeat: int) -> Dict[str, object]:
+    """Measures a tokenizer implementation. The tokenization time is the best of repeat runs.
+
+    Args:
+        name (str): Name of the implementation (see CASES).
+        inputs (dict): Paths to the universe, query and AnnData object, and their sizes.
+        repeat (int): Number of tokenization runs.
+
+    Returns:
+        dict: The measurements.
+    """
+    baseline_rss = _peak_rss_mb()
+    startup, warm_startup, run, n_regions = CASES[name](inputs)
+    seconds = min(_timed(run)[0] for _ in range(repeat))
+    return {
+        "implementation": name,
+        "n_regions": n_regions,
+        "startup_seconds": startup,
+        "warm_startup_seconds": warm_startup,
+        "tokenize_seconds": seconds,
+        "regions_per_second": n_regions / max(seconds, 1e-9),
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmark(
+    implementations: List[str] = None,
+    universe: str = None,
+    query: str = None,
+    h5ad: str = None,
+    workdir: str = None,
+    universe_size: int = BENCHMARK_UNIVERSE_SIZE,
+    query_size: int = BENCHMARK_QUERY_SIZE,
+    n_cells: int = BENCHMARK_N_CELLS,
+    n_features: int = BENCHMARK_N_FEATURES,
+    density: float = BENCHMARK_CELL_DENSITY,
+    repeat: int = BENCHMARK_REPEAT,
+    seed: int = 0,
+    isolate: bool = True,
+) -> Dict[str, object]:
+    """Benchmarks tokenizer implementations on the same inputs.
+
+    Inputs that are not given are generated (see make_universe, make_query and
+    make_anndata) in workdir, with the given sizes and seed, so runs are reproducible.
+    Implementations whose tools are missing (bedtools) are skipped.
+
+    Args:
+        implementations (list[str], optional): Implementations to run. Defaults to all.
+        universe (str, optional): Path to a universe BED file.
+        query (str, optional): Path to a query BED file.
+        h5ad (str, optional): Path to an `.h5ad` file with chr, start and end features.
+        workdir (str, optional): Folder for generated files. Defaults to a temporary folder.
+        universe_size (int, optional): Number of regions of a generated universe.
+        query_size (int, optional): Number of regions of a generated query.
+        n_cells (int, optional): Number of cells of a generated AnnData object.
+        n_features (int, optional): Number of features of a generated AnnData object.
+        density (float, optional): Fraction of nonzero counts of a generated AnnData object.
+        repeat (int, optional): Number of tokenization runs per implementation.
+        seed (int, optional): Random seed of generated inputs.
+        isolate (bool, optional): Whether to run every implementation in its own process,
+            to measure its peak RSS on its own. Defaults to True.
+
+    Returns:
+        dict: The configuration of the run and the results of every implementation.
+    """
+    implementations = implementations or list(CASES)
+    unknown = set(implementations) - set(CASES)
+    if unknown:
+        raise ValueError(f"Unknown implementations: {sorted(unknown)}")
+    if "bedtools" in implementations and shutil.which("bedtools") is None:
+        _LOGGER.warning("bedtools is not installed, skipping it")
+        implementations = [name for name in implementations if name != "bedtools"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        if universe is None:
+            universe = make_universe(os.path.join(workdir, "universe.bed"), universe_size, seed)
+        else:
+            # the index of the universe is rebuilt to time cold startups, so work on a copy
+            copy = os.path.join(workdir, "universe_" + os.path.basename(universe))
+            shutil.copyfile(universe, copy)
+            universe = copy
+        if query is None:
+            query = make_query(os.path.join(workdir, "query.bed"), universe, query_size, seed=seed)
+        if h5ad is None and "anndata" in implementations:
+            h5ad = make_anndata(
+                os.path.join(workdir, "cells.h5ad"), query, n_cells, n_features, density, seed
+            )
+        inputs = {
+            "universe": universe,
+            "query": query,
+            "h5ad": h5ad,
+            "workdir": workdir,
+            "universe_size": len(RegionSet(universe)),
+            "query_size": len(RegionSet(query)),
+        }
+        if h5ad is not None:
+            X = sc.read_h5ad(h5ad, backed="r").X[:]
+            inputs["h5ad_size"] = int(X.nnz if sp.issparse(X) else np.count_nonzero(X))
+
+        results = []
+        for name in implementations:
+            _LOGGER.info(f"Benchmarking {name}")
+            if isolate:
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results.append(executor.submit(measure_case, name, inputs, repeat).result())
+            else:
+                results.append(measure_case(name, inputs, repeat))
+
+    config = {
+        "universe": universe,
+        "query": query,
+        "h5ad": h5ad,
+        "universe_size": inputs["universe_size"],
+        "query_size": inputs["query_size"],
+        "repeat": repeat,
+        "seed": seed,
+    }
+    return {"config": config, "results": results}
+
+
+def compare_results(
+    report: Dict[str, object], baseline: Dict[str, object], tolerance: float = BENCHMARK_TOLERANCE
+) -> List[str]:
+    """Finds the implementations that got slower than in a baseline report.
+
+    Args:
+        report (dict): Report of run_benchmark.
+        baseline (dict): Report of an earlier run, on the same inputs.
+        tolerance (float, optional): Relative drop of regions/sec that is tolerated.
+
+    Returns:
+        list[str]: A description of every regression.
+    """
+    for key in ("universe_size", "query_size", "seed"):
+        if key in baseline.get("config", {}) and baseline["config"][key] != report["config"][key]:
+            _LOGGER.warning(f"The baseline was run with a different {key}, timings may differ")
+    previous = {result["implementation"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(result["implementation"])
+        if before is None:
+            continue
+        ratio = result["regions_per_second"] / before["regions_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(
+                f"{result['implementation']}: {result['regions_per_second']:,.0f} regions/s, "
+                f"{1 - ratio:.0%} slower than {before['regions_per_second']:,.0f} regions/s"
+            )
+    return regressions
+
+
+def format_results(results: List[Dict[str, object]]) -> str:
+    """Formats benchmark results as a table."""
+
+    def value(x, fmt):
+        return "-" if x is None else format(x, fmt)
+
+    columns = ["implementation", "startup s", "warm s", "regions/s", "peak RSS MB"]
+    rows = [
+        [
+            result["implementation"],
+            value(result["startup_seconds"], ".3f"),
+            value(result["warm_startup_seconds"], ".3f"),
+            value(result["regions_per_second"], ",.0f"),
+            value(result["peak_rss_mb"], ",.0f"),
+        ]
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in [columns] + rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in [columns] + rows
+    )
+
+
+def build_argparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the tokenizer implementations")
+    parser.add_argument(
+        "--implementations", nargs="+", choices=list(CASES), help="implementations to run"
+    )
+    parser.add_argument("--universe", type=str, help="universe BED file (default: synthetic)")
+    parser.add_argument("--query", type=str, help="query BED file (default: synthetic)")
+    parser.add_argument("--h5ad", type=str, help="AnnData file (default: synthetic)")
+    parser.add_argument("--workdir", type=str, help="folder for generated files")
+    parser.add_argument("--universe-size", type=int, default=BENCHMARK_UNIVERSE_SIZE)
+    parser.add_argument("--query-size", type=int, default=BENCHMARK_QUERY_SIZE)
+    parser.add_argument("--n-cells", type=int, default=BENCHMARK_N_CELLS)
+    parser.add_argument("--n-features", type=int, default=BENCHMARK_N_FEATURES)
+    parser.add_argument("--density", type=float, default=BENCHMARK_CELL_DENSITY)
+    parser.add_argument("--repeat", type=int, default=BENCHMARK_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, help="JSON file to write the results to")
+    parser.add_argument("--baseline", type=str, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_TOLERANCE)
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_argparser().parse_args(argv)
+    report = run_benchmark(
+        implementations=args.implementations,
+        universe=args.universe,
+        query=args.query,
+        h5ad=args.h5ad,
+        workdir=args.workdir,
+        universe_size=args.universe_size,
+        query_size=args.query_size,
+        n_cells=args.n_cells,
+        n_features=args.n_features,
+        density=args.density,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    print(format_results(report["results"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import logging
+import os
+import shutil
+import time
+from typing import Callable, Tuple, Union
+
+import numpy as np
+
+from ..const import PKG_NAME
+from ..io.exceptions import BinaryFileReadError
+from ..io.utils import check_binary_version, read_columnar_file, write_columnar_file
+from .const import (
+    DEFAULT_TOKEN_CACHE_FOLDER,
+    DEFAULT_TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_ENV,
+    TOKEN_CACHE_EXT,
+    TOKEN_CACHE_MAGIC,
+    TOKEN_CACHE_VERSION,
+)
+
+_LOGGER = logging.getLogger(PKG_NAME)
+
+# (offsets, token ids) of a tokenized region set: the tokens of region `i` are
+# `ids[offsets[i]:offsets[i + 1]]`
+Tokens = Tuple[np.ndarray, np.ndarray]
+
+
+class TokenCache:
+    """
+    Local, content-addressed cache of tokenized region sets.
+
+    Entries are keyed by the identifier of the region set (the digest of its regions) and the
+    identifier of the universe, so the same regions tokenized with the same universe are only
+    tokenized once, whatever file they were read from. Each entry is a memory-mappable file,
+    `<folder>/<universe id>/<bed id>.tok`, holding the token ids of every region.
+
+    The cache is bounded in size: when it grows over `max_size` bytes, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, folder: str = None, max_size: int = DEFAULT_TOKEN_CACHE_SIZE):
+        """
+        :param folder: folder to store the cache in; defaults to the GENIML_TOKEN_CACHE
+            environment variable, or to ~/.cache/geniml/tokens
+        :param max_size: maximum size of the cache in bytes, None for no limit
+        """
+        self.folder = (
+            folder
+            or os.getenv(TOKEN_CACHE_ENV)
+            or os.path.join(os.path.expanduser("~"), DEFAULT_TOKEN_CACHE_FOLDER)
+        )
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    def _entry_path(self, bed_id: str, universe_id: str) -> str:
+        return os.path.join(self.folder, universe_id, bed_id + TOKEN_CACHE_EXT)
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        """
+        Mark an entry as used now. The time is set explicitly, as file systems may only update
+        modification times every few milliseconds.
+        """
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def _entries(self) -> list:
+        """
+        List the entries of the cache as (last use, size, path), least recently used first.
+        """
+        entries = []
+        if not os.path.isdir(self.folder):
+            return entries
+        for universe_dir in os.scandir(self.folder):
+            if not universe_dir.is_dir():
+                continue
+            for entry in os.scandir(universe_dir.path):
+                if entry.name.endswith(TOKEN_CACHE_EXT):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return sorted(entries)
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the cache in bytes.
+        """
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return os.path.isfile(self._entry_path(*key))
+
+    def get(self, bed_id: str, universe_id: str) -> Union[Tokens, None]:
+        """
+        Get the tokens of a region set, marking the entry as recently used.
+
+        :param bed_id: identifier of the region set
+        :param universe_id: identifier of the universe
+        :return: offsets and token ids (memory-mapped), or None if they are not cached
+        """
+        path = self._entry_path(bed_id, universe_id)
+        try:
+            header, columns = read_columnar_file(path, TOKEN_CACHE_MAGIC)
+            check_binary_version(header, TOKEN_CACHE_VERSION, path)
+            self._touch(path)
+        except (OSError, ValueError, BinaryFileReadError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return columns["offsets"], columns["ids"]
+
+    def put(self, bed_id: str, universe_id: str, offsets: np.ndarray, ids: np.ndarray) -> str:
+        """
+        Store the tokens of a region set, evicting old entries if the cache gets too large.
+
+        :param bed_id: identifier of the region set
+        :param universe_id: identifier of the universe
+        :param offsets: start of the tokens of each region in `ids`, plus the total length
+        :param ids: token ids
+        :return: path to the entry
+        """
+        path = self._entry_path(bed_id, universe_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = self.size
+        if os.path.isfile(path):
+            size -= os.path.getsize(path)
+        write_columnar_file(
+            path,
+            TOKEN_CACHE_MAGIC,
+            {"version": TOKEN_CACHE_VERSION},
+            {
+                "offsets": np.asarray(offsets, dtype=np.int64),
+                "ids": np.asarray(ids, dtype=np.uint32),
+            },
+        )
+        self._touch(path)
+        self._size = size + os.path.getsize(path)
+        if self.max_size is not None and self._size > self.max_size:
+            self.evict(self.max_size)
+        return path
+
+    def get_or_compute(
+        self, bed_id: str, universe_id: str, compute: Callable[[], Tokens]
+    ) -> Tokens:
+        """
+        Get the tokens of a region set from the cache, or compute and cache them.
+
+        :param bed_id: identifier of the region set
+        :param universe_id: identifier of the universe
+        :param compute: function returning the offsets and token ids, called on a cache miss
+        :return: offsets and token ids
+        """
+        tokens = self.get(bed_id, universe_id)
+        if tokens is not None:
+            return tokens
+        offsets, ids = compute()
+        try:
+            self.put(bed_id, universe_id, offsets, ids)
+        except OSError as e:
+            _LOGGER.warning(f"Could not cache tokens of '{bed_id}': {e}")
+        return offsets, ids
+
+    def evict(self, max_size: int) -> int:
+        """
+        Remove the least recently used entries until the cache is at most `max_size` bytes.
+
+        :param max_size: size to shrink the cache to, in bytes
+        :return: number of removed entries
+        """
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            removed += 1
+        self._size = size
+        return removed
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self._size = 0
+
+    def __repr__(self):
+        return (
+            f"TokenCache(folder='{self.folder}', size={self.size}, max_size={self.max_size}, "
+            f"hits={self.hits}, misses={self.misses})"
+        )
@@ -0,0 +1,53 @@
+import os
+
+CHR_KEY = "chr"
+START_KEY = "start"
+END_KEY = "end"
+
+# number of cells encoded together by AnnDataTokenizer.encode
+ANNDATA_ENCODE_CHUNK_SIZE = 10_000
+
+# number of cells per task of AnnDataTokenizer.encode_to_gtok
+ANNDATA_GTOK_CHUNK_SIZE = 10_000
+# folder (inside the output folder) marking the chunks written by encode_to_gtok
+GTOK_PROGRESS_DIR = ".progress"
+
+# file (next to the token folder) recording the BED files tokenized by hard tokenization
+TOKENIZATION_MANIFEST_SUFFIX = "_manifest.tsv"
+# tasks handed to each hard tokenization worker, to balance load without per-file overhead
+TOKENIZATION_TASKS_PER_WORKER = 16
+
+TOKEN_CACHE_ENV = "GENIML_TOKEN_CACHE"
+# token cache folder, relative to the home folder, used when TOKEN_CACHE_ENV is not set
+DEFAULT_TOKEN_CACHE_FOLDER = os.path.join(".cache", "geniml", "tokens")
+# maximum size of the token cache, in bytes
+DEFAULT_TOKEN_CACHE_SIZE = 2**30
+TOKEN_CACHE_EXT = ".tok"
+TOKEN_CACHE_MAGIC = b"GENIMLTK"
+# 2: tokens of a region are ordered by start, then end, as by the tree tokenizer
+TOKEN_CACHE_VERSION = 2
+
+# prebuilt tokenizer index, persisted next to the universe file
+TOKENIZER_INDEX_EXT = ".tkidx"
+TOKENIZER_INDEX_MAGIC = b"GENIMLTI"
+TOKENIZER_INDEX_VERSION = 1
+# special tokens of the tree tokenizer, by the name of their `<name>_token_id` attribute
+SPECIAL_TOKENS = ("unknown", "padding", "mask", "cls", "bos", "eos", "sep")
+
+# `.gtok` files: magic bytes, then a flag for the token size, then the tokens (little-endian)
+GTOK_MAGIC = b"GTOK"
+GTOK_U16_FLAG = 1
+GTOK_U32_FLAG = 2
+
+# files queued per BEDToolsTokenizer worker, to bound the files globbed ahead of the workers
+BEDTOOLS_TASKS_PER_WORKER = 4
+
+# defaults of the tokenization benchmark (see tokenization.benchmark)
+BENCHMARK_UNIVERSE_SIZE = 1_000_000
+BENCHMARK_QUERY_SIZE = 100_000
+BENCHMARK_N_CELLS = 1_000
+BENCHMARK_N_FEATURES = 50_000
+BENCHMARK_CELL_DENSITY = 0.05
+BENCHMARK_REPEAT = 3
+# relative drop of regions/sec, compared to a baseline, reported as a regression
+BENCHMARK_TOLERANCE = 0.2
@@ -2,9 +2,21 @@ import argparse
 import os
 import shlex
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Tuple
 
+import numpy as np
+
+from ..io.bed_index import parse_bed_line
+from ..io.exceptions import BEDFileReadError
+from ..io.io import RegionSet
+from .const import TOKENIZATION_MANIFEST_SUFFIX, TOKENIZATION_TASKS_PER_WORKER
 from .utils import Timer, time_str
 
+# state of the tokenization worker processes: the shared universe
+_WORKER_STATE: Dict[str, object] = {}
+
 
 def bedtools_tokenization(
     f: str,
@@ -37,60 +49,254 @@ def bedtools_tokenization(
     os.remove(temp)
 
 
+def load_universe(universe: str) -> Tuple[np.ndarray, RegionSet]:
+    """Loads a universe file for in-process tokenization.
+
+    Args:
+        universe (str): Path to a universe file.
+
+    Returns:
+        tuple[np.ndarray, RegionSet]: The lines of the universe regions (without line
+            breaks), and the universe regions, with their interval index built.
+    """
+    lines, chroms, starts, ends = [], [], [], []
+    with open(universe, "rb") as f:
+        for line in f:
+            record = parse_bed_line(line)
+            if record is None:
+                continue
+            lines.append(line.rstrip(b"\r\n"))
+            chroms.append(record[0])
+            starts.append(record[1])
+            ends.append(record[2])
+    universe_set = RegionSet.from_arrays(chroms, starts, ends)
+    universe_set.interval_index
+    return np.asarray(lines, dtype=object), universe_set
+
+
+def intersect_universe(query: RegionSet, universe_set: RegionSet, fraction: float) -> np.ndarray:
+    """Finds the universe regions hit by a query, like `bedtools intersect -a universe
+    -b query -u -f fraction`.
+
+    The query is looked up in the interval index of the universe, so the cost depends on the
+    size of the query, not of the universe.
+
+    Args:
+        query (RegionSet): The regions to tokenize.
+        universe_set (RegionSet): The universe regions.
+        fraction (float): Minimum overlap, as a fraction of a universe region, with a single
+            query region.
+
+    Returns:
+        np.ndarray: Indices of the hit universe regions, in universe order.
+    """
+    query_idx, universe_idx = query.overlaps(universe_set)
+    overlap = np.minimum(query.ends[query_idx], universe_set.ends[universe_idx]) - np.maximum(
+        query.starts[query_idx], universe_set.starts[universe_idx]
+    )
+    lengths = universe_set.ends[universe_idx] - universe_set.starts[universe_idx]
+    return np.unique(universe_idx[overlap >= fraction * lengths])
+
+
+def tokenize_file(
+    f: str,
+    data_folder: str,
+    target_folder: str,
+    universe_lines: np.ndarray,
+    universe_set: RegionSet,
+    fraction: float,
+) -> int:
+    """Tokenizes a raw BED file, writing the universe regions it hits.
+
+    Args:
+        f (str): File name.
+        data_folder (str): The folder where raw BED files reside.
+        target_folder (str): The folder that stores tokenized BED files.
+        universe_lines (np.ndarray): The lines of the universe regions.
+        universe_set (RegionSet): The universe regions.
+        fraction (float): A parameter for bedtools.intersect.
+
+    Returns:
+        int: Number of tokens.
+    """
+    try:
+        hits = intersect_universe(RegionSet(os.path.join(data_folder, f)), universe_set, fraction)
+    except BEDFileReadError:
+        # empty files have no tokens
+        hits = np.empty(0, dtype=np.int64)
+    with open(os.path.join(target_folder, f), "wb") as f_target:
+        if len(hits) > 0:
+            f_target.write(b"\n".join(universe_lines[hits].tolist()) + b"\n")
+    return len(hits)
+
+
+def _init_worker(universe_lines: np.ndarray, universe_set: RegionSet):
+    """Initializes a tokenization worker process with the shared universe."""
+    _WORKER_STATE["universe_lines"] = universe_lines
+    _WORKER_STATE["universe_set"] = universe_set
+
+
+def _tokenize_file_worker(
+    f: str, data_folder: str, target_folder: str, fraction: float
+) -> Tuple[str, int, int]:
+    """Tokenizes a raw BED file in a worker process."""
+    n_tokens = tokenize_file(
+        f,
+        data_folder,
+        target_folder,
+        _WORKER_STATE["universe_lines"],
+        _WORKER_STATE["universe_set"],
+        fraction,
+    )
+    return f, os.path.getsize(os.path.join(data_folder, f)), n_tokens
+
+
+def manifest_path(token_folder: str) -> str:
+    """Gives the path of the manifest of a token folder. The manifest is kept next to the
+    folder, so that the folder only holds tokenized files.
+
+    Args:
+        token_folder (str): The folder that stores tokenized BED files.
+
+    Returns:
+        str: The path to the manifest.
+    """
+    return os.path.normpath(token_folder) + TOKENIZATION_MANIFEST_SUFFIX
+
+
+def read_manifest(token_folder: str, universe: str, fraction: float) -> Dict[str, int]:
+    """Reads the files recorded as tokenized in the manifest of a token folder.
+
+    Manifests written with a different universe or fraction are ignored.
+
+    Args:
+        token_folder (str): The folder that stores tokenized BED files.
+        universe (str): The path to the universe file.
+        fraction (float): A parameter for bedtools.intersect.
+
+    Returns:
+        dict[str, int]: Size of the raw BED file of each tokenized file.
+    """
+    path = manifest_path(token_folder)
+    if not os.path.exists(path):
+        return {}
+    done = {}
+    with open(path, "r") as f:
+        if f.readline() != _manifest_header(universe, fraction):
+            return {}
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 3:
+                done[fields[0]] = int(fields[1])
+    return done
+
+
+def _manifest_header(universe: str, fraction: float) -> str:
+    return f"# universe={os.path.abspath(universe)}\tfraction={fraction!r}\n"
+
+
+def tokenize_files(
+    raw_data_folder: str,
+    token_folder: str,
+    universe: str,
+    files: List[str],
+    fraction: float,
+    num_workers: int = 1,
+) -> int:
+    """Tokenizes raw BED files in-process, like `bedtools intersect -a universe -b file -u
+    -f fraction`.
+
+    The universe and its interval index are loaded once and shared by a pool of num_workers
+    processes. Every tokenized file is recorded in a manifest (see manifest_path), so
+    interrupted runs resume with the files that were not tokenized yet; files whose size
+    changed are tokenized again.
+
+    Args:
+        raw_data_folder (str): The folder where raw BED files reside.
+        token_folder (str): The folder to store tokenized BED files.
+        universe (str): The path to a universe file.
+        files (list[str]): Names of the BED files to tokenize.
+        fraction (float): A parameter for bedtools.intersect.
+        num_workers (int, optional): Number of processes used. Defaults to 1.
+
+    Returns:
+        int: Number of files tokenized by this call.
+    """
+    os.makedirs(token_folder, exist_ok=True)
+    done = read_manifest(token_folder, universe, fraction)
+    pending = [
+        f
+        for f in dict.fromkeys(files)
+        if done.get(f) != os.path.getsize(os.path.join(raw_data_folder, f))
+        or not os.path.exists(os.path.join(token_folder, f))
+    ]
+    if len(pending) == 0:
+        print(f"Use the existing folder {token_folder}", flush=True)
+        return 0
+    if len(done) > 0:
+        print(f"Folder {token_folder} has {len(pending)} files not processed. Continue...")
+
+    universe_lines, universe_set = load_universe(universe)
+    print(f"\033[93mUniverse size is {len(universe_set)}\033[00m")
+
+    mode = "a" if len(done) > 0 else "w"
+    with open(manifest_path(token_folder), mode) as manifest:
+        if mode == "w":
+            manifest.write(_manifest_header(universe, fraction))
+        if num_workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_worker,
+                initargs=(universe_lines, universe_set),
+            ) as executor:
+                results = executor.map(
+                    _tokenize_file_worker,
+                    pending,
+                    repeat(raw_data_folder),
+                    repeat(token_folder),
+                    repeat(fraction),
+                    chunksize=max(
+                        1, len(pending) // (num_workers * TOKENIZATION_TASKS_PER_WORKER)
+                    ),
+                )
+                for f, size, n_tokens in results:
+                    manifest.write(f"{f}\t{size}\t{n_tokens}\n")
+                    manifest.flush()
+        else:
+            for f in pending:
+                n_tokens = tokenize_file(
+                    f, raw_data_folder, token_folder, universe_lines, universe_set, fraction
+                )
+                size = os.path.getsize(os.path.join(raw_data_folder, f))
+                manifest.write(f"{f}\t{size}\t{n_tokens}\n")
+                manifest.flush()
+    return len(pending)
+
+
 def generate_tokens(
     raw_data_folder: str,
     token_folder: str,
     universe: str,
     file_list: str,
-    bedtools: str,
     fraction: float,
+    num_workers: int = 1,
 ) -> None:
     """Tokenizes raw BED files specified by file_list.
 
-    Tokenizes raw BED files specified by file_list. First, checks existing files
-    in token_folder. If token_folder has all the tokenized BED files, then does
-    nothing. Otherwise, tokenizes raw BED files that are in file_list but not
-    in token_folder.
+    Tokenizes raw BED files specified by file_list, skipping the files that the manifest of
+    token_folder records as already tokenized (see tokenize_files).
 
     Args:
         raw_data_folder (str): The folder where raw BED files reside.
         token_folder (str): The folder to store tokenized BED files.
         universe (str): The path to a universe file.
         file_list (str): The path to a file which contains selected BED files per row.
-        bedtools (str): The path to a bedtools binary.
         fraction (float): A parameter for bedtools.intersect.
+        num_workers (int, optional): Number of processes used. Defaults to 1.
     """
-    usize = 0
-    with open(universe, "r") as f:
-        for _ in f:
-            usize += 1
-    print(f"\033[93mUniverse size is {usize}\033[00m")
-
-    all_set = []
     with open(file_list, "r") as fin:
-        for fname in fin:
-            name = fname.strip()
-            all_set.append(name)
-    all_set = set(all_set)
-
-    if os.path.exists(token_folder):
-        files = os.listdir(token_folder)
-        existing_set = set([f.strip() for f in files])
-        not_covered = all_set - existing_set
-        number = len(not_covered)
-        if number == 0:
-            print(f"Use the existing folder {token_folder}", flush=True)
-            return
-        else:
-            print(
-                f"Folder {token_folder} exists with {number} files not processed. Continue...",
-                flush=True,
-            )
-    else:
-        os.makedirs(token_folder)
-        not_covered = all_set
-    for f in not_covered:
-        bedtools_tokenization(f, bedtools, raw_data_folder, token_folder, universe, fraction)
+        files = [name.strip() for name in fin if name.strip()]
+    tokenize_files(raw_data_folder, token_folder, universe, files, fraction, num_workers)
 
 
 def main(args: argparse.Namespace):
@@ -102,18 +308,18 @@ def main(args: argparse.Namespace):
     Args:
         args (argparse.Namespace): See the definition of the ArgumentParser.
     """
-    local_timer = utils.Timer()
+    local_timer = Timer()
     print(f"Entering hard tokenization. Results stored in {args.token_folder}")
     generate_tokens(
         args.data_folder,
         args.token_folder,
         args.universe,
         args.file_list,
-        args.bedtools_path,
         args.fraction,
+        getattr(args, "num_workers", 1),
     )
     tokenization_time = local_timer.t()
-    print(f"Hard tokenization takes {utils.time_str(tokenization_time)}")
+    print(f"Hard tokenization takes {time_str(tokenization_time)}")
 
 
 if __name__ == "__main__":
@@ -145,10 +351,10 @@ if __name__ == "__main__":
         help="path to a universe file",
     )
     parser.add_argument(
-        "--bedtools-path",
-        type=str,
-        default="/scratch/gz5hp/genomes/bedtools",
-        help="path to the bedtools binary",
+        "--num-workers",
+        type=int,
+        default=1,
+        help="number of processes used",
     )
     parser.add_argument(
         "--fraction",
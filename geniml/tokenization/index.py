@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from gtars.tokenizers import Region as GRegion
+
+from ..const import PKG_NAME
+from ..io import RegionSet
+from ..io.const import CHROM_CODE_DTYPE, REGION_COORD_DTYPE
+from ..io.exceptions import BinaryFileReadError
+from ..io.interval_index import IntervalIndex
+from ..io.utils import (
+    binary_is_fresh,
+    check_binary_version,
+    compute_bed_identifier_from_columns,
+    read_columnar_file,
+    source_stat,
+    write_columnar_file,
+)
+from .const import (
+    SPECIAL_TOKENS,
+    TOKENIZER_INDEX_EXT,
+    TOKENIZER_INDEX_MAGIC,
+    TOKENIZER_INDEX_VERSION,
+)
+
+_LOGGER = logging.getLogger(PKG_NAME)
+
+# prefix of the interval index columns in the persisted index
+_INTERVAL_PREFIX = "interval_"
+
+
+def tokenizer_index_path(universe: str) -> str:
+    """
+    Get the path of the prebuilt index sidecar of a universe file.
+
+    :param universe: path to the universe bed file
+    :return: path to the index
+    """
+    return universe + TOKENIZER_INDEX_EXT
+
+
+def _columns_checksum(columns: Dict[str, np.ndarray]) -> int:
+    """
+    Compute the CRC32 checksum of a set of columns, in order.
+
+    :param columns: named 1-D arrays
+    :return: checksum
+    """
+    checksum = 0
+    for array in columns.values():
+        checksum = zlib.crc32(memoryview(np.ascontiguousarray(array)).cast("B"), checksum)
+    return checksum
+
+
+def _universe_identifier(
+    regions_identifier: str, universe_ids: np.ndarray, special_token_ids: Dict[str, int]
+) -> str:
+    """
+    Compute the identifier of a tokenizer's universe: the digest of its regions and of the
+    token ids they (and the special tokens) map to, since the same regions can be numbered
+    differently (e.g. when a universe is exported with its special tokens).
+
+    :param regions_identifier: bed identifier of the universe regions
+    :param universe_ids: token id of each universe region
+    :param special_token_ids: token id of each special token
+    :return: identifier
+    """
+    digest = hashlib.md5(regions_identifier.encode("utf-8"))
+    digest.update(np.ascontiguousarray(universe_ids, dtype="<i8").tobytes())
+    digest.update(json.dumps(special_token_ids, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TokenizerIndex:
+    """
+    Prebuilt index of a tree tokenizer's universe, with everything needed to tokenize and
+    decode without building the tokenizer: the region of every token and an interval index
+    over the universe regions.
+
+    The index is persisted as a memory-mappable file next to the universe, so loading it is
+    near instant and its pages are shared between processes (e.g. forked workers) through the
+    page cache. A checksum of the arrays guards against corrupted files.
+    """
+
+    def __init__(self, header: dict, columns: Dict[str, np.ndarray]):
+        """
+        :param header: index metadata
+        :param columns: index arrays
+        """
+        self._header = header
+        self._columns = columns
+        self.chrom_names = np.asarray(header["chrom_names"], dtype=object)
+        self.special_token_ids: Dict[str, int] = header["special_token_ids"]
+        self.identifier: str = header["identifier"]
+        self.token_chrom_codes: np.ndarray = columns["token_chrom_codes"]
+        self.token_starts: np.ndarray = columns["token_starts"]
+        self.token_ends: np.ndarray = columns["token_ends"]
+        self.universe_ids: np.ndarray = columns["universe_ids"]
+        self.interval_index = IntervalIndex.from_columns(
+            header["interval_index"],
+            {
+                name[len(_INTERVAL_PREFIX) :]: array
+                for name, array in columns.items()
+                if name.startswith(_INTERVAL_PREFIX)
+            },
+        )
+
+    @classmethod
+    def build(cls, tokenizer, source_path: str = None) -> "TokenizerIndex":
+        """
+        Index the universe of a gtars tree tokenizer.
+
+        Token ids are looked up region by region, since duplicated universe regions share a
+        token. Duplicates are kept in the interval index, so tokenizing yields their token once
+        per copy, like the tree tokenizer does.
+
+        :param tokenizer: gtars tree tokenizer
+        :param source_path: path to the universe file, to detect stale persisted indexes
+        :return: TokenizerIndex
+        """
+        universe = tokenizer.universe
+        regions = universe.regions
+        ids = np.fromiter(
+            (universe.convert_region_to_id(region) for region in regions),
+            dtype=np.int64,
+            count=len(regions),
+        )
+        chrom_codes, chrom_names = pd.factorize(
+            np.asarray([region.chr for region in regions], dtype=object)
+        )
+        chrom_codes = chrom_codes.astype(CHROM_CODE_DTYPE)
+        starts = np.fromiter((region.start for region in regions), REGION_COORD_DTYPE, len(ids))
+        ends = np.fromiter((region.end for region in regions), REGION_COORD_DTYPE, len(ids))
+        chrom_names = np.asarray(chrom_names, dtype=object)
+
+        special_token_ids = {
+            name: int(getattr(tokenizer, f"{name}_token_id")) for name in SPECIAL_TOKENS
+        }
+        # universes exported with their special tokens can map regions past `len(tokenizer)`
+        vocab_size = max(
+            len(tokenizer), int(ids.max(initial=-1)) + 1, max(special_token_ids.values()) + 1
+        )
+        token_chrom_codes = np.zeros(vocab_size, dtype=CHROM_CODE_DTYPE)
+        token_starts = np.zeros(vocab_size, dtype=REGION_COORD_DTYPE)
+        token_ends = np.zeros(vocab_size, dtype=REGION_COORD_DTYPE)
+        token_chrom_codes[ids] = chrom_codes
+        token_starts[ids] = starts
+        token_ends[ids] = ends
+
+        rows = np.flatnonzero(~np.isin(ids, list(special_token_ids.values())))
+        interval_index = IntervalIndex(chrom_names, chrom_codes[rows], starts[rows], ends[rows])
+        interval_header, interval_columns = interval_index.to_columns()
+
+        header = {
+            "version": TOKENIZER_INDEX_VERSION,
+            "chrom_names": chrom_names.tolist(),
+            "special_token_ids": special_token_ids,
+            "identifier": _universe_identifier(
+                compute_bed_identifier_from_columns(
+                    chrom_names, chrom_codes[rows], starts[rows], ends[rows]
+                ),
+                ids[rows],
+                special_token_ids,
+            ),
+            "interval_index": interval_header,
+        }
+        if source_path is not None:
+            header["source"] = source_stat(source_path)
+        columns = {
+            "token_chrom_codes": token_chrom_codes,
+            "token_starts": token_starts,
+            "token_ends": token_ends,
+            "universe_ids": ids[rows],
+        }
+        for name, array in interval_columns.items():
+            columns[_INTERVAL_PREFIX + name] = array
+        return cls(header, columns)
+
+    @classmethod
+    def load(cls, index_path: str, verify: bool = True) -> "TokenizerIndex":
+        """
+        Load (memory-map) a persisted index.
+
+        :param index_path: path to the index
+        :param verify: whether to check the checksum of the arrays
+        :return: TokenizerIndex
+        """
+        header, columns = read_columnar_file(index_path, TOKENIZER_INDEX_MAGIC)
+        check_binary_version(header, TOKENIZER_INDEX_VERSION, index_path)
+        if verify and _columns_checksum(columns) != header.get("checksum"):
+            raise BinaryFileReadError(f"Checksum mismatch in tokenizer index '{index_path}'")
+        return cls(header, columns)
+
+    @classmethod
+    def open(
+        cls, universe: str, build_tokenizer: Callable[[], object], persist: bool = True
+    ) -> "TokenizerIndex":
+        """
+        Load the index of a universe file, building (and persisting) it if it is missing, stale
+        or corrupted.
+
+        :param universe: path to the universe bed file
+        :param build_tokenizer: function returning the gtars tree tokenizer of the universe,
+            only called if the index has to be built
+        :param persist: whether to save a newly built index next to the universe file
+        :return: TokenizerIndex
+        """
+        index_path = tokenizer_index_path(universe)
+        if binary_is_fresh(index_path, universe, TOKENIZER_INDEX_MAGIC, TOKENIZER_INDEX_VERSION):
+            try:
+                return cls.load(index_path)
+            except BinaryFileReadError as e:
+                _LOGGER.warning(f"Rebuilding tokenizer index of '{universe}': {e}")
+
+        index = cls.build(build_tokenizer(), universe)
+        if persist:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                _LOGGER.warning(f"Could not save tokenizer index of '{universe}': {e}")
+        return index
+
+    def save(self, index_path: str) -> str:
+        """
+        Persist the index.
+
+        :param index_path: path to the index
+        :return: path to the index
+        """
+        header = dict(self._header)
+        header["checksum"] = _columns_checksum(self._columns)
+        write_columnar_file(index_path, TOKENIZER_INDEX_MAGIC, header, self._columns)
+        return index_path
+
+    @property
+    def vocab_size(self) -> int:
+        return len(self.token_starts)
+
+    def __len__(self):
+        return self.vocab_size
+
+    def tokenize_chunk(
+        self, chrom_names: np.ndarray, chrom_codes: np.ndarray, starts, ends
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tokenize a block of region columns (e.g. from `RegionSet.iter_chunks`), every region on
+        its own, as the tree tokenizer would: the universe regions it overlaps, ordered by
+        start then end, or the unknown token if it overlaps none.
+
+        :param chrom_names: chromosome names of the regions
+        :param chrom_codes: index of each region's chromosome in chrom_names
+        :param starts: start position of each region
+        :param ends: end position of each region
+        :return: offsets and token ids; the tokens of region `i` are
+            `ids[offsets[i]:offsets[i + 1]]`
+        """
+        n_regions = len(starts)
+        region_ids, universe_rows = self.interval_index.overlaps(
+            chrom_names, chrom_codes, starts, ends
+        )
+        token_ids = self.universe_ids[universe_rows]
+        positions = self.token_starts[token_ids].astype(np.int64)
+        position_ends = self.token_ends[token_ids].astype(np.int64)
+        unknown = np.flatnonzero(np.bincount(region_ids, minlength=n_regions) == 0)
+        region_ids = np.concatenate([region_ids, unknown])
+        token_ids = np.concatenate(
+            [token_ids, np.full(len(unknown), self.special_token_ids["unknown"])]
+        )
+        positions = np.concatenate([positions, np.zeros(len(unknown), dtype=np.int64)])
+        position_ends = np.concatenate([position_ends, np.zeros(len(unknown), dtype=np.int64)])
+
+        # the tree tokenizer returns the tokens of a region ordered by start, then end
+        order = np.lexsort((token_ids, position_ends, positions, region_ids))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(region_ids, minlength=n_regions))])
+        return offsets.astype(np.int64), token_ids[order]
+
+    def tokenize(self, regions: RegionSet) -> sp.csr_matrix:
+        """
+        Tokenize every region of a RegionSet on its own (see `tokenize_chunk`).
+
+        Row `i` of the result holds the token ids of region `i`. Indices within a row are kept
+        in token order, so don't sort them. Flattening the rows (`.indices`) gives the tokens
+        of the whole RegionSet.
+
+        :param regions: regions to tokenize (streamed in chunks if backed)
+        :return: regions by tokens matrix
+        """
+        offsets, ids = [np.zeros(1, dtype=np.int64)], []
+        for codes, starts, ends in regions.iter_chunks():
+            chunk_offsets, chunk_ids = self.tokenize_chunk(
+                regions.chrom_names, codes, starts, ends
+            )
+            offsets.append(chunk_offsets[1:] + offsets[-1][-1])
+            ids.append(chunk_ids)
+        offsets = np.concatenate(offsets)
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        return sp.csr_matrix(
+            (np.ones(len(ids), dtype=np.uint8), ids, offsets),
+            shape=(len(offsets) - 1, self.vocab_size),
+        )
+
+    def decode(self, ids: List[int]) -> List[GRegion]:
+        """
+        Get the regions of a list of token ids.
+
+        :param ids: token ids
+        :return: regions
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        chroms = self.chrom_names[self.token_chrom_codes[ids]].tolist()
+        starts = self.token_starts[ids].tolist()
+        ends = self.token_ends[ids].tolist()
+        return [GRegion(chrom, start, end) for chrom, start, end in zip(chroms, starts, ends)]
@@ -1,22 +1,47 @@
-import multiprocessing
 import os
-import shutil
-import subprocess
 from abc import ABC, abstractmethod
-from typing import List, Union
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Iterator, List, Tuple, Union
 
 import numpy as np
 import scanpy as sc
+import scipy.sparse as sp
 from gtars.tokenizers import Region as GRegion
 from gtars.tokenizers import TreeTokenizer as GTreeTokenizer
 from huggingface_hub import hf_hub_download
 from rich.progress import track
+from ubiquerg import is_url
 
 from geniml.io import Region, RegionSet
-from geniml.tokenization.split_file import split_file
 
-from .hard_tokenization_batch import main as hard_tokenization
-from .utils import Timer, time_str
+from ..const import PKG_NAME
+from ..io.bed_index import compute_bed_identifier_from_file, iter_bed_chunks
+from ..io.const import REGIONSET_BINARY_EXT, REGIONSET_CHUNK_SIZE
+from ..scembed.utils import AnnDataChunker
+from .cache import TokenCache
+from .const import (
+    ANNDATA_ENCODE_CHUNK_SIZE,
+    ANNDATA_GTOK_CHUNK_SIZE,
+    CHR_KEY,
+    END_KEY,
+    GTOK_PROGRESS_DIR,
+    START_KEY,
+)
+from .hard_tokenization_batch import tokenize_files
+from .index import TokenizerIndex
+from .utils import (
+    Timer,
+    _gtok_worker,
+    _init_gtok_worker,
+    encode_cells,
+    encode_chunk_to_gtok,
+    gtok_chunk_marker,
+    time_str,
+    write_gtok_stream,
+)
+
+_LOGGER = getLogger(PKG_NAME)
 
 
 class Tokenizer(ABC):
@@ -25,6 +50,17 @@ class Tokenizer(ABC):
         raise NotImplementedError
 
 
+class FileTokenizer(Tokenizer):
+    """
+    A tokenizer of BED files on disk, that writes the tokens of every file to an output folder
+    instead of returning them.
+    """
+
+    @abstractmethod
+    def tokenize(self, input_globs: List[str], output_folder: str, *args, **kwargs):
+        raise NotImplementedError
+
+
 class Namespace:
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -53,27 +89,85 @@ class TreeTokenizer(Tokenizer):
         universe_file_path = hf_hub_download(model_path, "universe.bed")
         return cls(universe_file_path, **kwargs)
 
-    def __init__(self, universe: str) -> GTreeTokenizer:
+    def __init__(
+        self, universe: str, cache: Union[TokenCache, str, bool] = False
+    ) -> GTreeTokenizer:
         """
         Create a new tokenizer.
 
-        This tokenizer only accepts a path to a BED file containing regions.
+        This tokenizer only accepts a path to a BED file containing regions. The universe is
+        indexed once and the index is persisted next to the universe file (see
+        `TokenizerIndex`), so later tokenizers of the same universe start instantly. The gtars
+        tree tokenizer is only built when it is needed (e.g. to tokenize AnnData objects).
 
         :param str universe: The universe to use for tokenization.
+        :param Union[TokenCache, str, bool] cache: Cache for the tokens of RegionSets: a
+            TokenCache, the path to a cache folder, True to use the default cache, or False (the
+            default) to not cache tokens.
         """
-        self._tokenizer = GTreeTokenizer(universe)
+        self._universe_path = universe
+        self._gtars_tokenizer = None
+        self._index = TokenizerIndex.open(universe, lambda: self._tokenizer)
+        if cache is True:
+            self.cache = TokenCache()
+        elif isinstance(cache, str):
+            self.cache = TokenCache(cache)
+        elif cache is False:
+            self.cache = None
+        else:
+            self.cache = cache
+
+    @property
+    def _tokenizer(self) -> GTreeTokenizer:
+        if self._gtars_tokenizer is None:
+            self._gtars_tokenizer = GTreeTokenizer(self._universe_path)
+        return self._gtars_tokenizer
 
     @property
     def universe(self):
         return self._tokenizer.universe
 
+    @property
+    def universe_identifier(self) -> str:
+        """
+        Identifier (digest) of the universe regions and of the token ids they map to.
+        """
+        return self._index.identifier
+
+    def region_tokens(self, regions: RegionSet) -> sp.csr_matrix:
+        """
+        Tokenize every region of a RegionSet on its own (see `TokenizerIndex.tokenize`). Tokens
+        are looked up in, and added to, the token cache if the tokenizer has one.
+
+        :param RegionSet regions: The regions to tokenize.
+        :return sp.csr_matrix: Regions by tokens matrix.
+        """
+
+        def compute():
+            matrix = self._index.tokenize(regions)
+            return matrix.indptr, matrix.indices
+
+        if self.cache is None:
+            offsets, ids = compute()
+        else:
+            offsets, ids = self.cache.get_or_compute(
+                regions.identifier, self.universe_identifier, compute
+            )
+        return sp.csr_matrix(
+            (np.ones(len(ids), dtype=np.uint8), ids, offsets), shape=(len(offsets) - 1, len(self))
+        )
+
     def tokenize(self, query: Union[str, RegionSet]) -> List[List[Region]]:
         """
         Tokenize a Region or RegionSet into the universe
 
         :param Union[Region, RegionSet] query: The query to tokenize.
         """
-        if isinstance(query, sc.AnnData) or isinstance(query, RegionSet):
+        if isinstance(query, str):
+            query = RegionSet(query)
+        if isinstance(query, RegionSet):
+            return self._index.decode(self.encode(query))
+        elif isinstance(query, sc.AnnData):
             result = self._tokenizer(query)
             return result.to_regions()
         else:
@@ -81,13 +175,17 @@ class TreeTokenizer(Tokenizer):
                 f"Please pass a RegionSet object or a path to a BED file. You passed: {type(query)}"
             )
 
-    def encode(self, query: sc.AnnData) -> List[List[int]]:
+    def encode(self, query: Union[str, RegionSet, sc.AnnData]) -> List[int]:
         """
-        Tokenize an AnnData object to IDs.
+        Tokenize a RegionSet (or an AnnData object) to IDs.
 
-        :param sc.AnnData query: The query to tokenize.
+        :param Union[str, RegionSet, sc.AnnData] query: The query to tokenize.
         """
-        if isinstance(query, sc.AnnData) or isinstance(query, RegionSet):
+        if isinstance(query, str):
+            query = RegionSet(query)
+        if isinstance(query, RegionSet):
+            return self.region_tokens(query).indices.tolist()
+        elif isinstance(query, sc.AnnData):
             result = self._tokenizer(query)
             return result.to_ids()
         else:
@@ -95,58 +193,152 @@ class TreeTokenizer(Tokenizer):
                 f"Please pass a RegionSet object or a path to a BED file. You passed: {type(query)}"
             )
 
+    def iter_region_tokens(
+        self, query: Union[str, RegionSet], chunk_size: int = REGIONSET_CHUNK_SIZE
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Tokenize a BED file (or RegionSet) block by block, holding at most one block of regions
+        in memory. Local BED files are streamed in a single pass, without indexing them, so
+        files of any size are tokenized in constant memory. If the tokenizer has a token cache,
+        the tokens of the whole query are looked up in, and added to, it (see `region_tokens`),
+        and the blocks are sliced from the cached (memory-mapped) tokens.
+
+        :param Union[str, RegionSet] query: Path (or URL) to a BED file, or a (backed) RegionSet.
+        :param int chunk_size: Number of regions tokenized at a time.
+        :return Iterator[Tuple[np.ndarray, np.ndarray]]: The offsets and token ids of each
+            block; the tokens of region `i` of a block are `ids[offsets[i]:offsets[i + 1]]`.
+        """
+        chunks = None
+        bed_file = None
+        if isinstance(query, str):
+            if query.endswith(REGIONSET_BINARY_EXT):
+                # binary RegionSet files are memory-mapped, not parsed
+                query = RegionSet.open_binary(query)
+            elif os.path.isfile(query):
+                bed_file = query
+                chunks = iter_bed_chunks(query, chunk_size)
+            elif is_url(query):
+                # remote files can not be backed, so they are downloaded and read in memory
+                query = RegionSet(query)
+            else:
+                query = RegionSet(query, backed=True)
+
+        if chunks is None:
+            if not isinstance(query, RegionSet):
+                raise ValueError(
+                    f"Please pass a RegionSet object or a path to a BED file. You passed: {type(query)}"
+                )
+            chunks = ((query.chrom_names, *chunk) for chunk in query.iter_chunks(chunk_size))
+
+        tokens = (self._index.tokenize_chunk(*chunk) for chunk in chunks)
+        if self.cache is None:
+            yield from tokens
+            return
+
+        def compute():
+            offsets, ids = [np.zeros(1, dtype=np.int64)], []
+            for chunk_offsets, chunk_ids in tokens:
+                offsets.append(chunk_offsets[1:] + offsets[-1][-1])
+                ids.append(chunk_ids)
+            return np.concatenate(offsets), (
+                np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+            )
+
+        # local files are hashed as they are streamed, so they share cache entries with their
+        # RegionSets
+        bed_id = (
+            compute_bed_identifier_from_file(bed_file)
+            if bed_file is not None
+            else query.identifier
+        )
+        offsets, ids = self.cache.get_or_compute(bed_id, self.universe_identifier, compute)
+        for start in range(0, len(offsets) - 1, chunk_size):
+            stop = min(start + chunk_size, len(offsets) - 1)
+            yield offsets[start : stop + 1] - offsets[start], ids[offsets[start] : offsets[stop]]
+
+    def tokenize_stream(
+        self, query: Union[str, RegionSet], chunk_size: int = REGIONSET_CHUNK_SIZE
+    ) -> Iterator[np.ndarray]:
+        """
+        Tokenize a BED file (or RegionSet) block by block (see `iter_region_tokens`).
+
+        :param Union[str, RegionSet] query: Path to a BED file, or a (backed) RegionSet.
+        :param int chunk_size: Number of regions tokenized at a time.
+        :return Iterator[np.ndarray]: The token ids of each block; concatenated, they are the
+            token ids of `encode`.
+        """
+        for _, ids in self.iter_region_tokens(query, chunk_size):
+            yield ids
+
+    def tokenize_to_gtok(
+        self,
+        query: Union[str, RegionSet],
+        gtok_file: str,
+        chunk_size: int = REGIONSET_CHUNK_SIZE,
+    ) -> int:
+        """
+        Tokenize a BED file (or RegionSet) block by block (see `tokenize_stream`), writing the
+        token ids straight to a `.gtok` file.
+
+        :param Union[str, RegionSet] query: Path to a BED file, or a (backed) RegionSet.
+        :param str gtok_file: Path to the `.gtok` file to write.
+        :param int chunk_size: Number of regions tokenized at a time.
+        :return int: Number of tokens written.
+        """
+        return write_gtok_stream(gtok_file, self.tokenize_stream(query, chunk_size), len(self))
+
     def decode(self, query: List[List[int]]) -> List[List[Region]]:
         """
         Decode a list of IDs back to regions.
 
         :param List[List[int]] query: The query to decode.
         """
-        return [self._tokenizer.decode(ids) for ids in query]
+        return [self._index.decode(ids) for ids in query]
 
     def padding_token(self) -> GRegion:
-        return self._tokenizer.padding_token
+        return self._index.decode([self.padding_token_id()])[0]
 
     def padding_token_id(self) -> int:
-        return self._tokenizer.padding_token_id
+        return self._index.special_token_ids["padding"]
 
     def unknown_token(self) -> GRegion:
-        return self._tokenizer.unknown_token
+        return self._index.decode([self.unknown_token_id()])[0]
 
     def unknown_token_id(self) -> int:
-        return self._tokenizer.unknown_token_id
+        return self._index.special_token_ids["unknown"]
 
     def mask_token(self) -> GRegion:
-        return self._tokenizer.mask_token
+        return self._index.decode([self.mask_token_id()])[0]
 
     def mask_token_id(self) -> int:
-        return self._tokenizer.mask_token_id
+        return self._index.special_token_ids["mask"]
 
     def cls_token(self) -> GRegion:
-        return self._tokenizer.cls_token
+        return self._index.decode([self.cls_token_id()])[0]
 
     def cls_token_id(self) -> int:
-        return self._tokenizer.cls_token_id
+        return self._index.special_token_ids["cls"]
 
     def bos_token(self) -> GRegion:
-        return self._tokenizer.bos_token
+        return self._index.decode([self.bos_token_id()])[0]
 
     def bos_token_id(self) -> int:
-        return self._tokenizer.bos_token_id
+        return self._index.special_token_ids["bos"]
 
     def eos_token(self) -> GRegion:
-        return self._tokenizer.eos_token
+        return self._index.decode([self.eos_token_id()])[0]
 
     def eos_token_id(self) -> int:
-        return self._tokenizer.eos_token_id
+        return self._index.special_token_ids["eos"]
 
     def sep_token(self) -> GRegion:
-        return self._tokenizer.sep_token
+        return self._index.decode([self.sep_token_id()])[0]
 
     def sep_token_id(self) -> int:
-        return self._tokenizer.sep_token_id
+        return self._index.special_token_ids["sep"]
 
     def __len__(self):
-        return len(self._tokenizer)
+        return len(self._index)
 
     def __call__(self, query: Union[str, RegionSet]) -> List[List[Region]]:
         if isinstance(query, str) or isinstance(query, RegionSet) or isinstance(query, list):
@@ -197,10 +389,59 @@ class AnnDataTokenizer(Tokenizer):
         :param str universe: The universe to use for tokenization.
         """
         self.verbose = verbose
+        self._universe_path = universe
+        self._gtars_tokenizer = None
         if universe is not None:
-            self._tokenizer: GTreeTokenizer = GTreeTokenizer(universe)
+            self._index = TokenizerIndex.open(universe, lambda: self._tokenizer)
         else:
-            self._tokenizer = None
+            self._index = None
+
+    @property
+    def _tokenizer(self) -> GTreeTokenizer:
+        if self._gtars_tokenizer is None and self._universe_path is not None:
+            self._gtars_tokenizer = GTreeTokenizer(self._universe_path)
+        return self._gtars_tokenizer
+
+    def _read_anndata(self, query: Union[sc.AnnData, str]) -> sc.AnnData:
+        """
+        Get the AnnData object of a query, opening it in backed mode if it is a path to an
+        `.h5ad` file, so that only the cells being encoded are read.
+
+        :param Union[sc.AnnData, str] query: AnnData object or path to an `.h5ad` file.
+        """
+        if isinstance(query, sc.AnnData):
+            return query
+        elif isinstance(query, str):
+            return sc.read_h5ad(query, backed="r")
+        else:
+            raise NotImplementedError("Only AnnData is supported right now.")
+
+    def _anndata_features(self, adata: sc.AnnData) -> RegionSet:
+        """
+        Get the features (`.var` regions) of an AnnData object.
+
+        :param sc.AnnData adata: The AnnData object.
+        """
+        if not all(key in adata.var.columns for key in (CHR_KEY, START_KEY, END_KEY)):
+            raise ValueError(
+                "The AnnData object must have chr, start, and end in the `.var` attribute."
+            )
+        return RegionSet.from_arrays(
+            np.asarray(adata.var[CHR_KEY].astype(str), dtype=object),
+            adata.var[START_KEY].to_numpy(),
+            adata.var[END_KEY].to_numpy(),
+        )
+
+    def feature_token_matrix(self, query: Union[sc.AnnData, str]) -> sp.csr_matrix:
+        """
+        Tokenize the features (`.var` regions) of an AnnData object, once for all cells.
+
+        Row `i` of the result holds the token ids of feature `i` (see `TokenizerIndex.tokenize`).
+
+        :param Union[sc.AnnData, str] query: AnnData object or path to an `.h5ad` file.
+        :return: features by tokens matrix
+        """
+        return self._index.tokenize(self._anndata_features(self._read_anndata(query)))
 
     def _tokenize_anndata(self, adata: sc.AnnData) -> List[List[Region]]:
         """
@@ -249,84 +490,112 @@ class AnnDataTokenizer(Tokenizer):
         Tokenize a Region or RegionSet into the universe
 
         :param Union[Region, RegionSet, sc.AnnData] query: The query to tokenize.
-        :param bool ids_only: Whether to return only the IDs or the full TokenizedRegionSet
-        :param bool as_strings: Whether to return the IDs as strings or ints
         """
-        if isinstance(query, sc.AnnData):
-            adata = query
-        elif isinstance(query, str):
-            adata = sc.read_h5ad(query)
-        else:
-            raise NotImplementedError("Only AnnData is supported right now.")
+        return self.decode(self.encode(query))
 
-        adata_features = [
-            Region(chr, int(start), int(end))
-            for chr, start, end in track(
-                zip(adata.var["chr"], adata.var["start"], adata.var["end"]),
-                total=adata.var.shape[0],
-                description="Extracting regions from AnnData",
-                disable=not self.verbose,
-            )
-        ]
-        features = np.ndarray(len(adata_features), dtype=object)
-        for i, region in enumerate(adata_features):
-            features[i] = region
-        del adata_features
+    def encode(
+        self, query: sc.AnnData, chunk_size: int = ANNDATA_ENCODE_CHUNK_SIZE
+    ) -> List[List[int]]:
+        """
+        Tokenize an AnnData object to IDs.
+
+        Features are tokenized once (see `feature_token_matrix`), then cells are encoded in
+        chunks by gathering the tokens of their nonzero features.
+
+        :param sc.AnnData query: The query to tokenize.
+        :param int chunk_size: Number of cells encoded at a time.
+        """
+        adata = self._read_anndata(query)
+        feature_tokens = self.feature_token_matrix(adata)
 
-        # tokenize
         tokenized = []
-        for row in track(
-            range(adata.shape[0]),
-            total=adata.shape[0],
+        for start in track(
+            range(0, adata.shape[0], chunk_size),
             description="Tokenizing",
             disable=not self.verbose,
         ):
-            _, non_zeros = adata.X[row].nonzero()
-            regions = features[non_zeros]
-            tokenized.append(self._tokenizer.tokenize(regions))
+            tokenized.extend(encode_cells(adata.X[start : start + chunk_size], feature_tokens))
 
         return tokenized
 
-    def encode(self, query: sc.AnnData) -> List[List[int]]:
+    def encode_to_gtok(
+        self,
+        query: Union[sc.AnnData, str],
+        out_dir: str,
+        chunk_size: int = ANNDATA_GTOK_CHUNK_SIZE,
+        num_workers: int = 1,
+    ) -> int:
         """
-        Tokenize an AnnData object to IDs.
-
-        :param sc.AnnData query: The query to tokenize.
+        Tokenize an AnnData object to IDs, writing the tokens of each cell to
+        `<out_dir>/<cell index>.gtok`.
+
+        `.h5ad` files are opened in backed mode and cells are encoded in chunks, in a pool of
+        `num_workers` processes that each read only the cells they encode, so memory use is
+        bounded by the chunk size rather than the number of cells. Finished chunks are marked
+        in the output folder: running the same tokenization again resumes after the chunks
+        already written.
+
+        :param Union[sc.AnnData, str] query: Path to an `.h5ad` file, or AnnData object.
+        :param str out_dir: Folder to write the `.gtok` files to.
+        :param int chunk_size: Number of cells per chunk.
+        :param int num_workers: Number of processes to use.
+        :return int: Number of cells written by this call.
         """
-        if isinstance(query, sc.AnnData):
+        if isinstance(query, str):
+            path = query
+            adata = sc.read_h5ad(path, backed="r")
+        elif isinstance(query, sc.AnnData):
+            path = str(query.filename) if query.isbacked else None
             adata = query
-        elif isinstance(query, str):
-            adata = sc.read_h5ad(query)
         else:
             raise NotImplementedError("Only AnnData is supported right now.")
 
-        adata_features = [
-            Region(chr, int(start), int(end))
-            for chr, start, end in track(
-                zip(adata.var["chr"], adata.var["start"], adata.var["end"]),
-                total=adata.var.shape[0],
-                description="Extracting regions from AnnData",
-                disable=not self.verbose,
+        os.makedirs(os.path.join(out_dir, GTOK_PROGRESS_DIR), exist_ok=True)
+        chunker = AnnDataChunker(adata, chunk_size)
+        n_cells = adata.shape[0]
+        # the chunker counts an empty trailing chunk when chunk_size divides n_cells
+        chunks = [chunk for chunk in range(len(chunker)) if chunk * chunk_size < n_cells]
+        pending = [
+            chunk
+            for chunk in chunks
+            if not os.path.exists(
+                gtok_chunk_marker(
+                    out_dir, chunk * chunk_size, min((chunk + 1) * chunk_size, n_cells)
+                )
             )
         ]
-        features = np.ndarray(len(adata_features), dtype=object)
-        for i, region in enumerate(adata_features):
-            features[i] = region
-        del adata_features
-
-        # tokenize
-        tokenized = []
-        for row in track(
-            range(adata.shape[0]),
-            total=adata.shape[0],
-            description="Tokenizing",
-            disable=not self.verbose,
-        ):
-            _, non_zeros = adata.X[row].nonzero()
-            regions = features[non_zeros]
-            tokenized.append(self._tokenizer.encode(regions))
+        if len(pending) < len(chunks) and pending:
+            _LOGGER.info(f"Resuming tokenization: {len(pending)} chunks left.")
+        feature_tokens = self.feature_token_matrix(adata)
+
+        if num_workers > 1 and len(pending) > 1 and path is not None:
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_gtok_worker,
+                initargs=(feature_tokens,),
+            ) as executor:
+                written = executor.map(
+                    _gtok_worker,
+                    [path] * len(pending),
+                    pending,
+                    [chunk_size] * len(pending),
+                    [out_dir] * len(pending),
+                )
+                return sum(
+                    track(
+                        written,
+                        total=len(pending),
+                        description="Tokenizing",
+                        disable=not self.verbose,
+                    )
+                )
 
-        return tokenized
+        return sum(
+            encode_chunk_to_gtok(chunker, chunk, feature_tokens, out_dir)
+            for chunk in track(
+                pending, total=len(pending), description="Tokenizing", disable=not self.verbose
+            )
+        )
 
     def decode(self, query: List[List[int]]) -> List[List[Region]]:
         """
@@ -334,52 +603,52 @@ class AnnDataTokenizer(Tokenizer):
 
         :param List[List[int]] query: The query to decode.
         """
-        return [self._tokenizer.decode(ids) for ids in query]
+        return [self._index.decode(ids) for ids in query]
 
     def padding_token(self) -> GRegion:
-        return self._tokenizer.padding_token
+        return self._index.decode([self.padding_token_id()])[0]
 
     def padding_token_id(self) -> int:
-        return self._tokenizer.padding_token_id
+        return self._index.special_token_ids["padding"]
 
     def unknown_token(self) -> GRegion:
-        return self._tokenizer.unknown_token
+        return self._index.decode([self.unknown_token_id()])[0]
 
     def unknown_token_id(self) -> int:
-        return self._tokenizer.unknown_token_id
+        return self._index.special_token_ids["unknown"]
 
     def mask_token(self) -> GRegion:
-        return self._tokenizer.mask_token
+        return self._index.decode([self.mask_token_id()])[0]
 
     def mask_token_id(self) -> int:
-        return self._tokenizer.mask_token_id
+        return self._index.special_token_ids["mask"]
 
     def cls_token(self) -> GRegion:
-        return self._tokenizer.cls_token
+        return self._index.decode([self.cls_token_id()])[0]
 
     def cls_token_id(self) -> int:
-        return self._tokenizer.cls_token_id
+        return self._index.special_token_ids["cls"]
 
     def bos_token(self) -> GRegion:
-        return self._tokenizer.bos_token
+        return self._index.decode([self.bos_token_id()])[0]
 
     def bos_token_id(self) -> int:
-        return self._tokenizer.bos_token_id
+        return self._index.special_token_ids["bos"]
 
     def eos_token(self) -> GRegion:
-        return self._tokenizer.eos_token
+        return self._index.decode([self.eos_token_id()])[0]
 
     def eos_token_id(self) -> int:
-        return self._tokenizer.eos_token_id
+        return self._index.special_token_ids["eos"]
 
     def sep_token(self) -> GRegion:
-        return self._tokenizer.sep_token
+        return self._index.decode([self.sep_token_id()])[0]
 
     def sep_token_id(self) -> int:
-        return self._tokenizer.sep_token_id
+        return self._index.special_token_ids["sep"]
 
     def __len__(self):
-        return len(self.universe.regions)
+        return len(self._index)
 
     def __call__(self, query: sc.AnnData) -> List[List[Region]]:
         if isinstance(query, sc.AnnData):
@@ -410,8 +679,9 @@ def hard_tokenization_main(
 ) -> int:
     """Tokenizes raw BED files in parallel.
 
-    This is the main function for hard tokenization. It uses multiple processes to
-    speed up the tokenization process.
+    This is the main function for hard tokenization. Files are tokenized in-process, like
+    `bedtools intersect -a universe_file -b file -u -f fraction`, by a pool of processes
+    sharing the universe. Interrupted runs resume with the files not tokenized yet.
 
     Args:
         src_folder (str): The folder where raw BED files reside.
@@ -423,112 +693,34 @@ def hard_tokenization_main(
             paths) that need to be tokenized. Defaults to None and uses all BED
             files in src_folder.
         num_workers (int, optional): Number of processes used. Defaults to 10.
-        bedtools_path (str, optional): The path to a bedtools binary. Defaults
-            to "bedtools".
-
-    Raises:
-        Exception: No bedtools executable found
+        bedtools_path (str, optional): Unused, bedtools is no longer needed.
+            Kept for compatibility.
 
     Returns:
-        int: 0 when the dst_folder folder has incomplete list of tokenized BED
-            files which should be removed first; 1 when the dst_folder folder
-            has the complete tokenized BED files or the tokenization process
-            succeeds.
+        int: 0 when there are no files to tokenize; 1 when the dst_folder
+            folder has the complete tokenized BED files or the tokenization
+            process succeeds.
     """
     timer = Timer()
     start_time = timer.t()
 
-    file_list_path = os.path.join(dst_folder, "file_list.txt")
     files = os.listdir(src_folder)
     file_count = len(files)
     if file_count == 0:
         print(f"No files in {src_folder}")
         return 0
 
-    os.makedirs(dst_folder, exist_ok=True)
     if file_list is None:  # use all bed files in data_folder
-        # generate a file list
         file_list = files
         print(f"Use all ({file_count}) bed files in {src_folder}")
     else:
-        file_number = len(file_list)
-        print(f"{file_count} bed files in total, use {file_number} of them")
-
-    # check whether all files in file_list are tokenized
-    number = -1
-    if os.path.exists(dst_folder):
-        all_set = set([f.strip() for f in file_list])
-        existing_set = set(os.listdir(dst_folder))
-        not_covered = all_set - existing_set
-        number = len(not_covered)
-    if number == 0 and len(existing_set) == len(all_set):
-        print("Skip tokenization. Using the existing tokenization files")
-        return 1
-    elif len(existing_set) > 0:
-        print(
-            f"Folder {dst_folder} exists with incomplete tokenized files. Please empty/delete the folder first"
-        )
-        return 0
-
-    with open(file_list_path, "w") as f:
-        for file in file_list:
-            f.write(file)
-            f.write("\n")
-
-    if bedtools_path == "bedtools":
-        try:
-            rval = subprocess.call([bedtools_path, "--version"])
-        except Exception:
-            raise Exception("No bedtools executable found")
-        if rval != 0:
-            raise Exception("No bedtools executable found")
+        file_list = [f.strip() for f in file_list]
+        print(f"{file_count} bed files in total, use {len(file_list)} of them")
 
     print(f"Tokenizing {len(file_list)} bed files ...")
+    tokenize_files(src_folder, dst_folder, universe_file, file_list, fraction, num_workers)
 
-    file_count = len(file_list)
-    # split the file_list into several subsets for each worker to process in parallel
-    nworkers = min(int(np.ceil(file_count / 20)), num_workers)
-    if nworkers <= 1:
-        tokenization_args = Namespace(
-            data_folder=src_folder,
-            file_list=file_list_path,
-            token_folder=dst_folder,
-            universe=universe_file,
-            bedtools_path=bedtools_path,
-            fraction=fraction,
-        )
-        hard_tokenization(tokenization_args)
-
-    else:  # multiprocessing
-        dest_folder = os.path.join(dst_folder, "splits")
-        split_file(file_list_path, dest_folder, nworkers)
-        args_arr = []
-        for n in range(nworkers):
-            temp_token_folder = os.path.join(dst_folder, f"batch_{n}")
-            tokenization_args = Namespace(
-                data_folder=src_folder,
-                file_list=os.path.join(dest_folder, f"split_{n}.txt"),
-                token_folder=temp_token_folder,
-                universe=universe_file,
-                bedtools_path=bedtools_path,
-                fraction=fraction,
-            )
-            args_arr.append(tokenization_args)
-        with multiprocessing.Pool(nworkers) as pool:
-            processes = [pool.apply_async(hard_tokenization, args=(param,)) for param in args_arr]
-            _ = [r.get() for r in processes]
-        # move tokenized files in different folders to expr_tokens
-        shutil.rmtree(dest_folder)
-        for param in args_arr:
-            allfiles = os.listdir(param.token_folder)
-            for f in allfiles:
-                shutil.move(
-                    os.path.join(param.token_folder, f),
-                    os.path.join(dst_folder, f),
-                )
-            shutil.rmtree(param.token_folder)
-    os.remove(file_list_path)
-    print(f"Tokenization complete {len(os.listdir(dst_folder))}/{file_count} bed files")
+    print(f"Tokenization complete {len(os.listdir(dst_folder))}/{len(file_list)} bed files")
     elapsed_time = timer.t() - start_time
     print(f"[Tokenization] {time_str(elapsed_time)}/{time_str(timer.t())}")
     return 1
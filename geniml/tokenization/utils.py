@@ -1,12 +1,21 @@
 import os
 import time
-from typing import List
+from typing import Dict, Iterable, List
 
 import numpy as np
 import scanpy as sc
+import scipy.sparse as sp
+from gtars.utils import write_tokens_to_gtok
 from rich.progress import track
 
+from ..const import GTOK_EXT
 from ..io import Region
+from ..io.utils import expand_ranges
+from ..scembed.utils import AnnDataChunker
+from .const import GTOK_MAGIC, GTOK_PROGRESS_DIR, GTOK_U16_FLAG, GTOK_U32_FLAG
+
+# state of the encode_to_gtok worker processes: the feature tokens and the opened files
+_WORKER_STATE: Dict[str, object] = {}
 
 
 class Timer:
@@ -99,3 +108,115 @@ def anndata_to_regionsets(adata: sc.AnnData) -> List[List[Region]]:
             ]
         )
     return regions
+
+
+def encode_cells(X, feature_tokens: sp.csr_matrix) -> List[List[int]]:
+    """
+    Encode cells to token ids by gathering, for every nonzero feature of a cell, the tokens of
+    that feature. Features are visited in the order they are stored in `X`, so the result is
+    the same as tokenizing the regions of every cell's nonzero features.
+
+    :param X: cells by features matrix (dense or sparse), e.g. a slice of `adata.X`
+    :param feature_tokens: features by tokens matrix, with the token ids of every feature in
+        token order (see `AnnDataTokenizer.feature_token_matrix`)
+    :return: token ids of each cell
+    """
+    cells = sp.csr_matrix(X)
+    n_cells = cells.shape[0]
+    nonzero = cells.data != 0
+    rows = np.repeat(np.arange(n_cells), np.diff(cells.indptr))[nonzero]
+    cols = cells.indices[nonzero]
+
+    lo = feature_tokens.indptr[cols]
+    hi = feature_tokens.indptr[cols + 1]
+    _, positions = expand_ranges(lo, hi)
+    tokens = feature_tokens.indices[positions].tolist()
+
+    # boundaries of each cell in the flat token list
+    token_ends = np.concatenate([[0], np.cumsum(hi - lo)])
+    cell_ends = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_cells))])
+    bounds = token_ends[cell_ends].tolist()
+    return [tokens[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def gtok_chunk_marker(out_dir: str, start: int, stop: int) -> str:
+    """
+    Get the path of the file marking a chunk of cells as written to `.gtok` files.
+
+    :param out_dir: output folder of the tokenization
+    :param start: first cell of the chunk
+    :param stop: end (exclusive) of the chunk
+    :return: path to the marker
+    """
+    return os.path.join(out_dir, GTOK_PROGRESS_DIR, f"cells_{start}_{stop}.done")
+
+
+def encode_chunk_to_gtok(
+    chunker: AnnDataChunker, chunk: int, feature_tokens: sp.csr_matrix, out_dir: str
+) -> int:
+    """
+    Encode a chunk of cells and write the tokens of each cell to `<out_dir>/<cell index>.gtok`.
+    The chunk is marked as done once all of its cells are written.
+
+    :param chunker: chunker over the cells (of a backed AnnData object for large files)
+    :param chunk: index of the chunk
+    :param feature_tokens: features by tokens matrix (see `AnnDataTokenizer.feature_token_matrix`)
+    :param out_dir: output folder
+    :return: number of cells written
+    """
+    start = chunk * chunker.chunk_size
+    cells = chunker[chunk]
+    if cells.shape[0] == 0:
+        return 0
+    for offset, tokens in enumerate(encode_cells(cells.X, feature_tokens)):
+        write_tokens_to_gtok(os.path.join(out_dir, f"{start + offset}.{GTOK_EXT}"), tokens)
+
+    with open(gtok_chunk_marker(out_dir, start, start + cells.shape[0]), "w"):
+        pass
+    return cells.shape[0]
+
+
+def _init_gtok_worker(feature_tokens: sp.csr_matrix):
+    """
+    Initialize an encode_to_gtok worker process, sending it the feature tokens once.
+    """
+    _WORKER_STATE["feature_tokens"] = feature_tokens
+
+
+def _gtok_worker(path: str, chunk: int, chunk_size: int, out_dir: str) -> int:
+    """
+    Encode a chunk of cells of an `.h5ad` file in a worker process. Each worker opens the file
+    (in backed mode) once, and reads only the cells of the chunks it is given.
+    """
+    if path not in _WORKER_STATE:
+        _WORKER_STATE[path] = AnnDataChunker(sc.read_h5ad(path, backed="r"), chunk_size)
+    return encode_chunk_to_gtok(
+        _WORKER_STATE[path], chunk, _WORKER_STATE["feature_tokens"], out_dir
+    )
+
+
+def write_gtok_stream(file_path: str, token_chunks: Iterable[np.ndarray], vocab_size: int) -> int:
+    """
+    Write blocks of token ids to a `.gtok` file as they are produced, so the tokens are never
+    held in memory together. The token size (16 or 32 bits) is chosen from the vocabulary size,
+    since it has to be written before the tokens.
+
+    :param file_path: path to the `.gtok` file
+    :param token_chunks: blocks of token ids
+    :param vocab_size: number of tokens of the tokenizer
+    :return: number of tokens written
+    """
+    flag, dtype = (GTOK_U16_FLAG, "<u2") if vocab_size <= 2**16 else (GTOK_U32_FLAG, "<u4")
+    n_tokens = 0
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(GTOK_MAGIC + bytes([flag]))
+            for tokens in token_chunks:
+                f.write(np.asarray(tokens).astype(dtype).tobytes())
+                n_tokens += len(tokens)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return n_tokens
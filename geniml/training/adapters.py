@@ -34,7 +34,7 @@ class CellTypeFineTuneAdapter(L.LightningModule):
         """
         super().__init__(**kwargs)
         self.loss_fn = nn.CosineEmbeddingLoss()
-        self.r2v_model = model._model
+        self.r2v_model = model.model
         self.tokenizer = model.tokenizer
         self._exmodel = model
 
@@ -121,8 +121,8 @@ class MLMAdapter(L.LightningModule):
         self.loss_fn = nn.CrossEntropyLoss()
         # linear layer acts as a classification layer for training
         # but is not used during inference
-        self.linear = nn.Linear(model._model.d_model, model._model.vocab_size)
-        self.r2v_model = model._model
+        self.linear = nn.Linear(model.model.d_model, model.model.vocab_size)
+        self.r2v_model = model.model
         self.tokenizer = model.tokenizer
 
     def forward(self, x: torch.Tensor, mask: torch.Tensor = None) -> torch.Tensor:
@@ -2,12 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
-from functools import cmp_to_key
 
 import numpy as np
 import pyBigWig
 
-from geniml.utils import natural_chr_sort, timer_func
+from geniml.io.chromosomes import sort_chroms
+from geniml.utils import timer_func
 
 
 def get_uni(file, chrom, cutoff=None):
@@ -92,7 +92,7 @@ def cc_universe(cove, file_out, cove_prefix="all", merge=0, filter_size=0, cutof
     chroms = bw_start.chroms()
     bw_start.close()
     chroms_key = list(chroms.keys())
-    chroms_key = sorted(chroms_key, key=cmp_to_key(natural_chr_sort))
+    chroms_key = sort_chroms(chroms_key)
     chroms = {i: chroms[i] for i in chroms_key}
     for chrom in chroms:
         if chroms[chrom] > 0:
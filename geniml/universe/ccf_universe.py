@@ -2,12 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
-from functools import cmp_to_key
 
 import numpy as np
 import pyBigWig
 
-from geniml.utils import natural_chr_sort, timer_func
+from geniml.io.chromosomes import sort_chroms
+from geniml.utils import timer_func
 
 
 def ana_region(reg, start_s, starts, ends, track_val):
@@ -148,7 +148,7 @@ def ccf_universe(cove, file_out, cove_prefix="all"):
     chroms = bw.chroms()
     bw.close()
     chroms_key = list(chroms.keys())
-    chroms_key = sorted(chroms_key, key=cmp_to_key(natural_chr_sort))
+    chroms_key = sort_chroms(chroms_key)
     chroms = {i: chroms[i] for i in chroms_key}
     for chrom in chroms:
         if chroms[chrom] > 0:
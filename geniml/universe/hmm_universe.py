@@ -1,5 +1,4 @@
 import os
-from functools import cmp_to_key
 from logging import getLogger
 
 import numpy as np
@@ -7,7 +6,7 @@ import pyBigWig
 from scipy.stats import nbinom
 
 from ..const import PKG_NAME
-from ..utils import natural_chr_sort
+from ..io.chromosomes import sort_chroms
 from .const import LAMBDAS, TRANSMAT
 from .models import PoissonModel
 from .utils import find_full, predictions_to_bed
@@ -129,7 +128,7 @@ def hmm_universe(
     chroms = bw_start.chroms()
     bw_start.close()
     chroms_key = list(chroms.keys())
-    chroms_key = sorted(chroms_key, key=cmp_to_key(natural_chr_sort))
+    chroms_key = sort_chroms(chroms_key)
     chroms = {i: chroms[i] for i in chroms_key}
     for C in chroms:
         if chroms[C] > 0:
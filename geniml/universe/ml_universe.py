@@ -3,13 +3,13 @@
 
 import importlib.util
 import os
-from functools import cmp_to_key
 
 import numpy as np
 
 from geniml.likelihood.build_model import ModelLH
 
-from ..utils import natural_chr_sort, read_chromosome_from_bw, timer_func
+from ..io.chromosomes import sort_chroms
+from ..utils import read_chromosome_from_bw, timer_func
 from .utils import find_full, predictions_to_bed
 
 package_name = "numba"
@@ -144,6 +144,6 @@ def ml_universe(model_file, cove_folder, cove_prefix, file_out):
     if os.path.isfile(file_out):
         raise Exception(f"File : {file_out} exists")
     lh_model = ModelLH(model_file)
-    chroms = sorted(lh_model.chromosomes_list, key=cmp_to_key(natural_chr_sort))
+    chroms = sort_chroms(lh_model.chromosomes_list)
     for C in chroms:
         make_ml_flexible_universe(lh_model, cove_folder, cove_prefix, C, file_out)
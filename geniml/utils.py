@@ -3,26 +3,17 @@ from time import time
 import numpy as np
 import pyBigWig
 
+from .io.chromosomes import natural_chrom_key
+
 
 def natural_chr_sort(a, b):
-    ac = a.replace("chr", "")
-    ac = ac.split("_")[0]
-    bc = b.replace("chr", "")
-    bc = bc.split("_")[0]
-    if bc.isnumeric() and ac.isnumeric() and bc != ac:
-        if int(bc) < int(ac):
-            return 1
-        elif int(bc) > int(ac):
-            return -1
-        else:
-            return 0
-    else:
-        if b < a:
-            return 1
-        elif a < b:
-            return -1
-        else:
-            return 0
+    """
+    Compare two chromosome names in natural order, for use with `functools.cmp_to_key`. To
+    sort, use `geniml.io.chromosomes.natural_chrom_key` as the sort key instead.
+    """
+    ka = natural_chrom_key(a)
+    kb = natural_chrom_key(b)
+    return (ka > kb) - (ka < kb)
 
 
 def timer_func(func):
@@ -88,7 +88,6 @@ class TestBedshift:
         assert dropped == 100
         bs.reset_bed()
 
-    @pytest.mark.skip("Not implemented yet")
     def test_drop_from_file_zero_rate(self, bs):
         dropped = bs.drop_from_file(os.path.join(SCRIPT_PATH, "test.bed"), 0)
         assert dropped == 0
@@ -1,3 +1,5 @@
+import shutil
+
 import lightning as L
 import pytest
 import scanpy as sc
@@ -15,8 +17,9 @@ from geniml.training.utils import (
 )
 
 
-def test_generate_finetuning_dataset():
-    t = AnnDataTokenizer("tests/data/universe.bed")
+def test_generate_finetuning_dataset(tmp_path):
+    # a copy, so the tokenizer index persisted next to the universe stays out of tests/data
+    t = AnnDataTokenizer(shutil.copy("tests/data/universe.bed", tmp_path))
     adata = sc.read_h5ad("tests/data/pbmc_hg38.h5ad")
 
     pos, neg, pos_labels, neg_labels = generate_fine_tuning_dataset(
@@ -1,11 +1,23 @@
 import os
+import shutil
 
 import genomicranges
+import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
 import pytest
 
+from geniml.io.chromosomes import ChromosomeDictionary, sort_chroms
 from geniml.io.exceptions import BEDFileReadError, GenimlBaseError
-from geniml.io.io import SNP, Maf, Region, RegionSet
+from geniml.io.io import (
+    SNP,
+    BedSet,
+    EmbeddingSet,
+    Maf,
+    Region,
+    RegionSet,
+    RegionSetCollection,
+)
 
 DATA_TEST_FOLDER = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
@@ -18,14 +30,25 @@ DATA_TEST_FOLDER_MAF = os.path.join(DATA_TEST_FOLDER, "maf")
 DATA_TEST_FOLDER_BED_BAD = os.path.join(DATA_TEST_FOLDER, "bed_bad")
 
 ALL_BEDFILE_PATH = [
-    os.path.join(DATA_TEST_FOLDER_BED, x) for x in os.listdir(DATA_TEST_FOLDER_BED)
+    os.path.join(DATA_TEST_FOLDER_BED, x) for x in sorted(os.listdir(DATA_TEST_FOLDER_BED))
+]
+ALL_MAF_PATH = [
+    os.path.join(DATA_TEST_FOLDER_MAF, x) for x in sorted(os.listdir(DATA_TEST_FOLDER_MAF))
 ]
-ALL_MAF_PATH = [os.path.join(DATA_TEST_FOLDER_MAF, x) for x in os.listdir(DATA_TEST_FOLDER_MAF)]
 ALL_BADFILE_BAD_PATH = [
     os.path.join(DATA_TEST_FOLDER_BED_BAD, x) for x in os.listdir(DATA_TEST_FOLDER_BED_BAD)
 ]
 
 
+@pytest.fixture
+def local_copy(tmp_path):
+    """
+    Copy a test file into tmp_path, so the indexes written next to backed files stay out of
+    tests/data.
+    """
+    return lambda path: shutil.copy(path, tmp_path)
+
+
 def test_make_region():
     r = Region("chr1", 0, 100)
     assert r is not None
@@ -52,6 +75,37 @@ def test_make_SNP():
     assert s.strand == "+"
 
 
+def test_chromosome_dictionary():
+    chroms = [
+        "chrX",
+        "chr10",
+        "chr2",
+        "chrUn_KI270302v1",
+        "chr1_KI270706v1_random",
+        "chr1",
+        "chrM",
+    ]
+    assert sort_chroms(chroms) == [
+        "chr1",
+        "chr1_KI270706v1_random",
+        "chr2",
+        "chr10",
+        "chrM",
+        "chrUn_KI270302v1",
+        "chrX",
+    ]
+
+    chrom_dict = ChromosomeDictionary(chroms)
+    assert len(chrom_dict) == 7 and "chr10" in chrom_dict
+    assert chrom_dict.encode(["chr2", "chrX", "chr2"]).tolist() == [2, 0, 2]
+    assert chrom_dict.ranks[chrom_dict.encode(chroms)].tolist() == [6, 3, 2, 5, 1, 0, 4]
+    assert chrom_dict.compare("chr10", "chr9") == 1
+    assert chrom_dict.compare("chr9", "chr10") == -1
+    assert chrom_dict.compare("chrY", "chrY") == 0
+    assert "chrY" not in chrom_dict and chrom_dict.rank("chrY") == 8
+    assert chrom_dict.sort(["chrY", "chr22", "chr3"]) == ["chr3", "chr22", "chrY"]
+
+
 class TestRegionSet:
     @pytest.mark.parametrize(
         "url",
@@ -69,12 +123,114 @@ class TestRegionSet:
         assert isinstance(region_set.regions[0], Region)
 
     @pytest.mark.parametrize("url", ALL_BEDFILE_PATH)
-    def test_region_set_from_path(self, url):
+    def test_region_set_from_path(self, url, local_copy):
+        url = local_copy(url)
         region_set = RegionSet(url, backed=True)
         for region in region_set:
             assert isinstance(region, Region)
             break
 
+    @pytest.mark.parametrize("path", ALL_BEDFILE_PATH)
+    def test_backed_region_set_random_access(self, path, local_copy):
+        path = local_copy(path)
+        in_memory = RegionSet(path)
+        backed = RegionSet(path, backed=True)
+        assert len(backed) == len(in_memory)
+
+        region = backed[-1]
+        assert (region.chr, region.start, region.end) == (
+            in_memory[-1].chr,
+            in_memory[-1].start,
+            in_memory[-1].end,
+        )
+        assert backed[1:].identifier == in_memory[1:].identifier
+
+    def test_backed_iteration_matches_indexing(self, tmp_path):
+        path = str(tmp_path / "header.bed")
+        with open(path, "w") as f:
+            f.write("chrom\tstart\tend\nchr1\t10\t30\nchr2\t110\t130\n")
+        backed = RegionSet(path, backed=True)
+        iterated = [(r.chr, r.start, r.end) for r in backed]
+        assert iterated == [(backed[i].chr, backed[i].start, backed[i].end) for i in range(2)]
+        assert iterated == [("chr1", 10, 30), ("chr2", 110, 130)]
+
+    @pytest.mark.parametrize("path", ALL_BEDFILE_PATH)
+    def test_regions_in(self, path, local_copy):
+        path = local_copy(path)
+        for backed in (False, True):
+            hits = RegionSet(path, backed=backed).regions_in("chr1", 100, 215)
+            assert [(r.start, r.end) for r in hits] == [(110, 130), (210, 230)]
+
+    def test_overlaps_match_brute_force(self):
+        rng = np.random.default_rng(0)
+        starts = rng.integers(0, 10_000, 500)
+        universe = RegionSet.from_arrays(
+            rng.choice(["chr1", "chr2"], 500), starts, starts + rng.integers(1, 2_000, 500)
+        )
+        starts = rng.integers(0, 10_000, 200)
+        query = RegionSet.from_arrays(
+            rng.choice(["chr1", "chr2", "chr3"], 200), starts, starts + rng.integers(1, 300, 200)
+        )
+
+        hits = (
+            (query.chroms[:, None] == universe.chroms[None, :])
+            & (query.starts[:, None] < universe.ends[None, :])
+            & (query.ends[:, None] > universe.starts[None, :])
+        )
+        query_idx, universe_idx = query.overlaps(universe)
+        assert list(zip(query_idx, universe_idx)) == list(zip(*np.nonzero(hits)))
+        assert query.count_overlaps(universe).tolist() == hits.sum(axis=1).tolist()
+
+    def test_nearest(self):
+        universe = RegionSet.from_arrays(
+            ["chr1", "chr1", "chr1", "chr2"], [100, 300, 1000, 50], [200, 400, 1100, 60]
+        )
+        query = RegionSet.from_arrays(
+            ["chr1", "chr1", "chr1", "chr2", "chr3"],
+            [150, 210, 600, 0, 0],
+            [160, 295, 700, 10, 10],
+        )
+        nearest, distance = query.nearest(universe, return_distance=True)
+        assert nearest.tolist() == [0, 1, 1, 3, -1]
+        assert distance.tolist() == [0, 5, 200, 40, -1]
+
+    def test_sort_and_merge(self):
+        region_set = RegionSet.from_arrays(
+            ["chr10", "chr2", "chrX", "chr2", "chr2", "chr2"],
+            [5, 300, 0, 100, 150, 200],
+            [15, 400, 10, 160, 200, 250],
+        )
+        assert region_set.sort().chroms.tolist() == ["chr2"] * 4 + ["chr10", "chrX"]
+        merged = region_set.merge()
+        assert [(r.chr, r.start, r.end) for r in merged] == [
+            ("chr2", 100, 250),
+            ("chr2", 300, 400),
+            ("chr10", 5, 15),
+            ("chrX", 0, 10),
+        ]
+        assert len(region_set.merge(distance=50)) == 3
+
+    def test_intersect_subtract_complement(self):
+        region_set = RegionSet.from_arrays(["chr1", "chr1", "chr2"], [0, 100, 0], [50, 200, 100])
+        other = RegionSet.from_arrays(["chr1", "chr1", "chr1"], [40, 120, 150], [45, 130, 190])
+
+        assert region_set.intersect(other).starts.tolist() == [0, 100]
+        assert region_set.intersect(other, fraction=0.4).starts.tolist() == [100]
+        assert [(r.start, r.end) for r in region_set.subtract(other)] == [
+            (0, 40),
+            (45, 50),
+            (100, 120),
+            (130, 150),
+            (190, 200),
+            (0, 100),
+        ]
+        complement = region_set.complement({"chr1": 300, "chr2": 100, "chr3": 10})
+        assert [(r.chr, r.start, r.end) for r in complement] == [
+            ("chr1", 50, 100),
+            ("chr1", 200, 300),
+            ("chr3", 0, 10),
+        ]
+
     @pytest.mark.parametrize("path", ALL_BADFILE_BAD_PATH)
     def test_broken_bed_from_path(self, path):
         with pytest.raises(BEDFileReadError):
@@ -114,6 +270,134 @@ class TestRegionSet:
         assert len(bedfile_id_2) == 32
         assert bedfile_id_1 == bedfile_id_2 == bedfile_id_3
 
+    def test_region_set_is_array_backed(self):
+        region_set = RegionSet(os.path.join(DATA_TEST_FOLDER_BED, "s1_a.bed"))
+        assert region_set.starts.tolist() == [10, 110, 210]
+        assert region_set.ends.tolist() == [30, 130, 230]
+        assert region_set.chroms.tolist() == ["chr1", "chr1", "chr1"]
+
+        region = region_set[1]
+        assert isinstance(region, Region)
+        assert (region.chr, region.start, region.end) == ("chr1", 110, 130)
+
+        sliced = region_set[1:]
+        assert isinstance(sliced, RegionSet)
+        assert len(sliced) == 2
+        assert [r.start for r in sliced] == [110, 210]
+
+    def test_region_set_from_arrays(self):
+        region_set = RegionSet.from_arrays(["chr1", "chr2"], [0, 100], [50, 200])
+        regions = [Region("chr1", 0, 50), Region("chr2", 100, 200)]
+        assert len(region_set) == 2
+        assert region_set.identifier == RegionSet(regions).identifier
+
+    @pytest.mark.parametrize("path", ALL_BEDFILE_PATH)
+    def test_binary_round_trip(self, path, tmp_path):
+        region_set = RegionSet(path)
+        binary_path = region_set.save_binary(str(tmp_path / "regions.rsbin"))
+
+        reopened = RegionSet.open_binary(binary_path)
+        assert len(reopened) == len(region_set)
+        assert reopened.identifier == region_set.identifier
+        assert RegionSet(binary_path).identifier == region_set.identifier
+        with pytest.raises(ValueError):
+            RegionSet(binary_path, backed=True)
+
+    def test_binary_cache_sidecar(self, tmp_path):
+        bed_path = str(tmp_path / "s1_a.bed")
+        with open(os.path.join(DATA_TEST_FOLDER_BED, "s1_a.bed")) as src, open(
+            bed_path, "w"
+        ) as dst:
+            dst.write(src.read())
+
+        region_set = RegionSet(bed_path, binary_cache=True)
+        assert os.path.exists(bed_path + ".rsbin")
+
+        cached = RegionSet(bed_path, binary_cache=True)
+        assert isinstance(cached.starts, np.memmap)
+        assert cached.identifier == region_set.identifier
+
+    @pytest.mark.parametrize("path", ALL_BEDFILE_PATH)
+    def test_backed_identifier_matches_in_memory(self, path, local_copy):
+        path = local_copy(path)
+        assert RegionSet(path, backed=True).identifier == RegionSet(path).identifier
+
+    @pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+    def test_backed_identifier_line_ends(self, newline, tmp_path):
+        path = tmp_path / "regions.bed"
+        path.write_bytes(newline.join(["chr1\t10\t30", "chr1\t110\t130\tx", ""]).encode())
+        expected = RegionSet.from_arrays(["chr1", "chr1"], [10, 110], [30, 130]).identifier
+        assert RegionSet(str(path), backed=True).identifier == expected
+
+    def test_identifier_skips_header_row(self, tmp_path):
+        path = str(tmp_path / "header.bed")
+        with open(path, "w") as f:
+            f.write("chrom\tstart\tend\nchr1\t10\t30\nchr1\t110\t130\n")
+        expected = RegionSet(path).identifier
+        assert RegionSet(path, backed=True).identifier == expected
+
+        bedset = BedSet([path, ALL_BEDFILE_PATH[0]])
+        assert bedset.compute_bed_identifiers()[0] == expected
+        fresh_identifier = BedSet([path, ALL_BEDFILE_PATH[0]]).identifier
+        loaded = BedSet([path, ALL_BEDFILE_PATH[0]])
+        loaded[0]
+        assert loaded.identifier == fresh_identifier
+
+    def test_bedset_identifier_in_parallel(self):
+        serial = BedSet(ALL_BEDFILE_PATH).compute_bedset_identifier()
+        parallel = BedSet(ALL_BEDFILE_PATH).compute_bedset_identifier(workers=2)
+        assert serial == parallel
+
+    def test_bedset_is_lazy(self):
+        bedset = BedSet(ALL_BEDFILE_PATH, cache_size=2)
+        assert len(bedset._cache) == 0
+        identifiers = [RegionSet(path).identifier for path in ALL_BEDFILE_PATH]
+        assert bedset.compute_bed_identifiers() == identifiers
+        assert len(bedset._cache) == 0
+
+        for region_set in bedset:
+            assert isinstance(region_set, RegionSet)
+            assert len(bedset._cache) <= 2
+        assert [region_set.identifier for region_set in bedset] == identifiers
+
+    @pytest.mark.parametrize("path", ALL_BEDFILE_PATH)
+    def test_iter_chunks(self, path, local_copy):
+        path = local_copy(path)
+        in_memory = RegionSet(path)
+        for backed in (False, True):
+            region_set = RegionSet(path, backed=backed)
+            chunks = list(region_set.iter_chunks(2))
+            assert all(len(starts) <= 2 for _, starts, _ in chunks)
+            chrom_codes, starts, ends = (np.concatenate(column) for column in zip(*chunks))
+            assert region_set.chrom_names[chrom_codes].tolist() == in_memory.chroms.tolist()
+            assert starts.tolist() == in_memory.starts.tolist()
+            assert ends.tolist() == in_memory.ends.tolist()
+
+        bedset_regions = sum(
+            len(starts) for _, (_, starts, _) in BedSet([path, path]).iter_chunks()
+        )
+        assert bedset_regions == 2 * len(in_memory)
+
+    def test_bedset_region_sets(self):
+        bedset = BedSet(ALL_BEDFILE_PATH[:2])
+        assert isinstance(bedset.region_sets, tuple)
+        assert [rs.identifier for rs in bedset.region_sets] == bedset.compute_bed_identifiers()
+        with pytest.raises(AttributeError):
+            bedset.region_sets.append(RegionSet(ALL_BEDFILE_PATH[2]))
+
+        bedset.add(RegionSet(ALL_BEDFILE_PATH[2]))
+        assert len(bedset.region_sets) == 3
+        bedset.region_sets = [ALL_BEDFILE_PATH[0]]
+        assert len(bedset) == 1
+        assert bedset.identifier == BedSet(ALL_BEDFILE_PATH[:1]).identifier
+
+    def test_bedset_load_all(self):
+        bedset = BedSet(ALL_BEDFILE_PATH, cache_size=1).load_all(workers=2)
+        assert len(bedset._cache) == len(ALL_BEDFILE_PATH)
+        assert [len(region_set) for region_set in bedset] == [
+            len(RegionSet(path)) for path in ALL_BEDFILE_PATH
+        ]
+
     @pytest.mark.parametrize("url", ALL_BEDFILE_PATH)
     def test_to_df(self, url):
         region_set = RegionSet(url, backed=False)
@@ -121,12 +405,34 @@ class TestRegionSet:
         assert isinstance(pandas_df, pd.DataFrame)
 
     @pytest.mark.parametrize("url", ALL_BEDFILE_PATH)
-    def test_to_df_backed(self, url):
+    def test_to_df_backed(self, url, local_copy):
+        url = local_copy(url)
         region_set = RegionSet(url, backed=True)
         pandas_df = region_set.to_pandas()
         assert isinstance(pandas_df, pd.DataFrame)
 
 
+class TestRegionSetCollection:
+    def test_collection_from_globs(self, tmp_path):
+        collection = RegionSetCollection(
+            file_globs=[os.path.join(DATA_TEST_FOLDER_BED, "*.bed")], cache_size=1
+        )
+        assert len(collection) == len([path for path in ALL_BEDFILE_PATH if path.endswith(".bed")])
+        assert len(collection._cache) == 0
+
+        manifest_path = collection.save_manifest(os.path.join(tmp_path, "manifest.tsv"))
+        reloaded = RegionSetCollection.from_manifest(manifest_path)
+        assert reloaded._bed_identifiers == collection.compute_bed_identifiers()
+
+    def test_collection_to_parquet(self, tmp_path):
+        collection = RegionSetCollection(ALL_BEDFILE_PATH)
+        dataset_path = collection.to_parquet(os.path.join(tmp_path, "dataset"), workers=2)
+        table = ds.dataset(dataset_path).to_table()
+        assert table.column_names == ["file_id", "chrom", "start", "end"]
+        assert table.num_rows == sum(len(RegionSet(path)) for path in ALL_BEDFILE_PATH)
+        assert collection.to_arrow().num_rows == table.num_rows
+
+
 class TestMaff:
     @pytest.mark.parametrize("path", ALL_MAF_PATH)
     def test_maf_from_path(self, path):
@@ -140,7 +446,9 @@ class TestMaff:
     def test_read_maf_file_backed(
         self,
         path: str,
+        local_copy,
     ):
+        path = local_copy(path)
         snps = Maf(path, backed=True)
         assert snps is not None
         assert len(snps) == 99
@@ -156,3 +464,79 @@ class TestMaff:
         for snp in snps:
             assert isinstance(snp, SNP)
             assert isinstance(snp.to_region(), Region)
+
+    @pytest.mark.parametrize("path", ALL_MAF_PATH)
+    def test_backed_maf_random_access(self, path: str, local_copy):
+        path = local_copy(path)
+        snps = Maf(path)
+        backed = Maf(path, backed=True)
+        for i in (0, 42, -1):
+            assert (backed[i].chr, backed[i].start, backed[i].end, backed[i].hugo_symbol) == (
+                snps[i].chr,
+                snps[i].start,
+                snps[i].end,
+                snps[i].hugo_symbol,
+            )
+
+    @pytest.mark.parametrize("path", ALL_MAF_PATH)
+    def test_maf_to_region_set(self, path: str):
+        snps = Maf(path)
+        region_set = snps.to_region_set()
+        assert isinstance(region_set, RegionSet)
+        assert [(r.chr, r.start, r.end) for r in region_set] == [
+            (snp.to_region().chr, snp.to_region().start, snp.to_region().end) for snp in snps
+        ]
+
+
+class TestEmbeddingSet:
+    def test_save_open_gather(self, tmp_path):
+        embeddings = np.random.rand(10, 4).astype(np.float32)
+        identifiers = [f"bed{i}" for i in range(10)]
+        path = EmbeddingSet(embeddings, labels=list("abcdefghij"), identifiers=identifiers).save(
+            os.path.join(tmp_path, "embeddings")
+        )
+
+        embedding_set = EmbeddingSet.open(path)
+        assert isinstance(embedding_set.embeddings, np.memmap)
+        assert embedding_set.labels == list("abcdefghij")
+        assert np.array_equal(embedding_set.gather(["bed7", "bed2"]), embeddings[[7, 2]])
+        assert isinstance(embedding_set[2:5].embeddings, np.memmap)
+        with pytest.raises(KeyError):
+            embedding_set.gather(["missing"])
+
+    def test_gather_duplicated_identifiers(self, tmp_path):
+        embeddings = np.arange(8, dtype=np.float32).reshape(4, 2)
+        embedding_set = EmbeddingSet(embeddings, identifiers=["a", "b", "a", "c"])
+        embedding_set.append(np.full((1, 2), 9, dtype=np.float32), identifiers=["b"])
+        assert np.array_equal(embedding_set.gather(["c", "a", "b"]), embeddings[[3, 0, 1]])
+
+        reopened = EmbeddingSet.open(embedding_set.save(os.path.join(tmp_path, "embeddings")))
+        assert np.array_equal(reopened.gather(["a", "b"]), embeddings[[0, 1]])
+        with pytest.raises(KeyError):
+            reopened.gather(["d"])
+
+    def test_save_to_own_store(self, tmp_path):
+        embeddings = np.random.rand(5, 4).astype(np.float32)
+        path = EmbeddingSet(embeddings).save(os.path.join(tmp_path, "embeddings"))
+
+        # the vectors are memory-mapped from the file being overwritten
+        embedding_set = EmbeddingSet.open(path)
+        embedding_set.save(path, dtype="float16")
+
+        reopened = EmbeddingSet.open(path)
+        assert reopened.embeddings.dtype == np.float16
+        assert np.allclose(reopened.embeddings, embeddings, atol=1e-3)
+        assert np.allclose(embedding_set.embeddings, embeddings)
+
+    def test_append_to_store(self, tmp_path):
+        path = EmbeddingSet(np.zeros((2, 3)), labels=["x", "y"]).save(
+            os.path.join(tmp_path, "embeddings"), dtype="float16"
+        )
+        embedding_set = EmbeddingSet.open(path)
+        embedding_set.append(np.ones((3, 3)), labels=["a", "b", "c"])
+
+        reopened = EmbeddingSet.open(path)
+        assert reopened.embeddings.dtype == np.float16
+        assert reopened.embeddings.shape == (5, 3)
+        assert reopened.labels == ["x", "y", "a", "b", "c"]
+        assert np.array_equal(reopened.gather(["4"]), np.ones((1, 3)))
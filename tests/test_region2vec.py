@@ -1,18 +1,22 @@
 import os
+import shutil
 
 import numpy as np
 import pytest
 import torch
 
 from geniml.io.io import Region, RegionSet
+from geniml.region2vec.corpus import TokenCorpus
+from geniml.region2vec.embedding_table import EmbeddingTable
 from geniml.region2vec.main import Region2Vec, Region2VecExModel
 from geniml.region2vec.utils import Region2VecDataset
 from geniml.tokenization.main import TreeTokenizer
 
 
 @pytest.fixture
-def universe_file():
-    return "tests/data/universe.uniq.bed"
+def universe_file(tmp_path):
+    # a copy, so the tokenizer index persisted next to the universe stays out of tests/data
+    return shutil.copy("tests/data/universe.uniq.bed", tmp_path)
 
 
 def test_init_region2vec():
@@ -31,6 +35,24 @@ def test_make_region2vec_dataset():
     assert all([isinstance(x, int) for x in first])
 
 
+def test_pack_region2vec_dataset(tmp_path):
+    dataset = Region2VecDataset("tests/data/gtok_sample/", shuffle=False)
+    packed = dataset.pack(str(tmp_path / "corpus.r2vcorpus"))
+    assert isinstance(packed._corpus, TokenCorpus)
+    assert isinstance(packed._corpus.tokens, np.memmap)
+    assert len(packed) == len(dataset)
+    assert list(packed) == list(dataset)
+    assert packed[1] == dataset[1]
+
+    # tokens are shuffled within region sets, reproducibly
+    shuffled = list(Region2VecDataset(packed._corpus.path, seed=1, prefetch=1, num_workers=2))
+    assert shuffled == list(Region2VecDataset(packed._corpus.path, seed=1))
+    assert [sorted(tokens) for tokens in shuffled] == [sorted(tokens) for tokens in dataset]
+
+    as_str = Region2VecDataset(packed._corpus.path, shuffle=False, convert_to_str=True)
+    assert next(iter(as_str)) == [str(token) for token in dataset[0]]
+
+
 @pytest.mark.skip(reason="Model is too big to download in the runner, takes too long.")
 def test_pretrained_model():
     model = Region2VecExModel("databio/r2v-ChIP-atlas-hg38-v2")
@@ -80,6 +102,34 @@ def test_r2v_pytorch_exmodel_train(universe_file: str):
     assert loss
 
 
+def test_r2v_pytorch_exmodel_train_packed(universe_file: str, tmp_path):
+    model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+    dataset = Region2VecDataset("tests/data/gtok_sample/", convert_to_str=True)
+    dataset = dataset.pack(str(tmp_path / "corpus.r2vcorpus"))
+
+    assert model.train(dataset, epochs=2, min_count=1)
+
+
+def test_r2v_pytorch_exmodel_train_checkpoints(universe_file: str, tmp_path):
+    from gensim.models import Word2Vec as GensimWord2Vec
+
+    model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+    dataset = Region2VecDataset("tests/data/gtok_sample/", convert_to_str=True)
+    model.train(dataset, epochs=2, min_count=1, save_checkpoint_path=str(tmp_path))
+
+    # the trained vectors are copied to the rows of their tokens
+    wv = GensimWord2Vec.load(str(tmp_path / "epoch_2.model")).wv
+    ids = [int(key) for key in wv.index_to_key]
+    weights = model.model.projection.weight.detach().numpy()
+    assert np.allclose(weights[ids], wv.vectors)
+
+    # torch checkpoints load without gensim
+    loaded = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+    loaded.load_checkpoint(str(tmp_path / "epoch_2.pt"))
+    assert loaded.trained
+    assert np.allclose(loaded.model.projection.weight.detach().numpy()[ids], weights[ids])
+
+
 def test_r2v_pytorch_encode(universe_file: str):
     model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
     assert model is not None
@@ -97,7 +147,87 @@ def test_r2v_pytorch_encode(universe_file: str):
     assert embedding.shape == (13, 100)
 
 
-def test_save_load_pytorch_exmodel(universe_file: str):
+@pytest.mark.parametrize("pooling", ["mean", "max"])
+def test_r2v_pytorch_encode_batched(universe_file: str, pooling: str):
+    model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+    rs = RegionSet("tests/data/to_tokenize.bed")
+
+    # pooling every region on its own gives the same embeddings, whatever the batch size
+    tokens = model.tokenizer.region_tokens(rs)
+    expected = []
+    for i in range(len(rs)):
+        ids = torch.tensor(tokens.indices[tokens.indptr[i] : tokens.indptr[i + 1]])
+        embeddings = model._model.projection(ids)
+        pooled = embeddings.mean(axis=0) if pooling == "mean" else embeddings.max(axis=0)[0]
+        expected.append(pooled.detach().numpy())
+    expected = np.vstack(expected)
+
+    for batch_size in [1, 4, 100]:
+        embedding = model.encode(rs, pooling=pooling, batch_size=batch_size)
+        assert embedding.dtype == np.float32
+        assert np.allclose(embedding, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_r2v_pytorch_encode_regionsets(universe_file: str, workers: int, tmp_path):
+    model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+    paths = ["tests/data/to_tokenize.bed", "tests/data/to_tokenize2.bed", "tests/data/s1_a.bed"]
+    empty = tmp_path / "empty.bed"
+    empty.write_text("")
+
+    embeddings = model.encode_regionsets(
+        [*paths, RegionSet(paths[0]), str(empty)], workers=workers, chunk_size=3
+    )
+    assert embeddings.shape == (5, 100)
+    assert embeddings.dtype == np.float32
+    for path, embedding in zip(paths, embeddings):
+        assert np.allclose(embedding, model.encode(RegionSet(path)).mean(axis=0), atol=1e-6)
+    assert np.allclose(embeddings[3], embeddings[0])
+    assert np.isnan(embeddings[4]).all()
+
+
+def test_r2v_pytorch_encode_regionsets_token_cache(universe_file: str, tmp_path):
+    from geniml.search import BED2Vec
+    from geniml.tokenization.cache import TokenCache
+
+    cache = TokenCache(str(tmp_path / "cache"))
+    model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file, cache=cache))
+    path = "tests/data/to_tokenize.bed"
+    expected = model.encode(RegionSet(path)).mean(axis=0)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # BED files share the cache entry of their RegionSet
+    assert np.allclose(BED2Vec(model).forward(path), expected, atol=1e-6)
+    assert np.allclose(model.encode_regionsets([path], chunk_size=3)[0], expected, atol=1e-6)
+    assert (cache.hits, cache.misses) == (2, 1)
+    blocks = list(model.tokenizer.iter_region_tokens(path, chunk_size=3))
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert [len(offsets) - 1 for offsets, _ in blocks] == [3, 3, 3, 3, 1]
+    tokens = model.tokenizer.encode(RegionSet(path))
+    assert np.concatenate([ids for _, ids in blocks]).tolist() == tokens
+
+
+def test_bed2vec_forward_url(universe_file: str):
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+
+    from geniml.search import BED2Vec
+
+    handler = partial(SimpleHTTPRequestHandler, directory="tests/data")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
+        url = f"http://127.0.0.1:{server.server_port}/to_tokenize.bed"
+        embedding = BED2Vec(model).forward(url)
+        assert np.allclose(embedding, model.encode_regionsets(["tests/data/to_tokenize.bed"])[0])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_save_load_pytorch_exmodel(universe_file: str, tmp_path):
     model = Region2VecExModel(tokenizer=TreeTokenizer(universe_file))
     assert model is not None
 
@@ -106,27 +236,53 @@ def test_save_load_pytorch_exmodel(universe_file: str):
 
     before_embedding = model.encode(Region("chr1", 63403166, 63403785))
     assert loss
-    try:
-        # save the model
-        model.export("tests/data/test_model/")
-        assert os.path.exists("tests/data/test_model/checkpoint.pt")
-        assert os.path.exists("tests/data/test_model/universe.bed")
 
-        # load in
-        model_loaded = Region2VecExModel.from_pretrained("tests/data/test_model")
-
-        # the region embeddings should be the same
-        after_embedding = model_loaded.encode(Region("chr1", 63403166, 63403785))
-        assert np.allclose(before_embedding, after_embedding)
+    # save the model
+    export_path = tmp_path / "test_model"
+    model.export(str(export_path))
+    assert os.path.exists(export_path / "checkpoint.pt")
+    assert os.path.exists(export_path / "universe.bed")
+
+    # load in
+    model_loaded = Region2VecExModel.from_pretrained(str(export_path))
+
+    # the region embeddings should be the same
+    after_embedding = model_loaded.encode(Region("chr1", 63403166, 63403785))
+    assert np.allclose(before_embedding, after_embedding)
+
+
+@pytest.mark.parametrize("dtype,atol", [("float32", 1e-6), ("float16", 5e-3), ("int8", 3e-2)])
+def test_export_load_embedding_table(universe_file: str, dtype: str, atol: float, tmp_path):
+    universe = tmp_path / "universe.bed"
+    universe.write_text(open(universe_file).read())
+    model = Region2VecExModel(tokenizer=TreeTokenizer(str(universe)))
+    # exported universes number the unknown token differently, so only embed known regions
+    rs = RegionSet(universe_file)
+    before_embedding = model.encode(rs)
+
+    export_path = tmp_path / "model"
+    model.export(str(export_path), embedding_dtype=dtype)
+    assert not os.path.exists(export_path / "checkpoint.pt")
+
+    model_loaded = Region2VecExModel.from_pretrained(str(export_path))
+    table = model_loaded._embeddings
+    assert isinstance(table, EmbeddingTable)
+    assert isinstance(table.weights, np.memmap)
+    assert table.dtype == dtype
+    assert table.shape == tuple(model.model.projection.weight.shape)
+
+    # lookups are served from the mapped table, without building the model
+    assert np.allclose(model_loaded.encode(rs), before_embedding, atol=atol)
+    assert model_loaded._model is None
+    assert np.allclose(
+        model_loaded.encode_regionsets([rs], workers=2)[0],
+        before_embedding.mean(axis=0),
+        atol=atol,
+    )
 
-    finally:
-        try:
-            os.remove("tests/data/test_model/checkpoint.pt")
-            os.remove("tests/data/test_model/universe.bed")
-            os.remove("tests/data/test_model/config.yaml")
-            os.rmdir("tests/data/test_model/")
-        except Exception as e:
-            # just try to remove it, if it doesn't work, then pass, means something
-            # else wrong occurred up the stack
-            print(e)
-            pass
+    # the model is built from the table when needed
+    assert np.allclose(
+        model_loaded.model.projection.weight.detach().numpy(),
+        model.model.projection.weight.detach().numpy(),
+        atol=atol,
+    )
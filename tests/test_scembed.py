@@ -1,5 +1,6 @@
 import logging
 import os
+import shutil
 import sys
 
 import pytest
@@ -20,8 +21,9 @@ logging.basicConfig(level=logging.INFO)
 
 
 @pytest.fixture
-def universe_file():
-    return "tests/data/universe.bed"
+def universe_file(tmp_path):
+    # a copy, so the tokenizer index persisted next to the universe stays out of tests/data
+    return shutil.copy("tests/data/universe.bed", tmp_path)
 
 
 @pytest.fixture
@@ -58,7 +60,7 @@ def test_model_training(universe_file: str, pbmc_data: sc.AnnData):
     assert model.trained
 
 
-def test_model_train_and_export(universe_file: str):
+def test_model_train_and_export(universe_file: str, tmp_path):
     # remove gensim logging
     logging.getLogger("gensim").setLevel(logging.ERROR)
     model = ScEmbed(tokenizer=AnnDataTokenizer(universe_file))  # set to 1 for testing
@@ -69,17 +71,11 @@ def test_model_train_and_export(universe_file: str):
     assert model.trained
 
     # save
-    try:
-        model.export("tests/data/model-tests")
-        model = ScEmbed.from_pretrained("tests/data/model-tests")
+    model.export(str(tmp_path / "model-tests"))
+    model = ScEmbed.from_pretrained(str(tmp_path / "model-tests"))
 
-        # ensure model is still trained and has region2vec
-        assert model.trained
-
-    finally:
-        os.remove("tests/data/model-tests/checkpoint.pt")
-        os.remove("tests/data/model-tests/universe.bed")
-        os.remove("tests/data/model-tests/config.yaml")
+    # ensure model is still trained and has region2vec
+    assert model.trained
 
 
 @pytest.mark.skip(reason="Need to get a pretrained model first")
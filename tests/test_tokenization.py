@@ -1,8 +1,23 @@
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
 import pytest
 import scanpy as sc
+from gtars.utils import read_tokens_from_gtok
 
-from geniml.io.io import RegionSet
+from geniml.io.exceptions import BinaryFileReadError
+from geniml.io.io import Region, RegionSet
+from geniml.tokenization.bedtools_tokenizer import BEDToolsTokenizer
+from geniml.tokenization.benchmark import compare_results, run_benchmark
+from geniml.tokenization.cache import TokenCache
+from geniml.tokenization.const import TOKEN_CACHE_ENV
+from geniml.tokenization.hard_tokenization_batch import tokenize_files
+from geniml.tokenization.index import TokenizerIndex, tokenizer_index_path
 from geniml.tokenization.main import AnnDataTokenizer, TreeTokenizer
+from geniml.tokenization.utils import gtok_chunk_marker
 
 
 @pytest.fixture
@@ -16,8 +31,9 @@ def pbmc_data_backed():
 
 
 @pytest.fixture
-def universe_bed_file():
-    return "tests/data/universe.uniq.bed"
+def universe_bed_file(tmp_path):
+    # a copy, so the tokenizer index persisted next to the universe stays out of tests/data
+    return shutil.copy("tests/data/universe.uniq.bed", tmp_path)
 
 
 def test_create_universe(universe_bed_file: str):
@@ -90,3 +106,326 @@ def test_tokenize_anndata(universe_bed_file: str):
 
     # count tokens
     assert len(tokens) == 20
+
+
+def test_anndata_tokenizer_uses_index(universe_bed_file: str):
+    # builds and persists the index of the universe
+    tree = TreeTokenizer(universe_bed_file)
+    t = AnnDataTokenizer(universe_bed_file)
+    assert len(t) == len(tree)
+    for name in ["padding", "unknown", "mask", "cls", "bos", "eos", "sep"]:
+        token = getattr(t, f"{name}_token")()
+        assert str(token) == str(getattr(tree, f"{name}_token")())
+    assert t._gtars_tokenizer is None
+
+
+def test_encode_anndata_matches_tree_tokenizer(universe_bed_file: str, pbmc_data: sc.AnnData):
+    t = AnnDataTokenizer(universe_bed_file)
+
+    feature_tokens = t.feature_token_matrix(pbmc_data)
+    assert feature_tokens.shape == (pbmc_data.shape[1], len(t))
+
+    features = [
+        Region(chr, int(start), int(end))
+        for chr, start, end in zip(
+            pbmc_data.var["chr"], pbmc_data.var["start"], pbmc_data.var["end"]
+        )
+    ]
+    expected = [
+        t._tokenizer.encode([features[i] for i in pbmc_data.X[row].nonzero()[1]])
+        for row in range(pbmc_data.shape[0])
+    ]
+    assert t.encode(pbmc_data, chunk_size=7) == expected
+
+
+def test_encode_backed_anndata(universe_bed_file: str, pbmc_data, pbmc_data_backed):
+    t = AnnDataTokenizer(universe_bed_file)
+    assert t.encode(pbmc_data_backed) == t.encode(pbmc_data)
+
+
+def test_encode_to_gtok(universe_bed_file: str, pbmc_data, tmp_path):
+    t = AnnDataTokenizer(universe_bed_file)
+    expected = t.encode(pbmc_data)
+
+    out_dir = str(tmp_path / "tokens")
+    written = t.encode_to_gtok("tests/data/pbmc_hg38.h5ad", out_dir, chunk_size=7, num_workers=2)
+    assert written == pbmc_data.shape[0]
+    for i, tokens in enumerate(expected):
+        assert read_tokens_from_gtok(os.path.join(out_dir, f"{i}.gtok")) == tokens
+
+    # finished chunks are skipped when resuming
+    assert t.encode_to_gtok("tests/data/pbmc_hg38.h5ad", out_dir, chunk_size=7) == 0
+    os.remove(gtok_chunk_marker(out_dir, 14, 20))
+    assert t.encode_to_gtok("tests/data/pbmc_hg38.h5ad", out_dir, chunk_size=7) == 6
+
+
+def test_encode_to_gtok_whole_chunks(universe_bed_file: str, tmp_path, caplog):
+    t = AnnDataTokenizer(universe_bed_file)
+    out_dir = str(tmp_path / "tokens")
+    # 20 cells: the chunker counts an empty third chunk
+    with caplog.at_level(logging.INFO):
+        assert t.encode_to_gtok("tests/data/pbmc_hg38.h5ad", out_dir, chunk_size=10) == 20
+    assert "Resuming" not in caplog.text
+
+    os.remove(gtok_chunk_marker(out_dir, 10, 20))
+    with caplog.at_level(logging.INFO):
+        assert t.encode_to_gtok("tests/data/pbmc_hg38.h5ad", out_dir, chunk_size=10) == 10
+    assert "Resuming tokenization: 1 chunks left." in caplog.text
+
+
+@pytest.mark.parametrize("fraction", [1e-9, 0.5])
+def test_hard_tokenization(universe_bed_file: str, tmp_path, fraction: float):
+    src_folder = "tests/data/to_tokenize"
+    token_folder = str(tmp_path / "tokens")
+    files = sorted(os.listdir(src_folder))
+
+    assert tokenize_files(src_folder, token_folder, universe_bed_file, files, fraction, 2) == len(
+        files
+    )
+
+    # brute force `bedtools intersect -a universe -b file -u -f fraction`
+    with open(universe_bed_file) as f:
+        universe = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+    for name in files:
+        with open(os.path.join(src_folder, name)) as f:
+            query = [line.split("\t")[:3] for line in f if line.strip()]
+        expected = [
+            "\t".join(u)
+            for u in universe
+            if any(
+                q[0] == u[0]
+                and min(int(q[2]), int(u[2])) - max(int(q[1]), int(u[1]))
+                >= max(fraction * (int(u[2]) - int(u[1])), 1e-12)
+                for q in query
+            )
+        ]
+        with open(os.path.join(token_folder, name)) as f:
+            assert f.read().splitlines() == expected
+
+    # tokenized files are recorded in the manifest, and skipped
+    assert tokenize_files(src_folder, token_folder, universe_bed_file, files, fraction) == 0
+    os.remove(os.path.join(token_folder, files[0]))
+    assert tokenize_files(src_folder, token_folder, universe_bed_file, files, fraction) == 1
+
+
+def test_token_cache(universe_bed_file: str, tmp_path):
+    cache = TokenCache(str(tmp_path / "cache"))
+    t = TreeTokenizer(universe_bed_file, cache=cache)
+    rs = RegionSet("tests/data/to_tokenize.bed")
+
+    tokens = t.encode(rs)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert (rs.identifier, t.universe_identifier) in cache
+    assert t.encode(RegionSet("tests/data/to_tokenize.bed")) == tokens
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert tokens == TreeTokenizer(universe_bed_file, cache=False).encode(rs)
+
+    # least recently used entries are evicted first
+    other = RegionSet("tests/data/to_tokenize2.bed")
+    t.encode(other)
+    t.encode(rs)
+    cache.evict(cache.size - 1)
+    assert len(cache) == 1 and (rs.identifier, t.universe_identifier) in cache
+
+
+def test_tokenizer_index(tmp_path):
+    # this universe has duplicated regions, which share a token
+    universe = str(tmp_path / "universe.bed")
+    shutil.copy("tests/data/universe.bed", universe)
+    rs = RegionSet("tests/data/to_tokenize2.bed")
+
+    t = TreeTokenizer(universe, cache=False)
+    index_path = tokenizer_index_path(universe)
+    assert os.path.exists(index_path)
+    assert t.encode(rs) == t._tokenizer(rs).to_ids()
+    assert len(t) == len(t._tokenizer)
+    assert [str(r) for r in t.decode([[0, t.unknown_token_id()]])[0]] == [
+        str(r) for r in t._tokenizer.decode([0, t.unknown_token_id()])
+    ]
+
+    # the persisted index is reused, without building the gtars tokenizer
+    reloaded = TreeTokenizer(universe, cache=False)
+    assert reloaded._gtars_tokenizer is None
+    assert reloaded.encode(rs) == t.encode(rs)
+    assert reloaded.universe_identifier == t.universe_identifier
+
+    # corrupted indexes are detected and rebuilt
+    with open(index_path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"\xff" * 8)
+    with pytest.raises(BinaryFileReadError):
+        TokenizerIndex.load(index_path)
+    rebuilt = TreeTokenizer(universe, cache=False)
+    assert rebuilt.encode(rs) == t.encode(rs)
+    assert TokenizerIndex.load(index_path).identifier == t.universe_identifier
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_tokenizer_index_matches_gtars(seed: int, tmp_path):
+    # many universe regions share a start, so tokens are also ordered by end
+    rng = np.random.default_rng(seed)
+    universe = str(tmp_path / "universe.bed")
+    starts = rng.integers(0, 5_000, 5_000) * 10
+    ends = starts + rng.integers(1, 400, len(starts))
+    chroms = rng.choice(["chr1", "chr2", "chr3"], len(starts))
+    with open(universe, "w") as f:
+        f.writelines(f"{c}\t{s}\t{e}\n" for c, s, e in zip(chroms, starts, ends))
+
+    query_starts = rng.integers(0, 50_000, 2_000)
+    rs = RegionSet.from_arrays(
+        rng.choice(["chr1", "chr2", "chr3", "chr4"], len(query_starts)),
+        query_starts,
+        query_starts + rng.integers(1, 600, len(query_starts)),
+    )
+    t = TreeTokenizer(universe)
+    assert t.encode(rs) == t._tokenizer(rs).to_ids()
+
+
+@pytest.mark.parametrize(
+    "bed_file",
+    ["tests/data/to_tokenize2.bed", "tests/data/io_data/bed/s1_a.bed.gz"],
+)
+def test_tokenize_stream(universe_bed_file: str, bed_file: str, tmp_path):
+    # backed RegionSets write an index next to the file
+    bed_file = shutil.copy(bed_file, tmp_path)
+    t = TreeTokenizer(universe_bed_file, cache=False)
+    tokens = t.encode(RegionSet(bed_file))
+
+    blocks = list(t.tokenize_stream(bed_file, chunk_size=2))
+    assert len(blocks) > 1
+    assert [i for block in blocks for i in block.tolist()] == tokens
+    streamed = t.tokenize_stream(RegionSet(bed_file, backed=True), chunk_size=2)
+    assert [i for block in streamed for i in block.tolist()] == tokens
+
+    gtok_file = str(tmp_path / "tokens.gtok")
+    assert t.tokenize_to_gtok(bed_file, gtok_file, chunk_size=2) == len(tokens)
+    assert read_tokens_from_gtok(gtok_file) == tokens
+
+    # binary RegionSet files are memory-mapped, not parsed as text
+    binary_file = RegionSet(bed_file).save_binary(str(tmp_path / "regions.bed.rsbin"))
+    assert t.tokenize_to_gtok(binary_file, gtok_file, chunk_size=2) == len(tokens)
+    assert read_tokens_from_gtok(gtok_file) == tokens
+
+
+@pytest.mark.skipif(shutil.which("bedtools") is None, reason="bedtools is not installed")
+def test_bedtools_tokenizer(tmp_path):
+    universe = "tests/data/universe.bed"
+    files = ["s1_a.bed", "s2_a.bed", "to_tokenize.bed", "to_tokenize2.bed"]
+    tokenizer = BEDToolsTokenizer(universe_path=universe, num_workers=2)
+    results = tokenizer.tokenize(
+        ["tests/data/s[12]_a.bed", "tests/data/to_tokenize*.bed"], str(tmp_path / "bedtools")
+    )
+    assert sorted(os.path.basename(result.input_path) for result in results) == files
+
+    tokenize_files("tests/data", str(tmp_path / "tokens"), universe, files, 1e-9)
+    for result in results:
+        with open(result.output_path) as f:
+            tokens = f.read()
+        with open(os.path.join(tmp_path, "tokens", os.path.basename(result.input_path))) as f:
+            assert tokens == f.read()
+        assert result.n_tokens == tokens.count("\n")
+
+
+# stand-in for `bedtools intersect -a <universe> -b stdin -u`: universe lines hit by a query
+FAKE_BEDTOOLS = """
+import sys
+
+universe = sys.argv[sys.argv.index("-a") + 1]
+queries = [line.split("\\t")[:3] for line in sys.stdin.read().splitlines() if line.strip()]
+with open(universe) as f:
+    for line in f:
+        chrom, start, end = line.split("\\t")[:3]
+        if any(q[0] == chrom and int(q[1]) < int(end) and int(start) < int(q[2]) for q in queries):
+            sys.stdout.write(line)
+"""
+
+
+def test_bedtools_tokenizer_output_paths(tmp_path):
+    bedtools = tmp_path / "bedtools"
+    bedtools.write_text(f"#!{sys.executable}\n{FAKE_BEDTOOLS}")
+    bedtools.chmod(0o755)
+    universe = tmp_path / "universe.bed"
+    universe.write_text("chr1\t0\t100\nchr1\t200\t300\nchr2\t0\t100\n")
+    for folder, regions in [("a", ["chr1\t10\t20"]), ("b", ["chr1\t10\t20", "chr2\t5\t6"])]:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "x.bed").write_text("".join(f"{r}\n" for r in regions))
+
+    # files with the same name in different folders get their own output
+    tokenizer = BEDToolsTokenizer(str(bedtools), str(universe), num_workers=2)
+    results = tokenizer.tokenize([str(tmp_path / "*" / "x.bed")], str(tmp_path / "tokens"))
+    n_tokens = {
+        os.path.relpath(result.output_path, tmp_path): result.n_tokens for result in results
+    }
+    assert n_tokens == {
+        os.path.join("tokens", "a", "x.bed"): 1,
+        os.path.join("tokens", "b", "x.bed"): 2,
+    }
+    with open(tmp_path / "tokens" / "b" / "x.bed") as f:
+        assert f.read() == "chr1\t0\t100\nchr2\t0\t100\n"
+
+    # patterns that map files to the same output are rejected
+    with pytest.raises(ValueError):
+        tokenizer.tokenize(
+            [str(tmp_path / "a" / "*.bed"), str(tmp_path / "b" / "*.bed")], str(tmp_path / "out")
+        )
+
+
+def test_benchmark(tmp_path):
+    report = run_benchmark(
+        ["tree", "gtars", "anndata"],
+        workdir=str(tmp_path),
+        universe_size=2_000,
+        query_size=500,
+        n_cells=20,
+        n_features=200,
+        repeat=1,
+        isolate=False,
+    )
+    assert [result["implementation"] for result in report["results"]] == [
+        "tree",
+        "gtars",
+        "anndata",
+    ]
+    assert report["config"]["universe_size"] == 2_000
+    assert report["results"][0]["n_regions"] == 500
+    assert all(result["regions_per_second"] > 0 for result in report["results"])
+
+    faster = {
+        "results": [
+            dict(result, regions_per_second=result["regions_per_second"] * 2)
+            for result in report["results"]
+        ]
+    }
+    assert compare_results(report, report) == []
+    assert len(compare_results(report, faster)) == 3
+
+
+def test_benchmark_keeps_given_universe(universe_bed_file: str, tmp_path):
+    index_path = tokenizer_index_path(universe_bed_file)
+    TreeTokenizer(universe_bed_file)
+    index_mtime = os.stat(index_path).st_mtime_ns
+
+    workdir = tmp_path / "work"
+    run_benchmark(
+        ["tree"],
+        universe=universe_bed_file,
+        workdir=str(workdir),
+        query_size=50,
+        repeat=1,
+        isolate=False,
+    )
+    assert os.stat(index_path).st_mtime_ns == index_mtime
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(universe_bed_file), os.path.basename(index_path), "work"]
+    )
+
+
+def test_token_cache_is_opt_in(universe_bed_file: str, tmp_path):
+    assert TreeTokenizer(universe_bed_file).cache is None
+    assert TreeTokenizer(universe_bed_file, cache=str(tmp_path)).cache.folder == str(tmp_path)
+
+
+def test_token_cache_folder_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv(TOKEN_CACHE_ENV, str(tmp_path))
+    assert TokenCache().folder == str(tmp_path)
+    assert TokenCache(str(tmp_path / "other")).folder == str(tmp_path / "other")